@@ -0,0 +1,204 @@
+import argparse
+import logging
+import os
+import sys
+
+from lib.metrics import Metrics, add_metrics_arguments
+
+
+def get_sample_ids(filenames):
+    # The file name without extensions, files with the same name get as many parent
+    # directories as it takes to tell them apart (kraken/readid2taxid.tsv ->
+    # kraken_readid2taxid). None if some are the same file.
+    paths = [os.path.abspath(filename).split(os.sep) for filename in filenames]
+    depths = [1] * len(paths)
+    while True:
+        sample_ids = [
+            "_".join(path[-depth:-1] + [path[-1].split(".")[0]]).lstrip("_")
+            for path, depth in zip(paths, depths)
+        ]
+        repeated = [
+            i
+            for i, sample_id in enumerate(sample_ids)
+            if sample_ids.count(sample_id) > 1
+        ]
+        if not repeated:
+            return sample_ids
+        if all(depths[i] == len(paths[i]) for i in repeated):
+            return None
+        for i in repeated:
+            depths[i] = min(depths[i] + 1, len(paths[i]))
+
+
+def main():
+    # Parse arguments from command line
+    parser = argparse.ArgumentParser(
+        description="Computes the relative abundance profile of the ground truth and each "
+        "classifier at every rank (superkingdom to strain) from their read id to tax id files. "
+        "Outputs a tsv of the L1 and Bray-Curtis distance of each classifier's profile from the "
+        "ground truth's at every rank, and writes the profiles in the CAMI profiling format"
+    )
+    parser.add_argument(
+        "-c",
+        "--clark",
+        dest="clark",
+        action="store_true",
+        help="Read NA tax ids in a tsv as 0",
+    )
+    parser.add_argument(
+        "-i",
+        "--include-header",
+        dest="include_header",
+        action="store_true",
+        help="Prints the header line before the output",
+    )
+    parser.add_argument(
+        "-n",
+        "--names",
+        dest="names",
+        default=None,
+        help="Comma separated names of the ground truth and each classifier, in the order "
+        "of the inputs, used for the distance rows and profile files (default is the file "
+        "name, with its parent directories when file names are the same)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        default=None,
+        help="File to write the distances to (default is stdout)",
+    )
+    parser.add_argument(
+        "-O",
+        "--output-directory",
+        dest="output_directory",
+        default=None,
+        help="Directory to write the CAMI profile of every input to, as "
+        "<name>.profile",
+    )
+    add_metrics_arguments(parser)
+    parser.add_argument(
+        "taxonomy",
+        help="NCBI taxonomy directory or array taxonomy file (taxonomy-arrays.py)",
+    )
+    parser.add_argument(
+        "ground_truth_readid2taxid",
+        help="Read id to tax id (tsv or binary) of minimap2 or other ground truth",
+    )
+    parser.add_argument(
+        "predicted_readid2taxid",
+        nargs="*",
+        help="Read id to tax id (tsv or binary) of each classifier",
+    )
+    args = parser.parse_args()
+    filenames = [args.ground_truth_readid2taxid] + args.predicted_readid2taxid
+    if args.names is not None:
+        sample_ids = args.names.split(",")
+        if len(sample_ids) != len(filenames):
+            parser.error(
+                f"'--names' has {len(sample_ids)} names for {len(filenames)} inputs"
+            )
+        if len(set(sample_ids)) != len(sample_ids):
+            parser.error("'--names' has the same name more than once")
+    else:
+        sample_ids = get_sample_ids(filenames)
+        if sample_ids is None:
+            parser.error(
+                "inputs can't be told apart by their paths, give them '--names'"
+            )
+
+    from lib.abundance import (
+        DISTANCE_COLUMNS,
+        get_levels,
+        get_node_counts,
+        get_rank_rows,
+        profile_distances,
+        roll_up,
+        write_profile,
+    )
+    from lib.arraytaxonomy import get_array_taxonomy
+    from lib.output import BulkWriter
+    from lib.readid2taxid import load_taxids
+
+    # Initialize event logger
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.DEBUG,
+        format="[%(asctime)s %(threadName)s %(levelname)s] %(message)s",
+        datefmt="%m-%d-%Y %I:%M:%S%p",
+    )
+
+    metrics = Metrics(args.metrics, args.profile)
+
+    # Read taxonomy
+    logging.info(f"Reading taxonomy from {args.taxonomy}")
+    with metrics.stage("taxonomy load") as stage:
+        taxonomy = get_array_taxonomy(args.taxonomy)
+        levels = get_levels(taxonomy)
+        rank_rows = get_rank_rows(taxonomy)
+        stage["items"] = len(taxonomy)
+
+    profiles = []
+    profile_files = set()
+    for filename, sample_id in zip(filenames, sample_ids):
+        logging.info(f"Reading readid2taxid at {filename}")
+        with metrics.stage("readid2taxid load") as stage:
+            taxids = load_taxids(filename, args.clark)
+            stage["items"] = len(taxids)
+
+        with metrics.stage("profile") as stage:
+            node_counts, unknown_taxids = get_node_counts(taxonomy, taxids)
+            if len(unknown_taxids) > 0:
+                logging.warning(
+                    f"{len(unknown_taxids)} tax ids of {filename} are not in the taxonomy, "
+                    f"their reads count as unclassified: {unknown_taxids[:10].tolist()}"
+                )
+            totals = roll_up(taxonomy, node_counts, levels)
+            profiles.append((sample_id, totals, len(taxids)))
+            stage["items"] = len(taxids)
+
+        if args.output_directory is not None:
+            os.makedirs(args.output_directory, exist_ok=True)
+            profile_file = os.path.join(args.output_directory, sample_id + ".profile")
+            if os.path.realpath(profile_file) in profile_files:
+                logging.error(f"{profile_file} was already written for another input")
+                sys.exit(1)
+            profile_files.add(os.path.realpath(profile_file))
+            logging.info(f"Writing {profile_file}")
+            with metrics.stage("profile output"):
+                with BulkWriter(profile_file) as out_file:
+                    write_profile(
+                        out_file,
+                        taxonomy,
+                        rank_rows,
+                        totals,
+                        len(taxids),
+                        sample_id,
+                        os.path.basename(os.path.normpath(args.taxonomy)),
+                    )
+
+    with metrics.stage("output") as stage:
+        _, ground_truth_totals, ground_truth_reads = profiles[0]
+        with BulkWriter(args.output) as out_file:
+            if args.include_header:
+                out_file.write_row(*DISTANCE_COLUMNS)
+            for sample_id, totals, total_reads in profiles[1:]:
+                distances = profile_distances(
+                    rank_rows,
+                    ground_truth_totals,
+                    ground_truth_reads,
+                    totals,
+                    total_reads,
+                )
+                for rank, (l1, bray_curtis) in distances.items():
+                    out_file.write_row(
+                        sample_id, rank, f"{l1:.6f}", f"{bray_curtis:.6f}"
+                    )
+        stage["items"] = len(profiles) - 1
+    metrics.close()
+
+    logging.info("Done!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import argparse
+import logging
+import os
+import sys
+
+from lib.metrics import Metrics, add_metrics_arguments
+
+
+def main():
+    # Parse arguments from command line
+    parser = argparse.ArgumentParser(
+        description="Creates and updates an accession index, an accession2taxid that takes "
+        "NCBI's updates and dead accession lists without being rebuilt. Updates are appended "
+        "to a log that is merged into the index once it is large enough. Outputs a tsv of "
+        "accession, old tax id and new tax id (NA if removed) for every accession whose tax id "
+        "changed. Scripts accept the index directory wherever they take an accession2taxid"
+    )
+    parser.add_argument(
+        "-i",
+        "--init",
+        dest="init",
+        default=None,
+        help="Create the index from this accession2taxid",
+    )
+    parser.add_argument(
+        "-a",
+        "--additions",
+        dest="additions",
+        action="append",
+        default=[],
+        help="An accession2taxid of new and changed accessions (can be given several times)",
+    )
+    parser.add_argument(
+        "-r",
+        "--removals",
+        dest="removals",
+        action="append",
+        default=[],
+        help="A list of dead accessions, one per line (can be given several times)",
+    )
+    parser.add_argument(
+        "-c",
+        "--compact",
+        dest="compact",
+        action="store_true",
+        help="Merge the log into the index now instead of when it is large enough",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        default=None,
+        help="File to write the changed accessions to (default is stdout)",
+    )
+    add_metrics_arguments(parser)
+    parser.add_argument("index", help="The accession index directory")
+    args = parser.parse_args()
+
+    from lib.accessionindex import (
+        create_accession_index,
+        is_accession_index,
+        read_accessions,
+        update_accession_index,
+    )
+    from lib.input import open_input
+    from lib.lib import read_accession2taxid
+    from lib.output import BulkWriter
+
+    # Initialize event logger
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.DEBUG,
+        format="[%(asctime)s %(threadName)s %(levelname)s] %(message)s",
+        datefmt="%m-%d-%Y %I:%M:%S%p",
+    )
+
+    metrics = Metrics(args.metrics, args.profile)
+
+    if args.init is not None:
+        logging.info(f"Creating {args.index} from {args.init}")
+        with metrics.stage("create") as stage:
+            with open_input(args.init, "r") as f:
+                accession2taxid = read_accession2taxid(f)
+            create_accession_index(args.index, accession2taxid)
+            stage["items"] = len(accession2taxid)
+    elif not is_accession_index(args.index):
+        logging.error(
+            f"{args.index} is not an accession index, create it with '--init'"
+        )
+        sys.exit(1)
+
+    # Both kinds of update are read completely before anything is applied, an
+    # accession given two tax ids stops the update like it stops loading
+    with metrics.stage("update load") as stage:
+        additions = {}
+        for file in args.additions:
+            logging.info(f"Reading additions from {file}")
+            with open_input(file, "r") as f:
+                read_accession2taxid(f, additions)
+        removals = []
+        for file in args.removals:
+            logging.info(f"Reading removals from {file}")
+            removals.extend(read_accessions(file))
+        stage["items"] = len(additions) + len(removals)
+
+    with metrics.stage("update") as stage:
+        source = ",".join(
+            os.path.basename(file) for file in args.additions + args.removals
+        )
+        changes, records = update_accession_index(
+            args.index, additions, removals, source, args.compact
+        )
+        stage["items"] = records
+    logging.info(
+        f"Appended {records} updates, {len(changes)} accessions changed tax id"
+    )
+
+    with metrics.stage("output") as stage:
+        with BulkWriter(args.output) as out_file:
+            for accession, old_taxid, taxid in changes:
+                out_file.write_row(
+                    accession, old_taxid, "NA" if taxid is None else taxid
+                )
+        stage["items"] = len(changes)
+    metrics.close()
+
+    logging.info("Done!")
+
+
+if __name__ == "__main__":
+    main()
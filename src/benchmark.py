@@ -0,0 +1,413 @@
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+from lib import synthetic
+
+# Inputs are generated once per scale: accessions, SAM reads and readid2taxid reads
+# are 'scale' rows, FASTQ has scale / 10 reads of 1 kbp and FASTA scale / 100
+# sequences of 10 kbp. The taxonomy has '--taxonomy-size' nodes except for the
+# taxonomy benchmark, which loads one of 'scale' nodes.
+SAM_REFERENCES = 10000
+
+
+def generate_inputs(directory, scale, taxonomy_size, seed):
+    rng = random.Random(seed)
+    inputs = {"directory": directory, "scale": scale}
+    os.makedirs(directory, exist_ok=True)
+
+    inputs["taxonomy"] = os.path.join(directory, "taxonomy")
+    taxids_by_rank = synthetic.write_taxonomy(inputs["taxonomy"], taxonomy_size, rng)
+    # Sequences are assigned to species and strains, like real references
+    taxids = taxids_by_rank["species"] + taxids_by_rank["strain"]
+
+    inputs["accession2taxid"] = os.path.join(directory, "accession2taxid")
+    accessions = synthetic.write_accession2taxid(
+        inputs["accession2taxid"], scale, taxids, rng
+    )
+
+    inputs["sam"] = os.path.join(directory, "reads.sam")
+    synthetic.write_sam(inputs["sam"], scale, accessions[:SAM_REFERENCES], rng)
+
+    inputs["fastq"] = os.path.join(directory, "reads.fastq")
+    synthetic.write_fastq(inputs["fastq"], max(1, scale // 10), accessions, rng)
+
+    inputs["fasta"] = os.path.join(directory, "reference.fasta")
+    synthetic.write_fasta(inputs["fasta"], max(1, scale // 100), rng)
+
+    # Half of the sequences make up the classifier's reference
+    reference_accessions = accessions[: max(1, len(accessions) // 2)]
+    inputs["seqid2taxid"] = os.path.join(directory, "seqid2taxid")
+    synthetic.write_seqid2taxid(inputs["seqid2taxid"], reference_accessions)
+
+    inputs["ground_truth"] = os.path.join(directory, "ground_truth.tsv")
+    inputs["predicted"] = os.path.join(directory, "predicted.tsv")
+    synthetic.write_readid2taxid_pair(
+        inputs["ground_truth"],
+        inputs["predicted"],
+        scale,
+        taxids,
+        sorted(set(taxid for _, taxid in reference_accessions)),
+        rng,
+    )
+
+    inputs["scaled_taxonomy"] = os.path.join(directory, "scaled_taxonomy")
+    synthetic.write_taxonomy(inputs["scaled_taxonomy"], scale, rng)
+
+    inputs["lca_rows"] = [
+        (f"read_{index}", rng.choice(taxids))
+        for index in range(scale)
+        for _ in range(rng.randint(1, 3))
+    ]
+    return inputs
+
+
+# Each benchmark does its setup and returns the timed routine, which returns the
+# number of rows it processed
+
+
+def bench_load_accession2taxid(inputs):
+    from lib.lib import load_accession2taxid
+
+    return lambda: len(load_accession2taxid(inputs["accession2taxid"]))
+
+
+def bench_taxonomy_load(inputs):
+    from taxonomy.taxonomy import Taxonomy
+
+    return lambda: len(Taxonomy.from_ncbi(inputs["scaled_taxonomy"]))
+
+
+def bench_readid2taxid_from_sam(inputs):
+    import pysam
+    from taxonomy.taxonomy import Taxonomy
+
+    from lib.lib import load_accession2taxid
+    from lib.pipeline import readid2taxid_from_alignments
+
+    taxonomy = Taxonomy.from_ncbi(inputs["taxonomy"])
+    accession2taxid = load_accession2taxid(inputs["accession2taxid"])
+
+    def run():
+        with pysam.AlignmentFile(inputs["sam"], "r") as alignments:
+            return sum(
+                1
+                for _ in readid2taxid_from_alignments(
+                    alignments, accession2taxid, taxonomy, False
+                )
+            )
+
+    return run
+
+
+def bench_readid2taxid_lca(inputs):
+    from taxonomy.taxonomy import Taxonomy
+
+    from lib.pipeline import batched, collapse_to_lca
+
+    taxonomy = Taxonomy.from_ncbi(inputs["taxonomy"])
+    return lambda: len(collapse_to_lca(batched(inputs["lca_rows"]), taxonomy))
+
+
+def bench_reformat_readid2taxid(inputs):
+    from lib.remap import build_lookup, remap_readid2taxid
+
+    # Every tax id goes through the lookup
+    with open(inputs["predicted"], "r") as f:
+        taxids = set(int(line.split("\t")[1]) for line in f)
+    lookup = build_lookup({taxid: taxid for taxid in taxids})
+
+    def run():
+        with open(inputs["predicted"], "rb") as f, open(os.devnull, "wb") as out_file:
+            return remap_readid2taxid(f, out_file, lookup)
+
+    return run
+
+
+def bench_load_readid2taxid_tsv(inputs):
+    from lib.readid2taxid import load_readid2taxid
+
+    return lambda: len(load_readid2taxid(inputs["ground_truth"])["taxids"])
+
+
+def bench_load_readid2taxid_binary(inputs):
+    from lib.readid2taxid import (
+        load_readid2taxid,
+        write_binary_readid2taxid,
+    )
+
+    binary_file = os.path.join(inputs["directory"], "ground_truth.bin")
+    if not os.path.exists(binary_file):
+        with open(binary_file, "wb") as out_file:
+            write_binary_readid2taxid(
+                load_readid2taxid(inputs["ground_truth"]), out_file
+            )
+    return lambda: len(load_readid2taxid(binary_file)["taxids"])
+
+
+def bench_report_statistics(inputs):
+    from taxonomy.taxonomy import Taxonomy
+
+    from lib.evaluation import (
+        compute_statistics,
+        get_lineages_in_reference,
+        get_taxid_pair_counts,
+    )
+    from lib.readid2taxid import load_readid2taxid
+
+    taxonomy = Taxonomy.from_ncbi(inputs["taxonomy"])
+    ground_truth_table = load_readid2taxid(inputs["ground_truth"])
+    predicted_table = load_readid2taxid(inputs["predicted"])
+
+    def run():
+        reference_lineages, warned = get_lineages_in_reference(
+            inputs["seqid2taxid"], taxonomy, False
+        )
+        compute_statistics(
+            get_taxid_pair_counts(ground_truth_table, predicted_table),
+            reference_lineages,
+            taxonomy,
+            False,
+            False,
+            False,
+            warned,
+        )
+        return len(ground_truth_table["taxids"])
+
+    return run
+
+
+def bench_count_bp_fastq(inputs):
+    from Bio import SeqIO
+
+    return lambda: sum(1 for _ in SeqIO.parse(inputs["fastq"], "fastq"))
+
+
+def bench_count_fasta_bases(inputs):
+    from lib.lib import count_fasta_bases
+
+    # Throughput in bases
+    return lambda: count_fasta_bases(inputs["fasta"])
+
+
+BENCHMARKS = {
+    "load_accession2taxid": bench_load_accession2taxid,
+    "taxonomy_load": bench_taxonomy_load,
+    "readid2taxid_from_sam": bench_readid2taxid_from_sam,
+    "readid2taxid_lca": bench_readid2taxid_lca,
+    "reformat_readid2taxid": bench_reformat_readid2taxid,
+    "load_readid2taxid_tsv": bench_load_readid2taxid_tsv,
+    "load_readid2taxid_binary": bench_load_readid2taxid_binary,
+    "report_statistics": bench_report_statistics,
+    "count_bp_fastq": bench_count_bp_fastq,
+    "count_fasta_bases": bench_count_fasta_bases,
+}
+
+
+def get_rss_kb():
+    with open("/proc/self/statm", "r") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def measure(benchmark, inputs, repeat):
+    run = BENCHMARKS[benchmark](inputs)
+    baseline_rss_kb = get_rss_kb()
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        rows = run()
+        times.append(time.perf_counter() - start)
+    return {
+        "rows": rows,
+        "seconds": min(times),
+        "mean_seconds": sum(times) / len(times),
+        "baseline_rss_kb": baseline_rss_kb,
+    }
+
+
+def run_benchmark(benchmark, inputs, repeat):
+    # Run in a forked child so its peak RSS is measured on its own
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            result = measure(benchmark, inputs, repeat)
+        except BaseException as e:
+            result = {"error": repr(e)}
+        with os.fdopen(write_fd, "w") as f:
+            json.dump(result, f)
+        os._exit(0)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd, "r") as f:
+        data = f.read()
+    _, _, rusage = os.wait4(pid, 0)
+    result = json.loads(data) if data else {"error": "benchmark process died"}
+    result = {"benchmark": benchmark, "scale": inputs["scale"], **result}
+    if "error" not in result:
+        result["rows_per_second"] = round(result["rows"] / max(result["seconds"], 1e-9))
+        result["seconds"] = round(result["seconds"], 6)
+        result["mean_seconds"] = round(result["mean_seconds"], 6)
+        result["peak_rss_kb"] = rusage.ru_maxrss
+        result["peak_rss_delta_kb"] = max(
+            0, rusage.ru_maxrss - result.pop("baseline_rss_kb")
+        )
+    return result
+
+
+def compare_results(results, baseline_file):
+    with open(baseline_file, "r") as f:
+        baseline = {
+            (result["benchmark"], result["scale"]): result
+            for result in json.load(f)["results"]
+            if "error" not in result
+        }
+    print("benchmark\tscale\tspeedup\tpeak_rss_delta_ratio", file=sys.stderr)
+    for result in results:
+        old = baseline.get((result["benchmark"], result["scale"]))
+        if old is None or "error" in result:
+            continue
+        speedup = result["rows_per_second"] / max(old["rows_per_second"], 1)
+        memory = result["peak_rss_delta_kb"] / max(old["peak_rss_delta_kb"], 1)
+        print(
+            f"{result['benchmark']}\t{result['scale']}\t{speedup:.2f}x\t{memory:.2f}x",
+            file=sys.stderr,
+        )
+
+
+def main():
+    # Parse arguments from command line
+    parser = argparse.ArgumentParser(
+        description="Times the core routine of each script on seeded synthetic inputs at "
+        "several scales and outputs throughput and peak memory as JSON (runs offline)"
+    )
+    parser.add_argument(
+        "-b",
+        "--benchmarks",
+        dest="benchmarks",
+        default=",".join(BENCHMARKS),
+        help=f"Comma separated benchmarks to run (default all: {','.join(BENCHMARKS)})",
+    )
+    parser.add_argument(
+        "-s",
+        "--scales",
+        dest="scales",
+        default="10000,100000",
+        help="Comma separated numbers of rows to generate (default 10000,100000)",
+    )
+    parser.add_argument(
+        "--taxonomy-size",
+        dest="taxonomy_size",
+        type=int,
+        default=20000,
+        help="Number of taxonomy nodes (default 20000)",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        dest="repeat",
+        type=int,
+        default=3,
+        help="Times to run each routine, the fastest is reported (default 3)",
+    )
+    parser.add_argument("--seed", dest="seed", type=int, default=0, help="Random seed")
+    parser.add_argument(
+        "-d",
+        "--directory",
+        dest="directory",
+        default=None,
+        help="Keep the generated inputs in this directory (default is a temporary one)",
+    )
+    parser.add_argument(
+        "-c",
+        "--compare",
+        dest="compare",
+        default=None,
+        help="A previous JSON output to compare against",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        default=None,
+        help="Write the JSON results to this file (default is stdout)",
+    )
+    args = parser.parse_args()
+    benchmarks = args.benchmarks.split(",")
+    for benchmark in benchmarks:
+        if benchmark not in BENCHMARKS:
+            parser.error(f"unknown benchmark '{benchmark}'")
+    scales = [int(scale) for scale in args.scales.split(",")]
+
+    # Initialize event logger, routines' own logging is quieted
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.DEBUG,
+        format="[%(asctime)s %(threadName)s %(levelname)s] %(message)s",
+        datefmt="%m-%d-%Y %I:%M:%S%p",
+    )
+
+    temporary_directory = None
+    directory = args.directory
+    if directory is None:
+        temporary_directory = tempfile.TemporaryDirectory(prefix="bio-tools-benchmark-")
+        directory = temporary_directory.name
+
+    results = []
+    for scale in scales:
+        logging.info(f"Generating inputs with {scale} rows")
+        inputs = generate_inputs(
+            os.path.join(directory, str(scale)),
+            scale,
+            args.taxonomy_size,
+            args.seed,
+        )
+        for benchmark in benchmarks:
+            logging.getLogger().setLevel(logging.WARNING)
+            result = run_benchmark(benchmark, inputs, args.repeat)
+            logging.getLogger().setLevel(logging.DEBUG)
+            if "error" in result:
+                logging.error(f"{benchmark} at {scale} rows failed: {result['error']}")
+            else:
+                logging.info(
+                    f"{benchmark} at {scale} rows: {result['seconds']}s, "
+                    f"{result['rows_per_second']} rows/s, +{result['peak_rss_delta_kb']} KB peak RSS"
+                )
+            results.append(result)
+
+    report = {
+        "metadata": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "taxonomy_size": args.taxonomy_size,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare is not None:
+        compare_results(results, args.compare)
+    if temporary_directory is not None:
+        temporary_directory.cleanup()
+    logging.info("Done!")
+
+
+if __name__ == "__main__":
+    main()
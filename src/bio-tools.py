@@ -0,0 +1,166 @@
+import ast
+import os
+import runpy
+import sys
+import time
+
+# Subcommand -> (script in this directory, short description). The scripts are only
+# loaded when their subcommand runs, so each one pays for just the modules it imports.
+COMMANDS = {
+    "accession-index": (
+        "accession-index.py",
+        "Apply accession2taxid updates and dead accessions to an index",
+    ),
+    "abundance-profile": (
+        "abundance-profile.py",
+        "CAMI abundance profiles and their distances from the ground truth",
+    ),
+    "benchmark": (
+        "benchmark.py",
+        "Time the core routines on synthetic inputs at several scales",
+    ),
+    "clark-hack": (
+        "clark-hack.py",
+        "Update the tax ids of CLARK .fileToAccssnTaxID files",
+    ),
+    "convert-readid2taxid": (
+        "convert-readid2taxid.py",
+        "Convert a readid2taxid between the tsv and binary formats",
+    ),
+    "count-bp": ("count-bp.py", "Count the base pairs in a fasta/fastq file"),
+    "count-nodes-below": (
+        "count-nodes-below.py",
+        "Count leaf nodes below every node of a taxonomy level",
+    ),
+    "evaluation-pipeline": (
+        "evaluation-pipeline.py",
+        "SAM ground truth, LCA, reformat and statistics in one process",
+    ),
+    "extract-columns": ("extract-columns.py", "Output columns of a tsv/csv as a tsv"),
+    "fasta-index": (
+        "fasta-index.py",
+        "Index the FASTA files of a reference and fetch sequences from them",
+    ),
+    "filter-abv": (
+        "filter-abv.py",
+        "Link a random (optionally stratified) subset of a reference",
+    ),
+    "get-time-data": (
+        "get-time-data.py",
+        "Extract metrics from 'time -v' output",
+    ),
+    "gnuplot-data": ("gnuplot-data.py", "Build gnuplot data from report files"),
+    "lookup-server": (
+        "lookup-server.py",
+        "Keep the taxonomy and accession2taxid maps loaded for other jobs",
+    ),
+    "profile-command": (
+        "profile-command.py",
+        "Run a command and sample its resource usage",
+    ),
+    "readid2taxid-from-fastq": (
+        "readid2taxid-from-fastq.py",
+        "Read id to tax id from Badread simulated reads",
+    ),
+    "readid2taxid-from-sam": (
+        "readid2taxid-from-sam.py",
+        "Read id to tax id from a SAM file",
+    ),
+    "readid2taxid-lca": (
+        "readid2taxid-lca.py",
+        "Collapse read ids with several tax ids to their LCA",
+    ),
+    "reference-manifest": (
+        "reference-manifest.py",
+        "Scan a reference once and output classifier input files",
+    ),
+    "reformat-readid2taxid": (
+        "reformat-readid2taxid.py",
+        "Translate classifier tax ids back to NCBI tax ids",
+    ),
+    "report-statistics": (
+        "report-statistics.py",
+        "Genus and species statistics of a classifier",
+    ),
+    "resolve-names": ("resolve-names.py", "Resolve organism names to tax ids"),
+    "taxid-fix": ("taxid-fix.py", "Change the tax ids of files in SKiM output"),
+    "taxonomy-arrays": (
+        "taxonomy-arrays.py",
+        "Convert a taxonomy to a file every process can memory map",
+    ),
+    "taxor-hack": ("taxor-hack.py", "Create the taxor input tsv for a reference"),
+    "zymo-add-accessions": (
+        "zymo-add-accessions.py",
+        "Add accessions to reference fasta files",
+    ),
+}
+
+
+def print_usage(out_file):
+    out_file.write(
+        "usage: bio-tools.py [--startup-time] <command> [args...]\n\n"
+        "'bio-tools.py <command> --help' shows the help of each command.\n"
+        "'--startup-time' reports how long loading the command and the imports in its\n"
+        "functions (main() imports after parsing its arguments) take without running it.\n\n"
+        "commands:\n"
+    )
+    for command, (_, description) in COMMANDS.items():
+        out_file.write(f"  {command:<25}{description}\n")
+
+
+def get_import_statements(script):
+    # Every import in the script, including the ones deferred into its functions
+    with open(script, "r") as f:
+        tree = ast.parse(f.read(), script)
+    return [
+        compile(ast.Module(body=[node], type_ignores=[]), script, "exec")
+        for node in ast.walk(tree)
+        if isinstance(node, (ast.Import, ast.ImportFrom))
+    ]
+
+
+def main():
+    args = sys.argv[1:]
+    startup_time = args[:1] == ["--startup-time"]
+    if startup_time:
+        args = args[1:]
+
+    if not args or args[0] in ("-h", "--help"):
+        print_usage(sys.stdout)
+        return
+    if args[0] not in COMMANDS:
+        sys.stderr.write(f"bio-tools.py: unknown command '{args[0]}'\n\n")
+        print_usage(sys.stderr)
+        sys.exit(2)
+
+    script = os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), COMMANDS[args[0]][0]
+    )
+    # The scripts import from lib/ relative to their own directory
+    sys.path.insert(0, os.path.dirname(script))
+
+    if startup_time:
+        # Load the script without calling main(), then run the imports main() would
+        # run (optional dependencies that aren't installed are skipped)
+        modules_before = len(sys.modules)
+        start = time.perf_counter()
+        namespace = runpy.run_path(script, run_name="bio_tools_startup_time")
+        top_level = time.perf_counter() - start
+        for statement in get_import_statements(script):
+            try:
+                exec(statement, namespace)
+            except ImportError:
+                pass
+        elapsed = time.perf_counter() - start
+        print(
+            f"{args[0]}\t{elapsed * 1000:.1f} ms\t{top_level * 1000:.1f} ms top level"
+            f"\t{len(sys.modules) - modules_before} modules"
+        )
+        return
+
+    sys.argv = [script] + args[1:]
+    runpy.run_path(script, run_name="__main__")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,30 @@ import argparse
 import logging
 import sys
 
+from lib.batch import get_input_output_pairs, is_batch, run_batch
+from lib.input import open_input
 from lib.lib import load_accession2taxid
+from lib.lookup import prefetch_accessions
+from lib.metrics import Metrics, add_metrics_arguments
+from lib.output import BulkWriter
+from lib.pipeline import batched
+
+
+def update_taxids(in_file, out_file, accession2taxid):
+    # Lines are handled in batches so a lookup server gets one request per batch
+    total_lines = 0
+    for batch in batched(in_file):
+        lines = [line.strip().split("\t") for line in batch]
+        prefetch_accessions(accession2taxid, [line[1] for line in lines])
+        for line in lines:
+            out_file.write_row(line[0], line[1], accession2taxid[line[1]])
+        total_lines += len(lines)
+    return total_lines
+
+
+def update_file(input_file, output_file, accession2taxid):
+    with open_input(input_file, "r") as f, BulkWriter(output_file) as out_file:
+        return update_taxids(f, out_file, accession2taxid)
 
 
 def main():
@@ -10,9 +33,27 @@ def main():
     parser = argparse.ArgumentParser(
         description="Takes the .custom.fileToAccssnTaxID file from CLARK and updates the tax ids according to a accession2taxid (prints to stdout)"
     )
+    parser.add_argument(
+        "-O",
+        "--output-directory",
+        dest="output_directory",
+        default=None,
+        help="Write each input (or glob match) to a file of the same name in this directory "
+        "(outputs ending in .gz or .zst are compressed)",
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of files to update at the same time",
+    )
+    add_metrics_arguments(parser)
     parser.add_argument("accession2taxid", help="accession2taxid of reference file")
     parser.add_argument(
-        "file_to_accession_taxid", help=".custom.fileToAccssnTaxID from CLARK"
+        "file_to_accession_taxid",
+        nargs="+",
+        help=".custom.fileToAccssnTaxID from CLARK, or several as files, globs or <input>=<output> pairs",
     )
     args = parser.parse_args()
 
@@ -24,15 +65,33 @@ def main():
         datefmt="%m-%d-%Y %I:%M:%S%p",
     )
 
+    metrics = Metrics(args.metrics, args.profile)
+
     # Read in accession2taxid
     logging.info(f"Reading accession2taxid at {args.accession2taxid}")
-    accession2taxid = load_accession2taxid(args.accession2taxid)
+    with metrics.stage("mapping load") as stage:
+        accession2taxid = load_accession2taxid(args.accession2taxid)
+        stage["items"] = len(accession2taxid)
     logging.info("Done reading accession2taxid!")
 
-    with open(args.file_to_accession_taxid, "r") as f:
-        for line in f:
-            line = line.strip().split("\t")
-            print(f"{line[0]}\t{line[1]}\t{accession2taxid[line[1]]}")
+    # A single file without an output directory keeps printing to stdout
+    if not is_batch(args.file_to_accession_taxid, args.output_directory):
+        with metrics.stage("main loop") as stage:
+            stage["items"] = update_file(
+                args.file_to_accession_taxid[0], None, accession2taxid
+            )
+        metrics.close()
+        return
+
+    # Otherwise the accession2taxid is shared by every file in the batch
+    pairs = get_input_output_pairs(args.file_to_accession_taxid, args.output_directory)
+    logging.info(f"Updating {len(pairs)} files with {args.threads} workers")
+    with metrics.stage("main loop") as stage:
+        stage["items"] = run_batch(
+            update_file, pairs, args.threads, accession2taxid=accession2taxid
+        )
+    metrics.close()
+    logging.info("Done updating!")
 
 
 if __name__ == "__main__":
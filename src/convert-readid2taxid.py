@@ -0,0 +1,77 @@
+import argparse
+import logging
+import os
+import sys
+
+from lib.metrics import Metrics, add_metrics_arguments
+
+
+def main():
+    # Parse arguments from command line
+    parser = argparse.ArgumentParser(
+        description="Converts a read id to tax id file between the tsv and binary formats. "
+        "The input format is detected, the binary format loads with a memory map instead of parsing"
+    )
+    parser.add_argument(
+        "-b",
+        "--binary",
+        dest="binary",
+        action="store_true",
+        help="Write the binary format (default is a tsv)",
+    )
+    parser.add_argument(
+        "-c",
+        "--clark",
+        dest="clark",
+        action="store_true",
+        help="Read NA tax ids in a tsv as 0",
+    )
+    add_metrics_arguments(parser)
+    parser.add_argument("readid2taxid", help="Read id to tax id file (tsv or binary)")
+    parser.add_argument(
+        "output",
+        nargs="?",
+        default=None,
+        help="The output file (default is stdout, a tsv ending in .gz or .zst is compressed)",
+    )
+    args = parser.parse_args()
+
+    from lib.output import BulkWriter, get_compression
+    from lib.readid2taxid import load_readid2taxid, write_readid2taxid
+
+    # Initialize event logger
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.DEBUG,
+        format="[%(asctime)s %(threadName)s %(levelname)s] %(message)s",
+        datefmt="%m-%d-%Y %I:%M:%S%p",
+    )
+
+    metrics = Metrics(args.metrics, args.profile)
+
+    logging.info(f"Reading readid2taxid at {args.readid2taxid}")
+    with metrics.stage("readid2taxid load") as stage:
+        table = load_readid2taxid(args.readid2taxid, args.clark)
+        stage["items"] = len(table["taxids"])
+
+    output_format = "binary" if args.binary else "tsv"
+    logging.info(f"Writing {len(table['taxids'])} reads as {output_format}")
+    with metrics.stage("output") as stage:
+        if args.output is None:
+            with BulkWriter() as out_file:
+                write_readid2taxid(table, out_file, args.binary)
+        else:
+            # Write to a temporary file and rename so a failed run never leaves a partial file
+            with BulkWriter(
+                args.output + ".tmp", get_compression(args.output)
+            ) as out_file:
+                write_readid2taxid(table, out_file, args.binary)
+            os.replace(args.output + ".tmp", args.output)
+        stage["items"] = len(table["taxids"])
+    metrics.close()
+
+    logging.info("Done!")
+
+
+if __name__ == "__main__":
+    main()
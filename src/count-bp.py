@@ -2,7 +2,8 @@ import argparse
 import logging
 import sys
 
-from Bio import SeqIO
+from lib.input import open_input
+from lib.metrics import Metrics, add_metrics_arguments
 
 
 def main():
@@ -17,9 +18,15 @@ def main():
         action="store_true",
         help="Option if the file is fasta (default is fastq)",
     )
-    parser.add_argument("file", help="The fastq (or fasta) file")
+    add_metrics_arguments(parser)
+    parser.add_argument(
+        "file",
+        help="The fastq (or fasta) file, optionally gzip, BGZF or zstd compressed",
+    )
     args = parser.parse_args()
 
+    from Bio import SeqIO
+
     # Initialize event logger
     logging.basicConfig(
         stream=sys.stderr,
@@ -28,16 +35,23 @@ def main():
         datefmt="%m-%d-%Y %I:%M:%S%p",
     )
 
+    metrics = Metrics(args.metrics, args.profile)
+
     # Read the fasta file and count the base pairs
     logging.info(f"Looping through file at {args.file}")
     total_seq_len = 0
-    if args.fasta:
-        for record in SeqIO.parse(args.file, "fasta"):
-            total_seq_len += len(record.seq)
-    else:
-        for record in SeqIO.parse(args.file, "fastq"):
-            total_seq_len += len(record.seq)
+    with metrics.stage("main loop") as stage, open_input(args.file, "r") as f:
+        stage["items"] = 0
+        if args.fasta:
+            for record in SeqIO.parse(f, "fasta"):
+                total_seq_len += len(record.seq)
+                stage["items"] += 1
+        else:
+            for record in SeqIO.parse(f, "fastq"):
+                total_seq_len += len(record.seq)
+                stage["items"] += 1
     logging.info(f"total bases: {str(total_seq_len)}")
+    metrics.close()
     logging.info("Done reading through reference!")
 
 
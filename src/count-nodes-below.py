@@ -2,22 +2,22 @@ import argparse
 import logging
 import sys
 
-from taxonomy.taxonomy import Taxonomy
+from lib.metrics import Metrics, add_metrics_arguments
 
 
-def count_leaf_nodes_below(taxonomy, node, level):
+def count_leaf_nodes_below(taxonomy, node, level, out_file):
     leaf_nodes_below = 0
     children = taxonomy.children(node.id)
     if children:
         # "if children" returns true if the list is non-empty
         for child in children:
-            leaf_nodes_below += count_leaf_nodes_below(taxonomy, child, level)
+            leaf_nodes_below += count_leaf_nodes_below(taxonomy, child, level, out_file)
     else:
         # otherwise the list is empty and this is a leaf node
         return 1
 
     if node.rank == level:
-        print(f"{node.id}\t{str(leaf_nodes_below)}")
+        out_file.write(f"{node.id}\t{str(leaf_nodes_below)}\n")
 
     return leaf_nodes_below
 
@@ -28,10 +28,22 @@ def main():
     parser = argparse.ArgumentParser(
         description="Counts nodes below the given tax level"
     )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        default=None,
+        help="Write to this file instead of stdout (compressed if it ends in .gz or .zst)",
+    )
+    add_metrics_arguments(parser)
     parser.add_argument("level", help="NCBI taxonomy level to print")
     parser.add_argument("taxonomy", help="NCBI taxonomy directory")
     args = parser.parse_args()
 
+    from taxonomy.taxonomy import Taxonomy
+
+    from lib.output import BulkWriter
+
     # Initialize event logger
     logging.basicConfig(
         stream=sys.stderr,
@@ -40,12 +52,21 @@ def main():
         datefmt="%m-%d-%Y %I:%M:%S%p",
     )
 
+    metrics = Metrics(args.metrics, args.profile)
+
     # Read taxonomy
     logging.info(f"Reading taxonomy from directory {args.taxonomy}")
-    taxonomy = Taxonomy.from_ncbi(args.taxonomy)
+    with metrics.stage("taxonomy load") as stage:
+        taxonomy = Taxonomy.from_ncbi(args.taxonomy)
+        stage["items"] = len(taxonomy)
     logging.info("Taxonomy read!")
 
-    count_leaf_nodes_below(taxonomy, taxonomy.root, args.level)
+    with metrics.stage("main loop") as stage:
+        with BulkWriter(args.output) as out_file:
+            stage["items"] = count_leaf_nodes_below(
+                taxonomy, taxonomy.root, args.level, out_file
+            )
+    metrics.close()
 
     logging.info("Done!")
 
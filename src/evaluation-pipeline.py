@@ -0,0 +1,237 @@
+import argparse
+import logging
+import sys
+
+from lib.lib import load_accession2taxid
+from lib.metrics import Metrics, add_metrics_arguments
+from lib.pipeline import batched, collapse_to_lca, readid2taxid_from_alignments
+
+
+def main():
+    # Parse arguments from command line
+    parser = argparse.ArgumentParser(
+        description="Runs readid2taxid-from-sam.py, readid2taxid-lca.py, reformat-readid2taxid.py "
+        "and report-statistics.py in one process. The taxonomy and accession2taxid are loaded once "
+        "and reads are passed between the steps in memory instead of through files"
+    )
+    parser.add_argument(
+        "-s",
+        "--species-level",
+        dest="species_level",
+        action="store_true",
+        help="If the ground truth mapping doesn't occur at the species level, consider it unmapped",
+    )
+    parser.add_argument(
+        "--clark",
+        dest="clark",
+        action="store_true",
+        help="If the classifier is CLARK, we need to replace NA with 0",
+    )
+    parser.add_argument(
+        "--krakenuniq",
+        dest="krakenuniq_map",
+        default=None,
+        help="The seqid2taxid.map file provided by krakenuniq and the accession2taxid mapping for the dataset",
+    )
+    parser.add_argument(
+        "--kasa",
+        dest="kasa_map_and_seqid2taxid",
+        default=None,
+        help="<ref_content.txt>,<seqid2taxid> -- ref_content.txt provided by kASA's database",
+    )
+    parser.add_argument(
+        "--ground-truth-output",
+        dest="ground_truth_output",
+        default=None,
+        help="Also write the ground truth readid2taxid (after the LCA step) to this file",
+    )
+    parser.add_argument(
+        "--predicted-output",
+        dest="predicted_output",
+        default=None,
+        help="Also write the reformatted classifier readid2taxid to this file",
+    )
+    parser.add_argument(
+        "-b",
+        "--binary",
+        dest="binary",
+        action="store_true",
+        help="Write the optional readid2taxid files in the binary format",
+    )
+    parser.add_argument(
+        "-c",
+        "--classifier-name",
+        dest="classifier_name",
+        default=None,
+        help="The name of the classifier being evaluated",
+    )
+    parser.add_argument(
+        "-g",
+        "--give-formulas",
+        dest="give_formulas",
+        action="store_true",
+        help="Prints the formulas used for precision, recall, and accuracy",
+    )
+    parser.add_argument(
+        "-i",
+        "--include-header",
+        dest="include_header",
+        action="store_true",
+        help="Prints the header line before the output",
+    )
+    parser.add_argument(
+        "-o",
+        "--outside-reference",
+        dest="outside_reference",
+        action="store_true",
+        help="Computes statistics only for reads outside the reference",
+    )
+    parser.add_argument(
+        "-u",
+        "--ignore-unclassified",
+        dest="ignore_unclassified",
+        action="store_true",
+        help="Excludes unclassified ground truth reads",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="verbose",
+        action="store_true",
+        help="Logs additional information about program execution",
+    )
+    add_metrics_arguments(parser)
+    parser.add_argument("accession2taxid", help="Tab separated accession to tax id")
+    parser.add_argument("sam_file", help="SAM alignment file of the ground truth")
+    parser.add_argument(
+        "taxonomy", help="NCBI taxonomy directory (with names.dmp and nodes.dmp)"
+    )
+    parser.add_argument(
+        "predicted_readid2taxid",
+        help="Read id to tax id (tsv or binary) of the classifier",
+    )
+    parser.add_argument(
+        "reference_seqid2taxid", help="Tab separated seq id to tax id of the reference"
+    )
+    args = parser.parse_args()
+
+    import pysam
+
+    from lib.evaluation import (
+        compute_statistics,
+        count_taxid_pairs,
+        get_lineages_in_reference,
+        print_statistics,
+    )
+    from lib.lookup import load_taxonomy
+    from lib.output import BulkWriter
+    from lib.readid2taxid import (
+        get_read_ids,
+        load_readid2taxid,
+        table_from_lists,
+        write_readid2taxid,
+    )
+    from lib.remap import load_lookup, remap_taxids
+
+    # Initialize event logger
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.DEBUG,
+        format="[%(asctime)s %(threadName)s %(levelname)s] %(message)s",
+        datefmt="%m-%d-%Y %I:%M:%S%p",
+    )
+
+    metrics = Metrics(args.metrics, args.profile)
+
+    # Read taxonomy and accession2taxid once for every step
+    logging.info(f"Reading taxonomy from directory {args.taxonomy}")
+    with metrics.stage("taxonomy load"):
+        taxonomy = load_taxonomy(args.taxonomy)
+    logging.info(f"Reading accession2taxid at {args.accession2taxid}")
+    with metrics.stage("mapping load") as stage:
+        accession2taxid = load_accession2taxid(args.accession2taxid)
+        stage["items"] = len(accession2taxid)
+
+    # SAM -> readid2taxid -> LCA, streamed in batches
+    logging.info(f"Extracting the ground truth from {args.sam_file}")
+    with metrics.stage("ground truth") as stage:
+        ground_truth_readid2taxid = collapse_to_lca(
+            batched(
+                readid2taxid_from_alignments(
+                    pysam.AlignmentFile(args.sam_file, "r"),
+                    accession2taxid,
+                    taxonomy,
+                    args.species_level,
+                )
+            ),
+            taxonomy,
+        )
+        stage["items"] = len(ground_truth_readid2taxid)
+    logging.info(f"{len(ground_truth_readid2taxid)} ground truth reads")
+    if args.ground_truth_output is not None:
+        logging.info(f"Writing the ground truth to {args.ground_truth_output}")
+        with metrics.stage("ground truth output") as stage:
+            ground_truth_table = table_from_lists(
+                list(ground_truth_readid2taxid),
+                list(ground_truth_readid2taxid.values()),
+            )
+            with BulkWriter(args.ground_truth_output) as out_file:
+                write_readid2taxid(ground_truth_table, out_file, args.binary)
+            stage["items"] = len(ground_truth_readid2taxid)
+
+    # Classifier readid2taxid -> NCBI tax ids
+    with metrics.stage("predictions") as stage:
+        lookup = load_lookup(args.krakenuniq_map, args.kasa_map_and_seqid2taxid)
+        logging.info(
+            f"Reading predicted readid2taxid from {args.predicted_readid2taxid}"
+        )
+        predicted_table = load_readid2taxid(args.predicted_readid2taxid, args.clark)
+        if lookup is not None:
+            predicted_table["taxids"] = remap_taxids(predicted_table["taxids"], lookup)
+        predicted_readid2taxid = dict(
+            zip(
+                (read_id.decode() for read_id in get_read_ids(predicted_table)),
+                predicted_table["taxids"].tolist(),
+            )
+        )
+        stage["items"] = len(predicted_readid2taxid)
+    if args.predicted_output is not None:
+        logging.info(f"Writing the predictions to {args.predicted_output}")
+        with metrics.stage("predictions output") as stage:
+            with BulkWriter(args.predicted_output) as out_file:
+                write_readid2taxid(predicted_table, out_file, args.binary)
+            stage["items"] = len(predicted_readid2taxid)
+
+    # Statistics
+    logging.info("Getting lineages from the reference")
+    with metrics.stage("reference lineages"):
+        reference_lineages, warned = get_lineages_in_reference(
+            args.reference_seqid2taxid, taxonomy, args.verbose
+        )
+    logging.info(f"Computing statistics for {args.classifier_name}")
+    with metrics.stage("statistics") as stage:
+        stats = compute_statistics(
+            count_taxid_pairs(ground_truth_readid2taxid, predicted_readid2taxid),
+            reference_lineages,
+            taxonomy,
+            args.ignore_unclassified,
+            args.outside_reference,
+            args.verbose,
+            warned,
+        )
+        stage["items"] = len(ground_truth_readid2taxid)
+    with metrics.stage("output"):
+        print_statistics(
+            stats,
+            args.classifier_name,
+            args.give_formulas,
+            args.include_header,
+            args.outside_reference,
+        )
+    metrics.close()
+
+    logging.info("Done!")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,147 @@
 import argparse
+import csv
+import io
 import logging
+import mmap
+import os
 import sys
+from multiprocessing.pool import Pool
+from operator import itemgetter
+
+from lib.input import DecompressionError, get_input_compression, open_input
+from lib.metrics import Metrics, add_metrics_arguments
+from lib.output import BulkWriter
+
+BLOCK_SIZE = 16 * 1024 * 1024
+
+
+class RowError(Exception):
+    # Raised instead of exiting so a pool worker hands the error back to the parent
+    pass
+
+
+def get_row_getter(columns):
+    # itemgetter returns a single value instead of a tuple for one column
+    getter = itemgetter(*columns)
+    if len(columns) == 1:
+        return lambda row: (getter(row),)
+    return getter
+
+
+def get_column_indices(header, names):
+    indices = []
+    for name in names:
+        if name not in header:
+            logging.error(f"column '{name}' is not in the header: {header}")
+            sys.exit(1)
+        indices.append(header.index(name))
+    return indices
+
+
+def extract_tsv_block(block, columns):
+    getter = get_row_getter(columns)
+    lines = block.split(b"\n")
+    if lines[-1] == b"":
+        lines.pop()
+    if b"\r" in block:
+        lines = [line.rstrip(b"\r") for line in lines]
+    # Blank lines are skipped, as the csv reader does for empty rows
+    if not all(lines):
+        lines = [line for line in lines if line]
+    try:
+        extracted = [b"\t".join(getter(line.split(b"\t"))) for line in lines]
+    except IndexError:
+        raise RowError(
+            f"found a line with fewer than {max(columns) + 1} columns"
+        ) from None
+    return b"\n".join(extracted) + b"\n" if extracted else b""
+
+
+def extract_csv_rows(rows, columns):
+    getter = get_row_getter(columns)
+    try:
+        extracted = ["\t".join(getter(row)) for row in rows if row]
+    except IndexError:
+        raise RowError(
+            f"found a row with fewer than {max(columns) + 1} columns"
+        ) from None
+    text = "\n".join(extracted) + "\n" if extracted else ""
+    # A quoted field with a tab or line break would add columns or rows to the
+    # TSV output, so count the separators instead of checking every field
+    if (
+        text.count("\t") != len(extracted) * (len(columns) - 1)
+        or text.count("\n") != len(extracted)
+        or "\r" in text
+    ):
+        field = next(
+            field
+            for row in rows
+            if row
+            for field in getter(row)
+            if "\t" in field or "\n" in field or "\r" in field
+        )
+        raise RowError(
+            f"field {field!r} contains a tab or line break, which can't be "
+            "written as TSV"
+        )
+    return text.encode()
+
+
+def extract_range(task):
+    file, start, end, columns, is_csv = task
+    with open(file, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            block = mm[start:end]
+    if is_csv:
+        rows = list(csv.reader(io.StringIO(block.decode())))
+        return extract_csv_rows(rows, columns)
+    return extract_tsv_block(block, columns)
+
+
+def get_line_aligned_ranges(file, start, total_chunks):
+    # Split the file after 'start' into ranges that begin and end at line boundaries
+    ranges = []
+    with open(file, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        if file_size == 0:
+            return ranges
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            chunk_size = max((file_size - start) // total_chunks, 1)
+            while start < file_size:
+                end = mm.find(b"\n", min(start + chunk_size, file_size - 1))
+                end = file_size if end == -1 else end + 1
+                ranges.append((start, end))
+                start = end
+    return ranges
+
+
+def extract(f, file, data_start, columns, is_csv, processes, out_file):
+    if processes > 1:
+        ranges = get_line_aligned_ranges(file, data_start, processes * 4)
+        tasks = [(file, start, end, columns, is_csv) for start, end in ranges]
+        with Pool(processes) as pool:
+            for extracted in pool.imap(extract_range, tasks):
+                out_file.write(extracted)
+
+    elif is_csv:
+        # The csv module handles quoted fields, including ones with newlines
+        text_file = io.TextIOWrapper(f, newline="")
+        rows = csv.reader(text_file)
+        while True:
+            batch = [row for _, row in zip(range(100000), rows)]
+            if not batch:
+                break
+            out_file.write(extract_csv_rows(batch, columns))
+
+    else:
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+            block += f.readline()
+            if not block.endswith(b"\n"):
+                block += b"\n"
+            out_file.write(extract_tsv_block(block, columns))
 
 
 def main():
@@ -11,7 +152,8 @@ def main():
         "--csv",
         dest="csv",
         action="store_true",
-        help="Option if the file is csv (default is tsv)",
+        help="Option if the file is csv (default is tsv), quoted fields are supported "
+        "but extracted ones must not contain tabs or line breaks",
     )
     parser.add_argument(
         "-s",
@@ -20,7 +162,33 @@ def main():
         action="store_true",
         help="Skip the first line of the input file",
     )
-    parser.add_argument("file", help="TSV file to extract columns from")
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        default=None,
+        help="Write to this file instead of stdout (compressed if it ends in .gz or .zst)",
+    )
+    parser.add_argument(
+        "-n",
+        "--names",
+        dest="names",
+        action="store_true",
+        help="The columns are names from the first line of the file (which is skipped)",
+    )
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=1,
+        help="Split the file into chunks processed in parallel "
+        "(in csv mode, quoted fields must not contain newlines)",
+    )
+    add_metrics_arguments(parser)
+    parser.add_argument(
+        "file",
+        help="TSV file to extract columns from, optionally gzip, BGZF or zstd compressed",
+    )
     parser.add_argument(
         "columns",
         type=str,
@@ -28,8 +196,6 @@ def main():
         "(E.g. 4,6,1 will output 4<tab>6<tab>1)",
     )
     args = parser.parse_args()
-    columns = list(map(lambda x: int(x), args.columns.split(",")))
-    split_char = "," if args.csv else "\t"
 
     # Initialize event logger
     logging.basicConfig(
@@ -39,22 +205,49 @@ def main():
         datefmt="%m-%d-%Y %I:%M:%S%p",
     )
 
-    # Read the TSV/CSV
-    logging.info(f"Outputting columns {str(columns)} from {args.file}")
+    # The parallel chunks are byte ranges of the file, which needs it uncompressed
+    processes = args.processes
+    if processes > 1 and get_input_compression(args.file) is not None:
+        logging.warning(
+            f"{args.file} is compressed, extracting with one process (decompression "
+            "still runs in the background)"
+        )
+        processes = 1
+
+    metrics = Metrics(args.metrics, args.profile)
+
+    with metrics.stage("main loop"), open_input(args.file, "rb") as f, BulkWriter(
+        args.output
+    ) as out_file:
+        # Read the header if it is needed for column names or has to be skipped
+        data_start = 0
+        if args.names or args.skip_header:
+            header = f.readline()
+            data_start = f.tell()
+        if args.names:
+            header = header.decode().rstrip("\r\n")
+            header = (
+                next(csv.reader([header])) if args.csv else list(header.split("\t"))
+            )
+            columns = get_column_indices(header, args.columns.split(","))
+        else:
+            columns = list(map(lambda x: int(x), args.columns.split(",")))
+
+        # Read the TSV/CSV
+        logging.info(f"Outputting columns {str(columns)} from {args.file}")
 
-    with open(args.file, "r") as f:
-        if args.skip_header:
-            next(f)
-        for line in f:
-            line = list(line.strip().split(split_char))
-            acc = ""
-            for idx, column in enumerate(columns):
-                if idx == 0:
-                    acc += line[column]
-                else:
-                    acc += "\t" + line[column]
-            print(acc)
+        # Errors in a worker come back to the parent, which exits (the pool is
+        # terminated on the way out)
+        try:
+            extract(f, args.file, data_start, columns, args.csv, processes, out_file)
+        except RowError as e:
+            logging.error(f"{args.file}: {e}")
+            sys.exit(1)
+        except DecompressionError as e:
+            logging.error(e)
+            sys.exit(1)
 
+    metrics.close()
     logging.info("Done outputting columns!")
 
 
@@ -0,0 +1,104 @@
+import argparse
+import logging
+import sys
+
+from lib.metrics import Metrics, add_metrics_arguments
+
+LINE_WIDTH = 60
+
+
+def parse_region(region):
+    # <name>, <name>:<start> or <name>:<start>-<end>, 1-based and inclusive like samtools
+    name, _, span = region.partition(":")
+    if not span:
+        return name, 0, None
+    start, _, end = span.replace(",", "").partition("-")
+    try:
+        return name, int(start) - 1, int(end) if end else None
+    except ValueError:
+        logging.error(f"can't parse the region '{region}'")
+        sys.exit(1)
+
+
+def main():
+    # Parse arguments from command line
+    parser = argparse.ArgumentParser(
+        description="Writes a samtools compatible .fai index next to every FASTA file of a "
+        "reference directory (files with a current index are skipped). With '-r' outputs "
+        "sequences or parts of them as FASTA, read through the indexes instead of parsing the files"
+    )
+    parser.add_argument(
+        "-t", "--threads", type=int, default=14, help="Number of threads to use"
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        dest="force",
+        action="store_true",
+        help="Index every file again, even if its index is current",
+    )
+    parser.add_argument(
+        "-r",
+        "--region",
+        dest="regions",
+        action="append",
+        default=[],
+        help="Output this sequence id or accession, or part of it as <id>:<start>-<end> "
+        "(1-based, inclusive), can be given several times",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        default=None,
+        help="File to write the regions to (default is stdout)",
+    )
+    add_metrics_arguments(parser)
+    parser.add_argument(
+        "reference_directory", help="Directory containing reference fasta files"
+    )
+    args = parser.parse_args()
+
+    from lib.fastaindex import FastaIndex, build_directory_index
+    from lib.output import BulkWriter
+
+    # Initialize event logger
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.DEBUG,
+        format="[%(asctime)s %(threadName)s %(levelname)s] %(message)s",
+        datefmt="%m-%d-%Y %I:%M:%S%p",
+    )
+
+    metrics = Metrics(args.metrics, args.profile)
+
+    logging.info(f"Indexing the reference files in {args.reference_directory}")
+    with metrics.stage("index") as stage:
+        _, stage["items"] = build_directory_index(
+            args.reference_directory, args.threads, args.force
+        )
+
+    if args.regions:
+        with metrics.stage("output") as stage:
+            index = FastaIndex(args.reference_directory)
+            with BulkWriter(args.output) as out_file:
+                for region in args.regions:
+                    name, start, end = parse_region(region)
+                    if name not in index:
+                        logging.error(f"{name} is not in any indexed reference file")
+                        sys.exit(1)
+                    bases = index.fetch(name, start, end)
+                    out_file.write(f">{region}\n")
+                    for line_start in range(0, len(bases), LINE_WIDTH):
+                        out_file.write(
+                            bases[line_start : line_start + LINE_WIDTH] + "\n"
+                        )
+            index.close()
+            stage["items"] = len(args.regions)
+    metrics.close()
+
+    logging.info("Done!")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,25 +2,142 @@ import argparse
 import logging
 import os
 import random
-import subprocess
 import sys
-from multiprocessing.pool import Pool
+from concurrent.futures import ThreadPoolExecutor
 
+from lib.lib import count_fasta_bases, load_accession2taxid, read_first_accession
+from lib.metrics import Metrics, add_metrics_arguments
 
-def get_info(fasta_file):
-    file_size = os.stat(fasta_file).st_size
-    return fasta_file, file_size
+
+def get_size(entry, use_bases):
+    # Follow the directory entry to the real file so links point at the genome itself
+    fasta_file = os.path.realpath(entry.path)
+    if use_bases:
+        from lib.fastaindex import get_indexed_bases
+
+        # A current .fai (fasta-index.py) has the lengths, otherwise count the bases
+        bases = get_indexed_bases(fasta_file)
+        if bases is None:
+            bases = count_fasta_bases(fasta_file)
+        return fasta_file, bases
+    return fasta_file, entry.stat().st_size
+
+
+def get_ref_files_info(reference_directory, threads, use_bases):
+    with os.scandir(reference_directory) as entries:
+        fasta_entries = [
+            entry
+            for entry in entries
+            if entry.name.endswith(".fna") or entry.name.endswith(".fasta")
+        ]
+
+    # Stat (or count bases) with a thread pool, the work is all system calls and I/O
+    with ThreadPoolExecutor(threads) as executor:
+        ref_files_info = list(
+            executor.map(lambda entry: get_size(entry, use_bases), fasta_entries)
+        )
+
+    # Sort so the same seed gives the same subset regardless of directory order
+    ref_files_info.sort()
+    return ref_files_info
+
+
+def get_strata(ref_files_info, accession2taxid, taxonomy, level, threads):
+    with ThreadPoolExecutor(threads) as executor:
+        accessions = list(
+            executor.map(lambda x: read_first_accession(x[0]), ref_files_info)
+        )
+
+    strata = {}
+    taxid_to_stratum = {}
+    for file_info, accession in zip(ref_files_info, accessions):
+        if accession not in accession2taxid:
+            logging.error(
+                f"accession {accession} of {file_info[0]} is not in the accession2taxid"
+            )
+            logging.error(f"please fix this before running again - exiting")
+            sys.exit(1)
+        taxid = accession2taxid[accession]
+        if taxid not in taxid_to_stratum:
+            node = taxonomy.parent(taxid, at_rank=level)
+            # Files without a node at the level are kept in a stratum of their own taxid
+            taxid_to_stratum[taxid] = taxid if node is None else node.id
+        strata.setdefault(taxid_to_stratum[taxid], []).append(file_info)
+    return strata
+
+
+def select_files(ref_files_info, goal_size, rng, keep_one):
+    # Remove files in a random order until the size is at or below the goal
+    ref_files_info = list(ref_files_info)
+    rng.shuffle(ref_files_info)
+    total_current_size = sum(map(lambda x: x[1], ref_files_info))
+    while total_current_size > goal_size and ref_files_info:
+        if keep_one and len(ref_files_info) == 1:
+            break
+        total_current_size -= ref_files_info.pop()[1]
+    return ref_files_info
+
+
+def link_files(ref_files_info, output_directory):
+    os.makedirs(output_directory, exist_ok=True)
+    for file, _ in ref_files_info:
+        os.symlink(file, os.path.join(output_directory, os.path.basename(file)))
 
 
 def main():
 
     # Parse arguments from command line
     parser = argparse.ArgumentParser(
-        description="Outputs a fasta directory with references to genomes in abv of approximately 1/2 input size"
+        description="Outputs a fasta directory with symbolic links to a random subset of the reference "
+        "(by default approximately 1/2 of the input size)"
     )
     parser.add_argument(
         "-t", "--threads", type=int, default=14, help="Number of threads to use"
     )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed for the random selection (one is chosen and logged if not given)",
+    )
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument(
+        "-f",
+        "--fraction",
+        type=float,
+        default=0.5,
+        help="Fraction of the total size to keep (default 0.5)",
+    )
+    target.add_argument(
+        "-b",
+        "--budget",
+        type=int,
+        default=None,
+        help="Absolute size to keep (bytes, or bases with '--bases')",
+    )
+    parser.add_argument(
+        "--bases",
+        dest="use_bases",
+        action="store_true",
+        help="Measure files by number of bases instead of file size",
+    )
+    parser.add_argument(
+        "-s",
+        "--stratify",
+        choices=["genus", "species"],
+        default=None,
+        help="Subset every genus/species separately, keeping at least one file of each "
+        "(requires '--accession2taxid' and '--taxonomy')",
+    )
+    parser.add_argument(
+        "--accession2taxid",
+        default=None,
+        help="accession2taxid of reference file (for '--stratify')",
+    )
+    parser.add_argument(
+        "--taxonomy", default=None, help="NCBI taxonomy directory (for '--stratify')"
+    )
+    add_metrics_arguments(parser)
     parser.add_argument(
         "starting_reference", help="Directory containing reference fasta files"
     )
@@ -28,6 +145,10 @@ def main():
         "output_directory", help="Location of the directory to output symbolic links to"
     )
     args = parser.parse_args()
+    if args.stratify is not None and (
+        args.accession2taxid is None or args.taxonomy is None
+    ):
+        parser.error("'--stratify' requires '--accession2taxid' and '--taxonomy'")
 
     # Initialize event logger
     logging.basicConfig(
@@ -37,38 +158,76 @@ def main():
         datefmt="%m-%d-%Y %I:%M:%S%p",
     )
 
+    metrics = Metrics(args.metrics, args.profile)
+
+    seed = args.seed if args.seed is not None else random.randrange(2**32)
+    logging.info(f"Using random seed {seed}")
+    rng = random.Random(seed)
+
     logging.info(f"Looping through reference files in {args.starting_reference}")
-    with Pool(args.threads) as pool:
-        ref_files = map(
-            lambda x: os.path.realpath(os.path.join(args.starting_reference, x)),
-            filter(
-                lambda x: x.endswith(".fna") or x.endswith(".fasta"),
-                os.listdir(args.starting_reference),
-            ),
+    with metrics.stage("main loop") as stage:
+        ref_files_info = get_ref_files_info(
+            args.starting_reference, args.threads, args.use_bases
         )
+        stage["items"] = len(ref_files_info)
+
+    # Get the total size of all files
+    total_current_size = sum(map(lambda x: x[1], ref_files_info))
+    print(f"current total size: {total_current_size}")
+    if args.budget is not None:
+        if total_current_size == 0:
+            logging.error(
+                f"found no reference files with a nonzero size in {args.starting_reference}"
+            )
+            sys.exit(1)
+        fraction = min(args.budget / total_current_size, 1.0)
+    else:
+        fraction = args.fraction
+    goal_size = round(total_current_size * fraction)
+    print(f"goal total size: {goal_size}")
 
-        # Get the size of each file
-        ref_files_info = pool.map(get_info, ref_files)
+    if args.stratify is None:
+        selected_files_info = select_files(ref_files_info, goal_size, rng, False)
+    else:
+        from lib.lookup import load_taxonomy
 
-        # Get the total size of all files
-        total_current_size = sum(map(lambda x: x[1], ref_files_info))
+        logging.info(f"Reading taxonomy from directory {args.taxonomy}")
+        with metrics.stage("taxonomy load"):
+            taxonomy = load_taxonomy(args.taxonomy)
+        logging.info(f"Reading accession2taxid at {args.accession2taxid}")
+        with metrics.stage("mapping load") as stage:
+            accession2taxid = load_accession2taxid(args.accession2taxid)
+            stage["items"] = len(accession2taxid)
 
-        print(f"current total size: {total_current_size}")
-        half_total_size = round(total_current_size / 2)
-        print(f"goal total size: {half_total_size}")
+        with metrics.stage("strata") as stage:
+            strata = get_strata(
+                ref_files_info, accession2taxid, taxonomy, args.stratify, args.threads
+            )
+            stage["items"] = len(ref_files_info)
+        logging.info(f"Subsetting {len(strata)} {args.stratify} strata separately")
 
-        # Pop a random file from the group until the size is below the goal
-        while total_current_size > half_total_size:
-            random_index = random.randint(0, len(ref_files_info) - 1)
-            total_current_size -= ref_files_info[random_index][1]
-            ref_files_info.pop(random_index)
+        # Every stratum is reduced by the same fraction
+        selected_files_info = []
+        for stratum_id in sorted(strata):
+            stratum_files_info = strata[stratum_id]
+            stratum_goal_size = round(
+                sum(map(lambda x: x[1], stratum_files_info)) * fraction
+            )
+            selected_files_info.extend(
+                select_files(stratum_files_info, stratum_goal_size, rng, True)
+            )
 
-        total_resulting_size = sum(map(lambda x: x[1], ref_files_info))
-        print(f"resulting size: {total_resulting_size}")
+    total_resulting_size = sum(map(lambda x: x[1], selected_files_info))
+    print(f"resulting size: {total_resulting_size}")
 
-        # Symbolic link each output file (instead of copying)
-        for file, _ in ref_files_info:
-            subprocess.run(["ln", "-s", file, args.output_directory])
+    # Symbolic link each output file (instead of copying)
+    logging.info(
+        f"Linking {len(selected_files_info)} of {len(ref_files_info)} files into {args.output_directory}"
+    )
+    with metrics.stage("output") as stage:
+        link_files(selected_files_info, args.output_directory)
+        stage["items"] = len(selected_files_info)
+    metrics.close()
 
 
 if __name__ == "__main__":
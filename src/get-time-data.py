@@ -1,27 +1,138 @@
 import argparse
 import logging
+import os
+import re
 import sys
 from datetime import timedelta
 
+ELAPSED_KEY = "Elapsed (wall clock) time (h:mm:ss or m:ss)"
+
 
 def read_time_output(file):
     file_info = {}
     with open(file, "r") as f:
         for line in f:
             line = line.split(";")[1] if ";" in line else line
-            split_line = line.strip().split(" ")
-            value = split_line[-1]
-            key = f"{split_line[0]}"
-            for split in split_line[1:-1]:
-                key += f" {split}"
+            # No 'time -v' key contains ": " so the first one separates the value
+            key, _, value = line.strip().partition(": ")
+            if not value:
+                split_line = line.strip().split(" ")
+                key, value = " ".join(split_line[:-1]), split_line[-1]
             file_info[key.strip(":")] = value
     return file_info
 
 
+def parse_elapsed(time_str):
+    # Handles [[d-]h:]m:ss[.cc] and plain seconds
+    days = 0
+    if "-" in time_str:
+        days_str, time_str = time_str.split("-", 1)
+        if not days_str.isdigit():
+            return None
+        days = int(days_str)
+    split_time = list(time_str.split(":"))
+    if len(split_time) > 3:
+        return None
+    try:
+        seconds = float(split_time[-1])
+        minutes = int(split_time[-2]) if len(split_time) >= 2 else 0
+        hours = int(split_time[-3]) if len(split_time) == 3 else 0
+    except ValueError:
+        return None
+    return timedelta(
+        days=days, hours=hours, minutes=minutes, seconds=seconds
+    ).total_seconds()
+
+
+def get_column_name(key):
+    if key == ELAPSED_KEY:
+        return "wall_clock_seconds"
+    return re.sub(r"[^a-z0-9]+", "_", key.lower()).strip("_")
+
+
+def parse_value(value):
+    # Numbers (including percentages) become floats, anything else stays a string
+    try:
+        return float(value.rstrip("%"))
+    except ValueError:
+        return value.strip('"')
+
+
+def get_metrics(file):
+    metrics = {}
+    for key, value in read_time_output(file).items():
+        if key == ELAPSED_KEY:
+            elapsed = parse_elapsed(value)
+            if elapsed is None:
+                logging.error(
+                    f"file {file} has an unrecognized time format, exiting..."
+                )
+                sys.exit(1)
+            metrics[get_column_name(key)] = elapsed
+        else:
+            metrics[get_column_name(key)] = parse_value(value)
+    if "maximum_resident_set_size_kbytes" in metrics:
+        metrics["max_rss_gb"] = metrics["maximum_resident_set_size_kbytes"] / 1000000
+    return metrics
+
+
+def get_named_files(directory, pairs):
+    named_files = []
+    if directory is not None:
+        for file_name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, file_name)
+            if os.path.isfile(path):
+                named_files.append((os.path.splitext(file_name)[0], path))
+    for pair in pairs:
+        if "=" not in pair:
+            logging.error(f"'{pair}' is not a <name>=<file> pair")
+            sys.exit(1)
+        named_files.append(tuple(pair.split("=", 1)))
+    return named_files
+
+
+def format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def write_metrics_table(rows, tsv_file, npz_file):
+    # One row per classifier, one column per metric seen in any file
+    columns = []
+    for _, metrics in rows:
+        for column in metrics:
+            if column not in columns:
+                columns.append(column)
+
+    out_file = sys.stdout if tsv_file is None else open(tsv_file, "w")
+    out_file.write("classifier\t" + "\t".join(columns) + "\n")
+    for name, metrics in rows:
+        values = [format_value(metrics.get(column, "")) for column in columns]
+        out_file.write(name + "\t" + "\t".join(values) + "\n")
+    if tsv_file is not None:
+        out_file.close()
+
+    if npz_file is not None:
+        import numpy as np
+
+        arrays = {"classifier": np.array([name for name, _ in rows])}
+        for column in columns:
+            column_values = [metrics.get(column) for _, metrics in rows]
+            if all(isinstance(value, float) for value in column_values):
+                arrays[column] = np.array(column_values, dtype=np.float64)
+            else:
+                arrays[column] = np.array(
+                    ["" if value is None else str(value) for value in column_values]
+                )
+        np.savez(npz_file, **arrays)
+
+
 def main():
     # Parse arguments from command line
     parser = argparse.ArgumentParser(
-        description="Outputs the requested features of the 'time -v' command"
+        description="Outputs the requested features of the 'time -v' command. "
+        "With '-d' or '-p', outputs every feature of many 'time -v' files as one table"
     )
     parser.add_argument(
         "-f",
@@ -44,10 +155,45 @@ def main():
         action="store_true",
         help="The elapsed wall clock time",
     )
-    parser.add_argument("file", help="The time output file to parse")
-    parser.add_argument("name", help="The name of the classifier being added")
+    parser.add_argument(
+        "-d",
+        "--directory",
+        dest="directory",
+        default=None,
+        help="Directory of 'time -v' files, named <classifier>.<extension>",
+    )
+    parser.add_argument(
+        "-p",
+        "--pairs",
+        dest="pairs",
+        nargs="+",
+        default=[],
+        help="<classifier>=<file> pairs of 'time -v' files",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        default=None,
+        help="Write the table of all metrics to this tsv (default is stdout)",
+    )
+    parser.add_argument(
+        "--npz",
+        dest="npz",
+        default=None,
+        help="Also write the table of all metrics as a numpy .npz file (one array per column)",
+    )
+    parser.add_argument("file", nargs="?", help="The time output file to parse")
+    parser.add_argument(
+        "name", nargs="?", help="The name of the classifier being added"
+    )
 
     args = parser.parse_args()
+    batch = args.directory is not None or args.pairs
+    if not batch and (args.file is None or args.name is None):
+        parser.error(
+            "expected <file> <name>, '-d <directory>' or '-p <name>=<file>...'"
+        )
 
     # Initialize event logger
     logging.basicConfig(
@@ -57,6 +203,14 @@ def main():
         datefmt="%m-%d-%Y %I:%M:%S%p",
     )
 
+    if batch:
+        named_files = get_named_files(args.directory, args.pairs)
+        logging.info(f"Reading {len(named_files)} 'time -v' files")
+        rows = [(name, get_metrics(file)) for name, file in named_files]
+        write_metrics_table(rows, args.output, args.npz)
+        logging.info("Done!")
+        return
+
     logging.info(f"Reading 'time -v' from {args.file}")
 
     file_info = read_time_output(args.file)
@@ -75,34 +229,14 @@ def main():
         if args.first:
             print("classifier\ttime_(seconds)")
 
-        # Get the string extracted from the 'time -v' file and split on ":"
-        time_str = file_info["Elapsed (wall clock) time (h:mm:ss or m:ss)"]
-        split_time = list(time_str.split(":"))
-
-        # See the key name for formatting of this string (why this is necessary)
-        if len(split_time) == 2:
-            minutes = int(split_time[0])
-            # In this case, there is also a milliseconds number after a decimal point
-            split_time = list(split_time[1].split("."))
-            seconds = int(split_time[0])
-            milliseconds = int(split_time[1]) * 10
-            print(
-                f"{args.name}\t{timedelta(minutes=minutes, seconds=seconds, milliseconds=milliseconds).total_seconds()}"
-            )
-
-        elif len(split_time) == 3:
-            hours = int(split_time[0])
-            minutes = int(split_time[1])
-            seconds = int(split_time[2])
-            print(
-                f"{args.name}\t{timedelta(hours=hours, minutes=minutes, seconds=seconds).total_seconds()}"
-            )
-
-        else:
+        # See the key name for formatting of this string (h:mm:ss or m:ss.cc)
+        elapsed = parse_elapsed(file_info[ELAPSED_KEY])
+        if elapsed is None:
             logging.error(
                 f"file {args.file} has an unrecognized time format, exiting..."
             )
             sys.exit(1)
+        print(f"{args.name}\t{elapsed}")
 
     logging.info("Done!")
 
@@ -1,5 +1,6 @@
 import argparse
 import logging
+import os
 import sys
 
 
@@ -9,49 +10,40 @@ def get_order_from_output(out_file):
         return list(next(f).strip().split("\t"))
 
 
-def get_order_from_input(in_file, skip_formula_headers):
+def read_report(in_file, skip_formula_headers, column):
+    # Returns the classifier order and each classifier's value in the column
+    # (an index, or a name from the header line)
     order = []
-    with open(in_file, "r") as f:
-        f = iter(f)
-
-        # Skip header lines
-        if skip_formula_headers:
-            for _ in range(6):
-                next(f)
-        else:
-            next(f)
-
-        for line in f:
-            order.append(line.strip().split("\t")[0])
-    return order
-
-
-def get_new_row_data(in_file, skip_formula_headers, is_sizes):
     new_row_data = {}
     with open(in_file, "r") as f:
         f = iter(f)
 
         # Skip header lines
         if skip_formula_headers:
-            for _ in range(6):
+            for _ in range(5):
                 next(f)
+        header = list(next(f).strip().split("\t"))
+
+        if column.isdigit():
+            column_index = int(column)
+        elif column in header:
+            column_index = header.index(column)
         else:
-            next(f)
+            logging.error(f"column '{column}' is not in the header of {in_file}")
+            sys.exit(1)
 
-        # Add new stats
         for line in f:
             line = line.strip().split("\t")
-            if is_sizes:
-                new_row_data[line[0]] = line[1]
-            else:
-                new_row_data[line[0]] = line[6]
-    return new_row_data
+            order.append(line[0])
+            new_row_data[line[0]] = line[column_index]
+    return order, new_row_data
 
 
 def main():
     # Parse arguments from command line
     parser = argparse.ArgumentParser(
-        description="Outputs a row of data to use in gnuplot"
+        description="Outputs a row of data to use in gnuplot. "
+        "With '-m', outputs the whole matrix with a row for each input file"
     )
     parser.add_argument(
         "-f",
@@ -73,10 +65,34 @@ def main():
         action="store_true",
         help="If the data is maximum rss sizes",
     )
-    parser.add_argument("input_file", help="Tabular report file to extract from")
+    parser.add_argument(
+        "-c",
+        "--column",
+        dest="column",
+        default=None,
+        help="Column to extract, as an index or a header name "
+        "(default is 6, species_accuracy, or 1 with '--sizes')",
+    )
+    parser.add_argument(
+        "-m",
+        "--matrix",
+        dest="matrix",
+        action="store_true",
+        help="Build the whole matrix from all input files and (over)write the output file",
+    )
+    parser.add_argument(
+        "input_files",
+        nargs="+",
+        help="Tabular report file(s) to extract from (several only with '-m')",
+    )
     parser.add_argument("output_file", help="The output file")
 
     args = parser.parse_args()
+    if not args.matrix and len(args.input_files) != 1:
+        parser.error("more than one input file requires '-m'")
+    column = args.column
+    if column is None:
+        column = "1" if args.is_sizes else "6"
 
     # Initialize event logger
     logging.basicConfig(
@@ -86,24 +102,45 @@ def main():
         datefmt="%m-%d-%Y %I:%M:%S%p",
     )
 
+    if args.matrix:
+        # Read every report once, the column order comes from the first one
+        rows = []
+        order = []
+        for input_file in args.input_files:
+            input_order, new_row_data = read_report(
+                input_file, args.skip_formula_headers, column
+            )
+            order = order if order else input_order
+            missing = [
+                classifier for classifier in order if classifier not in new_row_data
+            ]
+            if missing:
+                logging.error(f"{input_file} is missing classifiers {missing}")
+                sys.exit(1)
+            rows.append([new_row_data[classifier] for classifier in order])
+
+        # Write to a temporary file and rename so a failed run never leaves a partial matrix
+        with open(args.output_file + ".tmp", "w") as out_file:
+            out_file.write("\t".join(order) + "\n")
+            for row in rows:
+                out_file.write("\t".join(row) + "\n")
+        os.replace(args.output_file + ".tmp", args.output_file)
+        logging.info(f"Wrote a {len(rows)} x {len(order)} matrix")
+        logging.info("Done!")
+        return
+
     # Get the new row data from the input file
-    new_row_data = get_new_row_data(
-        args.input_file, args.skip_formula_headers, args.is_sizes
+    order, new_row_data = read_report(
+        args.input_files[0], args.skip_formula_headers, column
     )
 
     # If this is the first line, write the order to the output file
     if args.first_line:
-        order = get_order_from_input(args.input_file, args.skip_formula_headers)
-        order_str = f"{order[0]}"
-        for classifier in order[1:]:
-            order_str += f"\t{classifier}"
         with open(args.output_file, "a") as out_file:
-            out_file.write(order_str + "\n")
+            out_file.write("\t".join(order) + "\n")
 
     order = get_order_from_output(args.output_file)
-    new_row_str = f"{new_row_data[order[0]]}"
-    for classifier in order[1:]:
-        new_row_str += f"\t{new_row_data[classifier]}"
+    new_row_str = "\t".join(new_row_data[classifier] for classifier in order)
     with open(args.output_file, "a") as out_file:
         out_file.write(new_row_str + "\n")
 
@@ -0,0 +1,136 @@
+import numpy as np
+
+# Ranks of a CAMI profile, from the top
+PROFILE_RANKS = (
+    "superkingdom",
+    "phylum",
+    "class",
+    "order",
+    "family",
+    "genus",
+    "species",
+    "strain",
+)
+CAMI_VERSION = "0.9.1"
+DISTANCE_COLUMNS = ("classifier", "rank", "l1", "bray_curtis")
+
+
+def count_taxids(taxids):
+    # Distinct tax ids and how many reads have each
+    taxids = np.asarray(taxids, dtype=np.int64)
+    if len(taxids) == 0:
+        return taxids, np.zeros(0, dtype=np.int64)
+    # Count into a dense array when the ids are packed closely enough, otherwise sort
+    if taxids.min() >= 0 and taxids.max() < max(4 * len(taxids), 1 << 16):
+        counts = np.bincount(taxids)
+        distinct = np.flatnonzero(counts)
+        return distinct, counts[distinct]
+    return np.unique(taxids, return_counts=True)
+
+
+def get_node_counts(taxonomy, taxids):
+    # Reads assigned directly to each node of an ArrayTaxonomy, and the tax ids other
+    # than 0 that the taxonomy doesn't have (their reads count as unclassified)
+    distinct, counts = count_taxids(taxids)
+    rows = taxonomy.rows(distinct)
+    known = rows >= 0
+    node_counts = np.zeros(len(taxonomy), dtype=np.int64)
+    node_counts[rows[known]] = counts[known]
+    return node_counts, distinct[~known & (distinct != 0)]
+
+
+def get_levels(taxonomy):
+    # Every non-root row grouped by depth, deepest first
+    order = np.argsort(taxonomy.depths, kind="stable")
+    boundaries = np.searchsorted(
+        taxonomy.depths[order], np.arange(1, taxonomy.max_depth + 2)
+    ).tolist()
+    return [order[start:end] for start, end in zip(boundaries, boundaries[1:])][::-1]
+
+
+def roll_up(taxonomy, node_counts, levels):
+    # Reads at or below each node, one bottom-up pass: a level is only added to its
+    # parents once every level below it has been added to it
+    totals = node_counts.copy()
+    for rows in levels:
+        rows = rows[totals[rows] > 0]
+        np.add.at(totals, taxonomy.parents[rows], totals[rows])
+    return totals
+
+
+def get_rank_rows(taxonomy):
+    # The rows of each profile rank the taxonomy has
+    return {
+        rank: np.flatnonzero(taxonomy.ranks == taxonomy.rank_ids[rank])
+        for rank in PROFILE_RANKS
+        if rank in taxonomy.rank_ids
+    }
+
+
+def write_profile(
+    out_file, taxonomy, rank_rows, totals, total_reads, sample_id, taxonomy_id
+):
+    # CAMI profile, the percentage of a node is of all reads (unclassified included),
+    # so a rank adds up to less than 100 when reads weren't classified to it
+    out_file.write(
+        f"@SampleID:{sample_id}\n@Version:{CAMI_VERSION}\n"
+        f"@Ranks:{'|'.join(PROFILE_RANKS)}\n@TaxonomyID:{taxonomy_id}\n"
+        "@@TAXID\tRANK\tTAXPATH\tTAXPATHSN\tPERCENTAGE\n"
+    )
+    # The TAXPATH and TAXPATHSN of every written node, a node's extend those of its
+    # closest ancestor at a rank above (which has reads too, so it was written)
+    paths = {}
+    for rank_index, rank in enumerate(PROFILE_RANKS):
+        if rank not in rank_rows:
+            continue
+        rows = rank_rows[rank][totals[rank_rows[rank]] > 0]
+        # Most abundant first
+        rows = rows[np.lexsort((taxonomy.taxids[rows], -totals[rows]))]
+        prefix_rows = np.full(len(rows), -1, dtype=np.int64)
+        prefix_ranks = np.zeros(len(rows), dtype=np.int64)
+        for above_index in range(rank_index - 1, -1, -1):
+            pending = np.flatnonzero(prefix_rows < 0)
+            if len(pending) == 0:
+                break
+            ancestors = taxonomy.ancestors_at_rank(
+                rows[pending], PROFILE_RANKS[above_index]
+            )
+            found = ancestors >= 0
+            prefix_rows[pending[found]] = ancestors[found]
+            prefix_ranks[pending[found]] = above_index
+
+        lines = []
+        percentages = 100 * totals[rows] / max(total_reads, 1)
+        for row, taxid, name, prefix_row, prefix_rank, percentage in zip(
+            rows.tolist(),
+            taxonomy.taxids[rows].tolist(),
+            taxonomy.names(rows),
+            prefix_rows.tolist(),
+            prefix_ranks.tolist(),
+            percentages.tolist(),
+        ):
+            if prefix_row < 0:
+                # Ranks without an ancestor are empty
+                taxpath, taxpathsn = "|" * rank_index, "|" * rank_index
+            else:
+                taxpath, taxpathsn = paths[prefix_row]
+                separators = "|" * (rank_index - prefix_rank)
+                taxpath += separators
+                taxpathsn += separators
+            taxpath, taxpathsn = f"{taxpath}{taxid}", taxpathsn + name
+            paths[row] = (taxpath, taxpathsn)
+            lines.append(f"{taxid}\t{rank}\t{taxpath}\t{taxpathsn}\t{percentage:.6f}\n")
+        out_file.write("".join(lines))
+
+
+def profile_distances(rank_rows, totals1, total_reads1, totals2, total_reads2):
+    # L1 and Bray-Curtis distance between the relative abundances of two profiles at
+    # each rank, L1 is between 0 and 2 and Bray-Curtis between 0 and 1
+    distances = {}
+    for rank, rows in rank_rows.items():
+        abundances1 = totals1[rows] / max(total_reads1, 1)
+        abundances2 = totals2[rows] / max(total_reads2, 1)
+        l1 = float(np.abs(abundances1 - abundances2).sum())
+        total = float(abundances1.sum() + abundances2.sum())
+        distances[rank] = (l1, l1 / total if total > 0 else 0.0)
+    return distances
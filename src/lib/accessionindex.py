@@ -0,0 +1,229 @@
+import fcntl
+import logging
+import mmap
+import os
+import sys
+
+from lib.input import open_input
+from lib.lib import read_accession2taxid
+from lib.output import BulkWriter
+
+# An accession index is a directory holding a snapshot of an accession2taxid and an
+# append log of the updates applied to it since:
+#   accession2taxid: "<accession>\t<taxid>" lines sorted by accession, so single
+#     accessions are found with a binary search of the memory mapped file
+#   log.tsv: "+\t<accession>\t<taxid>" (added or changed) and "-\t<accession>"
+#     (removed) lines, every update ends with a "#\t<records>\t<source>" line, records
+#     after the last one are from an interrupted update and are ignored
+# Updates only append to the log. Once the log grows past COMPACT_RATIO of the
+# snapshot's size it is merged into a new snapshot and emptied. Replaying a log onto
+# the snapshot it was merged into changes nothing, so a compaction interrupted between
+# the two steps loses nothing.
+SNAPSHOT_NAME = "accession2taxid"
+LOG_NAME = "log.tsv"
+COMPACT_RATIO = 0.1
+COPY_SIZE = 64 * 1024 * 1024
+
+
+def is_accession_index(directory):
+    return os.path.isfile(os.path.join(directory, SNAPSHOT_NAME))
+
+
+def read_log(log_file):
+    # accession -> tax id (None if removed) after every complete update, the number of
+    # records and the size of the complete part of the log
+    updates, pending = {}, []
+    records, complete_size, position = 0, 0, 0
+    log_file.seek(0)
+    for line in log_file:
+        position += len(line)
+        if not line.endswith(b"\n"):
+            break
+        fields = line[:-1].decode().split("\t")
+        if fields[0] == "+" and len(fields) == 3:
+            pending.append((fields[1], fields[2]))
+        elif fields[0] == "-" and len(fields) == 2:
+            pending.append((fields[1], None))
+        elif fields[0] == "#":
+            updates.update(pending)
+            records += len(pending)
+            pending.clear()
+            complete_size = position
+        else:
+            logging.error(f"{log_file.name} is corrupt at byte {position - len(line)}")
+            sys.exit(1)
+    return updates, records, complete_size
+
+
+def map_snapshot(directory):
+    with open(os.path.join(directory, SNAPSHOT_NAME), "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def find_line(data, accession, low=0):
+    # Binary search of the sorted snapshot for the start of the first line (at or after
+    # low) whose accession isn't below accession (bytes)
+    high = len(data)
+    while low < high:
+        middle = (low + high) // 2
+        start = data.rfind(b"\n", 0, middle) + 1
+        end = data.find(b"\n", start) + 1
+        if data[start : data.find(b"\t", start, end)] < accession:
+            low = end
+        else:
+            high = start
+    return low
+
+
+def read_line(data, start):
+    # The accession and tax id of the line at start, and where the next line starts
+    end = data.find(b"\n", start)
+    accession, _, taxid = data[start:end].partition(b"\t")
+    return accession, taxid, end + 1
+
+
+def lookup_snapshot(data, accession):
+    accession = accession.encode()
+    start = find_line(data, accession)
+    if start == len(data):
+        return None
+    line_accession, taxid, _ = read_line(data, start)
+    return taxid.decode() if line_accession == accession else None
+
+
+def write_snapshot(directory, accession2taxid_items):
+    # The items are (accession, tax id) pairs sorted by accession
+    snapshot = os.path.join(directory, SNAPSHOT_NAME)
+    with BulkWriter(snapshot + ".tmp", compression=None) as out_file:
+        for accession, taxid in accession2taxid_items:
+            out_file.write(f"{accession}\t{taxid}\n")
+    os.replace(snapshot + ".tmp", snapshot)
+
+
+def create_accession_index(directory, accession2taxid):
+    if is_accession_index(directory):
+        logging.error(f"{directory} already holds an accession index")
+        sys.exit(1)
+    os.makedirs(directory, exist_ok=True)
+    open(os.path.join(directory, LOG_NAME), "wb").close()
+    write_snapshot(directory, sorted(accession2taxid.items()))
+
+
+def load_accession_index(directory):
+    # The whole index as a dict, like load_accession2taxid. The log is read under a
+    # shared lock and the snapshot opened before it is released, so a compaction
+    # running at the same time can't pair an emptied log with the old snapshot.
+    with open(os.path.join(directory, LOG_NAME), "rb") as log_file:
+        fcntl.flock(log_file, fcntl.LOCK_SH)
+        updates, _, _ = read_log(log_file)
+        snapshot_file = open_input(os.path.join(directory, SNAPSHOT_NAME), "r")
+    with snapshot_file:
+        accession2taxid = read_accession2taxid(snapshot_file)
+    for accession, taxid in updates.items():
+        if taxid is None:
+            accession2taxid.pop(accession, None)
+        else:
+            accession2taxid[accession] = taxid
+    return accession2taxid
+
+
+def copy_range(data, start, end, out_file):
+    for position in range(start, end, COPY_SIZE):
+        out_file.write(data[position : min(position + COPY_SIZE, end)])
+
+
+def compact_accession_index(directory, updates, log_file):
+    # Merges the sorted updates into a new snapshot, copying the unchanged lines
+    # between two updated accessions in bulk, then empties the log
+    data = map_snapshot(directory)
+    snapshot = os.path.join(directory, SNAPSHOT_NAME)
+    position = 0
+    with BulkWriter(snapshot + ".tmp", compression=None) as out_file:
+        for accession, taxid in sorted(updates.items()):
+            key = accession.encode()
+            start = find_line(data, key, position)
+            copy_range(data, position, start, out_file)
+            position = start
+            if start < len(data):
+                line_accession, _, next_start = read_line(data, start)
+                if line_accession == key:
+                    position = next_start
+            if taxid is not None:
+                out_file.write(f"{accession}\t{taxid}\n")
+        copy_range(data, position, len(data), out_file)
+    os.replace(snapshot + ".tmp", snapshot)
+    log_file.truncate(0)
+    log_file.flush()
+    os.fsync(log_file.fileno())
+
+
+def update_accession_index(directory, additions, removals, source, compact=False):
+    # Appends the additions (accession -> tax id) and removals (accessions) that change
+    # the index to its log, compacting it when the log has grown large enough. Returns
+    # (accession, old tax id, new tax id or None if removed) for every accession that
+    # had a tax id before and now has another one, and the number of records appended.
+    conflicts = sorted(set(additions) & set(removals))
+    if conflicts:
+        logging.error(
+            f"{len(conflicts)} accessions are both added and removed, e.g. {conflicts[0]}"
+        )
+        logging.error(f"please fix this before running again - exiting")
+        sys.exit(1)
+
+    changes, records = [], []
+    with open(os.path.join(directory, LOG_NAME), "r+b") as log_file:
+        # One update at a time, the lock is released when the log is closed
+        fcntl.flock(log_file, fcntl.LOCK_EX)
+        updates, log_records, complete_size = read_log(log_file)
+        data = map_snapshot(directory)
+
+        def current_taxid(accession):
+            if accession in updates:
+                return updates[accession]
+            return lookup_snapshot(data, accession)
+
+        for accession in sorted(additions):
+            old_taxid, taxid = current_taxid(accession), additions[accession]
+            if old_taxid == taxid:
+                continue
+            records.append(f"+\t{accession}\t{taxid}\n")
+            updates[accession] = taxid
+            if old_taxid is not None:
+                changes.append((accession, old_taxid, taxid))
+        for accession in sorted(set(removals)):
+            old_taxid = current_taxid(accession)
+            if old_taxid is None:
+                continue
+            records.append(f"-\t{accession}\n")
+            updates[accession] = None
+            changes.append((accession, old_taxid, None))
+
+        if records:
+            # Drop what an interrupted update left behind before appending
+            log_file.truncate(complete_size)
+            log_file.seek(complete_size)
+            records.append(f"#\t{len(records)}\t{source}\n")
+            log_file.write("".join(records).encode())
+            log_file.flush()
+            os.fsync(log_file.fileno())
+            log_records += len(records) - 1
+
+        log_size = log_file.seek(0, os.SEEK_END)
+        if compact or log_size > COMPACT_RATIO * max(len(data), 1):
+            logging.info(f"Compacting {log_records} log records into the snapshot")
+            compact_accession_index(directory, updates, log_file)
+    return changes, max(0, len(records) - 1)
+
+
+def read_accessions(file):
+    # The first column of every line without the version, like NCBI's dead accession
+    # lists (whose 'accession' header line is skipped)
+    accessions = []
+    with open_input(file, "r") as f:
+        for line in f:
+            fields = line.split(None, 1)
+            if fields and fields[0] != "accession":
+                accessions.append(fields[0].split(".")[0])
+    return accessions
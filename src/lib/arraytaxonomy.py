@@ -0,0 +1,388 @@
+import logging
+import mmap
+import os
+import sys
+from bisect import bisect_left
+
+import numpy as np
+
+from lib.input import open_input
+from lib.lookup import TaxonomyNode
+
+# Array taxonomy layout (little endian), the same bytes in a file or in memory:
+#   magic (8 bytes), node count n (uint64), rank count r (uint64), pool size (uint64)
+#   taxids: int64[n], sorted, node i is the node with taxids[i]
+#   name_offsets: int64[n + 1], the scientific name of node i is pool[name_offsets[i]:name_offsets[i + 1]]
+#   rank_offsets: int64[r + 1], rank name j is pool[rank_offsets[j]:rank_offsets[j + 1]]
+#   parents: int32[n], index of the parent node, the root is its own parent
+#   depths: int32[n], steps from the root
+#   ranks: uint16[n], index of the rank name
+#   pool: every scientific name, then every rank name
+# Nothing is copied when the file is memory mapped, so workers forked from the loading
+# process (or mapping the same file) share one copy of the taxonomy through the page cache.
+ARRAY_MAGIC = b"TAXARRS1"
+HEADER_SIZE = len(ARRAY_MAGIC) + 24
+MAX_DEPTH = 1 << 16
+SECTIONS = (
+    ("taxids", "<i8"),
+    ("name_offsets", "<i8"),
+    ("rank_offsets", "<i8"),
+    ("parents", "<i4"),
+    ("depths", "<i4"),
+    ("ranks", "<u2"),
+    ("pool", np.uint8),
+)
+
+
+class ArrayTaxonomy:
+    # The parts of taxonomy.Taxonomy the scripts use (node, parent, lca) plus vectorized
+    # versions working on arrays of node indices
+    def __init__(self, buffer, owner=None, source=None):
+        # owner is the mmap behind buffer, source says how another process attaches
+        # the same buffer (a file path)
+        self.owner = owner
+        self.source = source
+        # Nothing to release until every view exists
+        self.closed = True
+        self.data = memoryview(buffer)
+        if bytes(self.data[: len(ARRAY_MAGIC)]) != ARRAY_MAGIC:
+            raise ValueError("not an array taxonomy")
+        size, rank_count, pool_size = np.frombuffer(
+            self.data, "<u8", 3, len(ARRAY_MAGIC)
+        ).tolist()
+        self.size = size
+
+        offset = HEADER_SIZE
+        sections = {}
+        counts = (size, size + 1, rank_count + 1, size, size, size, pool_size)
+        for (name, dtype), count in zip(SECTIONS, counts):
+            sections[name] = (offset, count)
+            offset += np.dtype(dtype).itemsize * count
+            setattr(
+                self, name, np.frombuffer(self.data, dtype, count, sections[name][0])
+            )
+        if len(self.data) != offset:
+            raise ValueError("array taxonomy is truncated or corrupt")
+
+        # Memoryviews index faster than numpy arrays for the one-node-at-a-time methods
+        self.views = {}
+        for name, format, itemsize in (
+            ("taxids", "q", 8),
+            ("name_offsets", "q", 8),
+            ("parents", "i", 4),
+            ("depths", "i", 4),
+            ("ranks", "H", 2),
+        ):
+            start, count = sections[name]
+            self.views[name] = self.data[start : start + itemsize * count].cast(format)
+        self.pool_view = self.data[sections["pool"][0] : offset]
+
+        rank_offsets = self.rank_offsets.tolist()
+        self.rank_names = [
+            bytes(self.pool_view[start:end]).decode()
+            for start, end in zip(rank_offsets, rank_offsets[1:])
+        ]
+        self.rank_ids = {rank: i for i, rank in enumerate(self.rank_names)}
+        self.max_depth = int(self.depths.max()) if size else 0
+        self.closed = False
+
+    def __len__(self):
+        return self.size
+
+    def __reduce__(self):
+        # Pickled for a worker as where to attach, not as the arrays themselves
+        if self.source is not None and self.source[0] == "file":
+            return load_array_taxonomy, (self.source[1],)
+        return ArrayTaxonomy, (bytes(self.data),)
+
+    def row(self, taxid):
+        # Index of the node, -1 if the taxonomy doesn't have it
+        try:
+            taxid = int(taxid)
+        except ValueError:
+            return -1
+        taxids = self.views["taxids"]
+        row = bisect_left(taxids, taxid)
+        if row < self.size and taxids[row] == taxid:
+            return row
+        return -1
+
+    def node_at(self, row):
+        name_offsets = self.views["name_offsets"]
+        parent = self.views["parents"][row]
+        return TaxonomyNode(
+            str(self.views["taxids"][row]),
+            bytes(self.pool_view[name_offsets[row] : name_offsets[row + 1]]).decode(),
+            None if parent == row else str(self.views["taxids"][parent]),
+            self.rank_names[self.views["ranks"][row]],
+        )
+
+    def names(self, rows):
+        # Scientific names of many rows
+        pool = self.pool_view
+        return [
+            bytes(pool[start:end]).decode()
+            for start, end in zip(
+                self.name_offsets[rows].tolist(), self.name_offsets[rows + 1].tolist()
+            )
+        ]
+
+    def node(self, taxid):
+        row = self.row(taxid)
+        return None if row < 0 else self.node_at(row)
+
+    def parent(self, taxid, at_rank=None):
+        # The parent node, or with at_rank the node itself or the closest ancestor of
+        # that rank, like Taxonomy.parent. None when there is no such node.
+        row = self.row(taxid)
+        if row < 0:
+            return None
+        parents = self.views["parents"]
+        if at_rank is None:
+            parent = parents[row]
+            return None if parent == row else self.node_at(parent)
+
+        rank = self.rank_ids.get(at_rank)
+        if rank is None:
+            return None
+        ranks = self.views["ranks"]
+        while ranks[row] != rank:
+            parent = parents[row]
+            if parent == row:
+                return None
+            row = parent
+        return self.node_at(row)
+
+    def lca_row(self, row1, row2):
+        parents, depths = self.views["parents"], self.views["depths"]
+        while depths[row1] > depths[row2]:
+            row1 = parents[row1]
+        while depths[row2] > depths[row1]:
+            row2 = parents[row2]
+        while row1 != row2:
+            if parents[row1] == row1:
+                raise KeyError("tax ids have no common ancestor")
+            row1, row2 = parents[row1], parents[row2]
+        return row1
+
+    def lca(self, taxid1, taxid2):
+        rows = []
+        for taxid in (taxid1, taxid2):
+            row = self.row(taxid)
+            if row < 0:
+                raise KeyError(f"Tax ID {taxid} not found in taxonomy")
+            rows.append(row)
+        return self.node_at(self.lca_row(*rows))
+
+    def rows(self, taxids):
+        # Vectorized row(), an int64 array of node indices with -1 for unknown tax ids
+        taxids = np.asarray(taxids, dtype=np.int64)
+        if self.size == 0:
+            return np.full(len(taxids), -1, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.taxids, taxids), self.size - 1)
+        rows[self.taxids[rows] != taxids] = -1
+        return rows
+
+    def ancestors_at_rank(self, rows, rank):
+        # Vectorized parent(at_rank=rank) for known rows, -1 where there is no such node
+        rows = np.array(rows, dtype=np.int64)
+        result = np.full(len(rows), -1, dtype=np.int64)
+        rank_id = self.rank_ids.get(rank)
+        if rank_id is None:
+            return result
+        pending = np.arange(len(rows))
+        for _ in range(self.max_depth + 1):
+            found = self.ranks[rows] == rank_id
+            result[pending[found]] = rows[found]
+            parents = self.parents[rows].astype(np.int64)
+            # Stop following a row at its node of the rank or at the root
+            keep = ~found & (parents != rows)
+            pending, rows = pending[keep], parents[keep]
+            if len(rows) == 0:
+                break
+        return result
+
+    def lca_rows(self, rows1, rows2):
+        # Vectorized LCA of known rows, steps every pair up one level at a time
+        rows1 = np.array(rows1, dtype=np.int64)
+        rows2 = np.array(rows2, dtype=np.int64)
+        depths1, depths2 = self.depths[rows1], self.depths[rows2]
+        while True:
+            deeper1, deeper2 = depths1 > depths2, depths2 > depths1
+            if not (deeper1.any() or deeper2.any()):
+                break
+            rows1[deeper1] = self.parents[rows1[deeper1]]
+            depths1[deeper1] -= 1
+            rows2[deeper2] = self.parents[rows2[deeper2]]
+            depths2[deeper2] -= 1
+        differ = np.flatnonzero(rows1 != rows2)
+        while len(differ):
+            if (self.parents[rows1[differ]] == rows1[differ]).any():
+                raise KeyError("tax ids have no common ancestor")
+            rows1[differ] = self.parents[rows1[differ]]
+            rows2[differ] = self.parents[rows2[differ]]
+            differ = differ[rows1[differ] != rows2[differ]]
+        return rows1
+
+    def lca_of_sets(self, taxid_sets):
+        # The LCA tax id of each set like pipeline.lca_of_taxids, one vectorized step
+        # per position in the sets instead of one lca() call per tax id
+        results = [""] * len(taxid_sets)
+        lengths = np.fromiter(map(len, taxid_sets), dtype=np.int64, count=len(results))
+        taxids = np.fromiter(
+            (int(taxid) for taxids in taxid_sets for taxid in taxids),
+            dtype=np.int64,
+            count=int(lengths.sum()),
+        )
+        starts = np.cumsum(lengths) - lengths
+        set_of_taxid = np.repeat(np.arange(len(results)), lengths)
+        has_zero = np.zeros(len(results), dtype=bool)
+        has_zero[set_of_taxid[taxids == 0]] = True
+        for i in np.flatnonzero(lengths == 1).tolist():
+            results[i] = str(taxid_sets[i][0])
+
+        # A single tax id is its own LCA, whether or not the taxonomy has it
+        selected = (lengths > 1) & ~has_zero
+        sets = np.flatnonzero(selected)
+        rows = self.rows(taxids)
+        missing = (rows < 0) & selected[set_of_taxid]
+        if missing.any():
+            raise KeyError(f"Tax ID {taxids[missing][0]} not found in taxonomy")
+        if len(sets):
+            lca = rows[starts[sets]]
+            for position in range(1, int(lengths[sets].max())):
+                active = lengths[sets] > position
+                lca[active] = self.lca_rows(
+                    lca[active], rows[starts[sets[active]] + position]
+                )
+            for i, taxid in zip(sets.tolist(), self.taxids[lca].tolist()):
+                results[i] = str(taxid)
+        for i in np.flatnonzero(has_zero).tolist():
+            results[i] = "0"
+        return results
+
+    def close(self):
+        # A memory map can only be closed once nothing views it
+        if self.closed:
+            return
+        self.closed = True
+        for name, _ in SECTIONS:
+            delattr(self, name)
+        for view in self.views.values():
+            view.release()
+        self.pool_view.release()
+        self.data.release()
+        if self.owner is not None:
+            self.owner.close()
+
+    def __del__(self):
+        # Before the owner's own __del__, which fails while the views exist
+        self.close()
+
+
+def read_nodes(directory):
+    taxids, parent_taxids, ranks = [], [], []
+    with open_input(os.path.join(directory, "nodes.dmp"), "r") as f:
+        for line in f:
+            fields = line.split("\t|\t", 3)
+            taxids.append(int(fields[0]))
+            parent_taxids.append(int(fields[1]))
+            ranks.append(fields[2])
+    return taxids, parent_taxids, ranks
+
+
+def read_scientific_names(directory):
+    names = {}
+    with open_input(os.path.join(directory, "names.dmp"), "r") as f:
+        for line in f:
+            fields = line.split("\t|\t")
+            if fields[3].rstrip("\t|\n") == "scientific name":
+                names[int(fields[0])] = fields[1]
+    return names
+
+
+def get_depths(parents):
+    # Pointer jumping, each pass doubles how far every node has looked up the tree
+    rows = np.arange(len(parents), dtype=np.int32)
+    depths = (parents != rows).astype(np.int32)
+    ancestors = parents.copy()
+    for _ in range(MAX_DEPTH.bit_length() + 1):
+        if (ancestors[ancestors] == ancestors).all():
+            return depths + depths[ancestors]
+        depths = depths + depths[ancestors]
+        ancestors = ancestors[ancestors]
+    raise ValueError(f"nodes.dmp has a cycle or is deeper than {MAX_DEPTH} levels")
+
+
+def build_array_taxonomy(directory):
+    # The bytes of an array taxonomy for the nodes.dmp and names.dmp in directory
+    taxids, parent_taxids, ranks = read_nodes(directory)
+    names = read_scientific_names(directory)
+
+    taxids = np.array(taxids, dtype=np.int64)
+    order = np.argsort(taxids, kind="stable")
+    taxids = taxids[order]
+    if np.any(taxids[1:] == taxids[:-1]):
+        raise ValueError("nodes.dmp has a tax id more than once")
+    parent_taxids = np.array(parent_taxids, dtype=np.int64)[order]
+    parents = np.searchsorted(taxids, parent_taxids)
+    parents[parents == len(taxids)] = 0
+    if len(taxids) and np.any(taxids[parents] != parent_taxids):
+        missing = parent_taxids[taxids[parents] != parent_taxids][0]
+        raise ValueError(f"nodes.dmp has no node for parent tax id {missing}")
+    parents = parents.astype(np.int32)
+
+    rank_names, rank_ids = np.unique(np.array(ranks, dtype=object), return_inverse=True)
+    rank_ids = rank_ids.astype(np.uint16)[order]
+
+    encoded_names = [names.get(taxid, "").encode() for taxid in taxids.tolist()]
+    encoded_ranks = [rank.encode() for rank in rank_names.tolist()]
+    name_offsets = np.zeros(len(taxids) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, encoded_names), np.int64), out=name_offsets[1:])
+    rank_offsets = np.zeros(len(encoded_ranks) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, encoded_ranks), np.int64), out=rank_offsets[1:])
+    rank_offsets += name_offsets[-1]
+    pool = b"".join(encoded_names) + b"".join(encoded_ranks)
+
+    return b"".join(
+        (
+            ARRAY_MAGIC,
+            np.array([len(taxids), len(encoded_ranks), len(pool)], "<u8").tobytes(),
+            taxids.astype("<i8").tobytes(),
+            name_offsets.astype("<i8").tobytes(),
+            rank_offsets.astype("<i8").tobytes(),
+            parents.astype("<i4").tobytes(),
+            get_depths(parents).astype("<i4").tobytes(),
+            rank_ids.astype("<u2").tobytes(),
+            pool,
+        )
+    )
+
+
+def is_array_taxonomy(filename):
+    with open(filename, "rb") as f:
+        return f.read(len(ARRAY_MAGIC)) == ARRAY_MAGIC
+
+
+def load_array_taxonomy(filename):
+    # Memory mapped read-only, forked workers and other processes share the pages
+    with open(filename, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return ArrayTaxonomy(
+            data, owner=data, source=("file", os.path.realpath(filename))
+        )
+    except ValueError as e:
+        logging.error(f"{filename} is not a valid array taxonomy: {e}")
+        sys.exit(1)
+
+
+def get_array_taxonomy(path):
+    # For callers that need the arrays: a file is memory mapped, a directory converted
+    if os.path.isfile(path):
+        return load_array_taxonomy(path)
+    try:
+        return ArrayTaxonomy(build_array_taxonomy(path))
+    except (OSError, ValueError) as e:
+        logging.error(f"can't read the taxonomy in {path}: {e}")
+        sys.exit(1)
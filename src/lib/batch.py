@@ -0,0 +1,113 @@
+import glob
+import logging
+import os
+import sys
+from multiprocessing import get_context
+
+# Tables loaded once by the parent, forked workers read them without copying
+shared_tables = {}
+
+
+def is_batch(inputs, output_directory=None):
+    # Anything but one plain input file without an output directory is a batch
+    return (
+        len(inputs) > 1
+        or ("=" in inputs[0] and not os.path.exists(inputs[0]))
+        or glob.has_magic(inputs[0])
+        or output_directory is not None
+    )
+
+
+def split_pair(item):
+    # (input, output) of an '<input>=<output>' item, None for a plain file or glob. File
+    # names can hold '=' too, so an item is only a pair at an '=' whose left side is an
+    # existing file, and never when the whole item is one.
+    if "=" not in item or os.path.exists(item):
+        return None
+    position = item.find("=")
+    while position != -1:
+        if os.path.isfile(item[:position]):
+            return item[:position], item[position + 1 :]
+        position = item.find("=", position + 1)
+    logging.error(
+        f"'{item}' is neither a file nor an <input>=<output> pair of an existing input"
+    )
+    sys.exit(1)
+
+
+def get_input_output_pairs(inputs, output_directory=None, suffix=""):
+    # Inputs are '<input>=<output>' pairs, files or globs written to the output directory
+    pairs = []
+    for item in inputs:
+        pair = split_pair(item)
+        if pair is not None:
+            pairs.append(pair)
+            continue
+
+        matched_files = sorted(glob.glob(item)) if glob.has_magic(item) else [item]
+        if not matched_files:
+            logging.error(f"'{item}' did not match any files")
+            sys.exit(1)
+        if output_directory is None:
+            logging.error(
+                f"no output given for '{item}', use '<input>=<output>' or an output directory"
+            )
+            sys.exit(1)
+        for input_file in matched_files:
+            output_file = os.path.join(
+                output_directory, os.path.basename(input_file) + suffix
+            )
+            pairs.append((input_file, output_file))
+
+    # Make sure no output overwrites an input or another output
+    input_paths = set(os.path.realpath(input_file) for input_file, _ in pairs)
+    output_paths = [os.path.realpath(output_file) for _, output_file in pairs]
+    if len(set(output_paths)) != len(output_paths) or input_paths & set(output_paths):
+        logging.error("every input needs its own output that isn't also an input")
+        sys.exit(1)
+    return pairs
+
+
+def run_pair(task):
+    function, input_file, output_file = task
+    try:
+        total_lines = function(input_file, output_file, **shared_tables)
+    except SystemExit:
+        # The error is already logged, a worker exiting would hang the pool
+        total_lines = None
+    except (OSError, EOFError) as e:
+        # Unreadable inputs, e.g. a corrupt or truncated compressed file
+        logging.error(e)
+        total_lines = None
+    return input_file, output_file, total_lines
+
+
+def log_pair(input_file, output_file, total_lines):
+    if total_lines is None:
+        logging.error(f"failed to convert {input_file}, exiting...")
+        sys.exit(1)
+    logging.info(f"converted {total_lines} lines of {input_file} to {output_file}")
+
+
+def run_batch(function, pairs, threads, **tables):
+    # function(input_file, output_file, **tables) is run for every pair in a worker pool,
+    # returns the total lines converted
+    shared_tables.clear()
+    shared_tables.update(tables)
+    for _, output_file in pairs:
+        if os.path.dirname(output_file):
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+
+    tasks = [(function, input_file, output_file) for input_file, output_file in pairs]
+    total_lines = 0
+    if threads <= 1 or len(tasks) <= 1:
+        for result in map(run_pair, tasks):
+            log_pair(*result)
+            total_lines += result[2]
+        return total_lines
+
+    with get_context("fork").Pool(min(threads, len(tasks))) as pool:
+        for result in pool.imap_unordered(run_pair, tasks):
+            log_pair(*result)
+            total_lines += result[2]
+    return total_lines
@@ -0,0 +1,396 @@
+import logging
+import math
+
+from lib.input import open_input
+
+EVALUATION_LEVELS = ("genus", "species")
+
+
+def get_taxid_pair_counts(ground_truth_table, predicted_table):
+    # How many reads have each (true tax id, predicted tax id), reads missing from
+    # the prediction are unclassified and the last tax id of a repeated read is used
+    import numpy as np
+
+    from lib.readid2taxid import MAX_TAXID, get_read_ids
+
+    ground_truth_read_ids = get_read_ids(ground_truth_table)
+    if (
+        np.array_equal(ground_truth_table["offsets"], predicted_table["offsets"])
+        and np.array_equal(ground_truth_table["pool"], predicted_table["pool"])
+        and len(set(ground_truth_read_ids)) == len(ground_truth_read_ids)
+    ):
+        # Same reads in the same order, count the pairs without any lookups
+        taxids = np.stack(
+            (ground_truth_table["taxids"], predicted_table["taxids"]), axis=1
+        ).astype(np.int64)
+        if len(taxids) > 0 and (taxids.min() < 0 or taxids.max() > MAX_TAXID):
+            # Tax ids that don't fit in 32 bits can't be packed into one integer
+            unique_pairs, counts = np.unique(taxids, axis=0, return_counts=True)
+            return {
+                tuple(pair): count
+                for pair, count in zip(unique_pairs.tolist(), counts.tolist())
+            }
+        pairs = (taxids[:, 0] << 32) | taxids[:, 1]
+        unique_pairs, counts = np.unique(pairs, return_counts=True)
+        return {
+            (pair >> 32, pair & 0xFFFFFFFF): count
+            for pair, count in zip(unique_pairs.tolist(), counts.tolist())
+        }
+
+    ground_truth_readid2taxid = dict(
+        zip(ground_truth_read_ids, ground_truth_table["taxids"].tolist())
+    )
+    predicted_readid2taxid = dict(
+        zip(get_read_ids(predicted_table), predicted_table["taxids"].tolist())
+    )
+    return count_taxid_pairs(ground_truth_readid2taxid, predicted_readid2taxid)
+
+
+def count_taxid_pairs(ground_truth_readid2taxid, predicted_readid2taxid):
+    pair_counts = {}
+    for readid, true_taxid in ground_truth_readid2taxid.items():
+        pair = (true_taxid, predicted_readid2taxid.get(readid, 0))
+        pair_counts[pair] = pair_counts.get(pair, 0) + 1
+    return pair_counts
+
+
+def prefetch_lineages(taxids, taxonomy):
+    # Asks a lookup server for the species and genus of every tax id, and for the
+    # parent of the species of tax ids without a genus, in one request each
+    from lib.lookup import RemoteTaxonomy
+
+    if not isinstance(taxonomy, RemoteTaxonomy):
+        return
+    taxids = set(str(taxid) for taxid in taxids)
+    for level in EVALUATION_LEVELS:
+        taxonomy.prefetch_parents(taxids, level)
+    species_nodes = [
+        taxonomy.parent(taxid, at_rank="species")
+        for taxid in taxids
+        if taxonomy.parent(taxid, at_rank="genus") is None
+    ]
+    taxonomy.prefetch_nodes(
+        species_node.parent
+        for species_node in species_nodes
+        if species_node is not None
+    )
+
+
+def get_lineages_in_reference(filename, taxonomy, verbose):
+    warned = False
+    lineages = {}
+    lineages[0] = (None, None)
+
+    with open_input(filename, "r") as f:
+        ref_taxids = [line.strip().split("\t")[1] for line in f]
+    prefetch_lineages(ref_taxids, taxonomy)
+
+    for ref_taxid in ref_taxids:
+        # Find the species node
+        species_node = taxonomy.parent(ref_taxid, at_rank="species")
+        if species_node is None:
+            # If no species node is found, log it then exit
+            logging.error(
+                f"no species node found for reference tax id: {ref_taxid} - fix this and run again"
+            )
+            exit(1)
+
+        # Find the genus node
+        genus_node = taxonomy.parent(ref_taxid, at_rank="genus")
+        if genus_node is None:
+            # If no genus node is found, log appropriate messages
+            if not warned and not verbose:
+                logging.warning("a tax id that did not have a genus node was found")
+                logging.info(
+                    "provide option '-v' to log all tax ids without genus nodes"
+                )
+                warned = True
+            elif verbose:
+                logging.warning(f"tax id {ref_taxid} has no genus node")
+
+            # After logging, set the genus node to be the parent of the species node
+            genus_node = taxonomy.node(species_node.parent)
+
+        # Finally, add the lineages to the dictionary
+        species_taxid = int(species_node.id)
+        genus_taxid = int(genus_node.id)
+        ref_taxid_int = int(ref_taxid)
+        lineages[ref_taxid_int] = (genus_taxid, species_taxid)
+        if ref_taxid_int != species_taxid:
+            # The reference tax id isn't the same as the species tax id
+            # It is likely at a lower level, so add the species tax id too
+            lineages[species_taxid] = (genus_taxid, species_taxid)
+        lineages[genus_taxid] = (genus_taxid, None)
+
+    return lineages, warned
+
+
+def get_lineage(taxid, taxonomy, verbose, warned):
+    # Find the species node
+    species_node = taxonomy.parent(taxid, at_rank="species")
+    species_taxid = int(species_node.id) if species_node is not None else None
+
+    # Find the genus node
+    genus_node = taxonomy.parent(taxid, at_rank="genus")
+    if genus_node is None:
+        # If no genus node is found, log appropriate messages
+        if not warned and not verbose:
+            logging.warning("a tax id that did not have a genus node was found")
+            logging.info("provide option '-v' to log all tax ids without genus nodes")
+            warned = True
+        elif verbose:
+            logging.warning(f"tax id {taxid} has no genus node")
+
+        # After logging, try to set the genus node to be the parent of the species node
+        genus_node = (
+            taxonomy.node(species_node.parent) if species_node is not None else None
+        )
+    genus_taxid = int(genus_node.id) if genus_node is not None else None
+
+    return (genus_taxid, species_taxid), warned
+
+
+def compute_statistics(
+    pair_counts,
+    reference_lineages,
+    taxonomy,
+    ignore_unclassified,
+    outside_reference,
+    verbose,
+    warned,
+):
+    # Counts at each level for reads grouped by (true tax id, predicted tax id)
+    evaluation_levels = EVALUATION_LEVELS
+    stats = {}
+    for level in evaluation_levels:
+        stats[level + "_total"] = 0
+        stats[level + "_tp"] = 0
+        stats[level + "_fp"] = 0
+        stats[level + "_fn"] = 0
+        stats[level + "_unclassified_tn"] = 0
+        stats[level + "_unclassified_fp"] = 0
+        stats[level + "_not_in_ref_fp"] = 0
+        stats[level + "_not_in_ref_tn"] = 0
+
+    additional_lineages = {}
+    prefetch_lineages(
+        set(taxid for pair in pair_counts for taxid in pair)
+        - reference_lineages.keys(),
+        taxonomy,
+    )
+
+    # Reads with the same true and predicted tax ids are counted together
+    for (true_taxid, predicted_taxid), count in pair_counts.items():
+        if true_taxid == 0 and ignore_unclassified:
+            continue
+
+        if outside_reference and true_taxid in reference_lineages:
+            continue
+
+        # Get ground truth lineage nodes
+        true_lineage = (None, None)
+        if true_taxid in reference_lineages:
+            true_lineage = reference_lineages[true_taxid]
+        elif true_taxid in additional_lineages:
+            true_lineage = additional_lineages[true_taxid]
+        else:
+            true_lineage, warned = get_lineage(
+                str(true_taxid), taxonomy, verbose, warned
+            )
+            additional_lineages[true_taxid] = true_lineage
+            if true_taxid != true_lineage[1] and true_lineage[1] is not None:
+                additional_lineages[(true_lineage[1])] = true_lineage
+            if true_lineage[0] is not None:
+                additional_lineages[true_lineage[0]] = (true_lineage[0], None)
+
+        # # Test that the ground truth lineage doesn't have a None value
+        # if true_lineage[0] is None or true_lineage[1] is None:
+        #     logging.error(f"ground truth lineage was (genus, species): {true_lineage}")
+        #     exit()
+
+        # Get the lineage nodes for the predicted taxid
+        predicted_lineage = (None, None)
+        if predicted_taxid in reference_lineages:
+            predicted_lineage = reference_lineages[predicted_taxid]
+        elif predicted_taxid in additional_lineages:
+            predicted_lineage = additional_lineages[predicted_taxid]
+        else:
+            predicted_lineage, warned = get_lineage(
+                str(predicted_taxid), taxonomy, verbose, warned
+            )
+            additional_lineages[predicted_taxid] = predicted_lineage
+            if (
+                predicted_taxid != predicted_lineage[1]
+                and predicted_lineage[1] is not None
+            ):
+                additional_lineages[(predicted_lineage[1])] = predicted_lineage
+            if predicted_lineage[0] is not None:
+                additional_lineages[predicted_lineage[0]] = (predicted_lineage[0], None)
+
+        # Increment the correct count based on the observed lineage
+        for true_taxid, predicted_taxid, level in zip(
+            true_lineage, predicted_lineage, evaluation_levels
+        ):
+
+            if true_taxid is None and predicted_taxid is None:
+                stats[level + "_unclassified_tn"] += count
+            elif true_taxid is None and predicted_taxid is not None:
+                stats[level + "_unclassified_fp"] += count
+            elif true_taxid is not None and predicted_taxid is None:
+                if true_taxid in reference_lineages:
+                    # Classifier could have made the correct assignment but failed to do so
+                    stats[level + "_fn"] += count
+                else:
+                    # Classifier could not have made the correct assignment
+                    # and correctly abstained from making one
+                    stats[level + "_not_in_ref_tn"] += count
+            else:
+                # Both true tax id and predicted tax id are NOT 'None'
+                if true_taxid in reference_lineages:
+                    # Classifer could have made the correct assignment, check if it did
+                    if true_taxid == predicted_taxid:
+                        stats[level + "_tp"] += count
+                    else:
+                        stats[level + "_fp"] += count
+                else:
+                    # Classifier could not have made the correct assignment, but it made an assignment anyways
+                    assert true_taxid != predicted_taxid
+                    stats[level + "_not_in_ref_fp"] += count
+
+            # Increment the total count
+            stats[level + "_total"] += count
+
+    # Some assertions for logic correctness
+    if ignore_unclassified:
+        for level in evaluation_levels:
+            assert stats[level + "_unclassified_fp"] == 0
+            assert stats[level + "_unclassified_tn"] == 0
+
+    return stats
+
+
+def get_standard_error(successes, trials, sample_fraction):
+    # Standard error (in percent) of a proportion estimated from the reads of a sample
+    # holding sample_fraction of them, with the finite population correction since
+    # the sample is drawn from a fixed set of reads without replacement
+    if trials == 0:
+        return "undef"
+    proportion = successes / trials
+    return (
+        math.sqrt(proportion * (1 - proportion) / trials * (1 - sample_fraction)) * 100
+    )
+
+
+def print_statistics(
+    stats,
+    classifier_name,
+    give_formulas,
+    include_header,
+    outside_reference,
+    sample_fraction=None,
+):
+    # Print formulas if needed
+    if give_formulas:
+        print("TP = True Positives, FP = False Positives, FN = False Negatives")
+        print("precision = TP / (TP + FP)")
+        print("recall = TP / (TP + FN)")
+        print("accuracy = (TP + TN) / (TP + FP + FN + TN)\n")
+        if sample_fraction is not None:
+            print(f"computed on a {sample_fraction} fraction of the reads")
+            print(
+                "standard error (SE) = sqrt(p * (1 - p) / n * (1 - fraction)), p being "
+                "the statistic and n its denominator, 95% interval = p +/- 1.96 * SE\n"
+            )
+
+    print_string = ""
+    # Print statistics
+    if classifier_name is not None:
+        print_string += f"{classifier_name}\t"
+    else:
+        print_string += "<No name provided>\t"
+
+    genus_tp, genus_fn = stats["genus_tp"], stats["genus_fn"]
+    genus_fp = (
+        stats["genus_fp"]
+        + stats["genus_unclassified_fp"]
+        + stats["genus_not_in_ref_fp"]
+    )
+    genus_tn = stats["genus_unclassified_tn"] + stats["genus_not_in_ref_tn"]
+
+    species_tp, species_fn = stats["species_tp"], stats["species_fn"]
+    species_fp = (
+        stats["species_fp"]
+        + stats["species_unclassified_fp"]
+        + stats["species_not_in_ref_fp"]
+    )
+    species_tn = stats["species_unclassified_tn"] + stats["species_not_in_ref_tn"]
+
+    try:
+        genus_recall = (genus_tp / (genus_tp + genus_fn)) * 100
+    except ZeroDivisionError:
+        genus_recall = "undef"
+
+    try:
+        genus_precision = (genus_tp / (genus_tp + genus_fp)) * 100
+    except ZeroDivisionError:
+        genus_precision = "undef"
+
+    try:
+        genus_accuracy = (
+            (genus_tp + genus_tn) / (genus_tp + genus_tn + genus_fn + genus_fp)
+        ) * 100
+    except ZeroDivisionError:
+        genus_accuracy = "undef"
+
+    try:
+        species_recall = (species_tp / (species_tp + species_fn)) * 100
+    except ZeroDivisionError:
+        species_recall = "undef"
+
+    try:
+        species_precision = (species_tp / (species_tp + species_fp)) * 100
+    except ZeroDivisionError:
+        species_precision = "undef"
+
+    try:
+        species_accuracy = (
+            (species_tp + species_tn)
+            / (species_tp + species_tn + species_fn + species_fp)
+        ) * 100
+    except ZeroDivisionError:
+        species_accuracy = "undef"
+
+    if outside_reference and give_formulas:
+        print(f"total outside reference reads: {stats['species_total']}\n")
+
+    if include_header:
+        header = (
+            "classifier\tgenus_recall\tgenus_precision\tgenus_accuracy\tspecies_recall\tspecies_precision\tspecies_accuracy\t"
+            "genus_TP\tgenus_FP\tgenus_FN\tgenus_TN\tspecies_TP\tspecies_FP\tspecies_FN\tspecies_TN"
+        )
+        if sample_fraction is not None:
+            header += "\tgenus_recall_SE\tgenus_precision_SE\tgenus_accuracy_SE\tspecies_recall_SE\tspecies_precision_SE\tspecies_accuracy_SE"
+        print(header)
+
+    print_string += f"{genus_recall}\t{genus_precision}\t{genus_accuracy}\t{species_recall}\t{species_precision}\t{species_accuracy}\t"
+    print_string += f"{genus_tp}\t{genus_fp}\t{genus_fn}\t{genus_tn}\t{species_tp}\t{species_fp}\t{species_fn}\t{species_tn}"
+    if sample_fraction is not None:
+        # The counts are of the sampled reads, the statistics estimate those of all reads
+        standard_errors = [
+            get_standard_error(genus_tp, genus_tp + genus_fn, sample_fraction),
+            get_standard_error(genus_tp, genus_tp + genus_fp, sample_fraction),
+            get_standard_error(
+                genus_tp + genus_tn,
+                genus_tp + genus_tn + genus_fn + genus_fp,
+                sample_fraction,
+            ),
+            get_standard_error(species_tp, species_tp + species_fn, sample_fraction),
+            get_standard_error(species_tp, species_tp + species_fp, sample_fraction),
+            get_standard_error(
+                species_tp + species_tn,
+                species_tp + species_tn + species_fn + species_fp,
+                sample_fraction,
+            ),
+        ]
+        print_string += "\t" + "\t".join(map(str, standard_errors))
+    print(print_string)
@@ -0,0 +1,253 @@
+import logging
+import mmap
+import os
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+from lib.input import get_input_compression
+from lib.lib import get_reference_files
+
+# A .fai next to every FASTA file, in the samtools faidx format:
+#   NAME  LENGTH  OFFSET  LINEBASES  LINEWIDTH
+# NAME is the first word of the header, OFFSET the byte offset of the first base,
+# LINEBASES and LINEWIDTH the bases and bytes (with the line ending) of every line
+# but the last. Base i of a sequence is at OFFSET + i // LINEBASES * LINEWIDTH +
+# i % LINEBASES, which is what makes fetching any part of it a slice of a memory map.
+FAI_SUFFIX = ".fai"
+COUNT_BLOCK_SIZE = 64 * 1024 * 1024
+MAX_OPEN_FILES = 256
+
+
+class FastaIndexError(Exception):
+    pass
+
+
+def count_byte(data, start, end, byte):
+    # Counted in blocks so a whole chromosome never needs a comparison array
+    total = 0
+    for block_start in range(start, end, COUNT_BLOCK_SIZE):
+        block = data[block_start : min(block_start + COUNT_BLOCK_SIZE, end)]
+        total += int(np.count_nonzero(block == byte))
+    return total
+
+
+def index_record(memory, data, name, start, end):
+    # The .fai entry of the sequence in memory[start:end] (data is a numpy view of the
+    # same memory map), which may end with newlines. None for an empty sequence,
+    # which samtools leaves out of the index too.
+    while end > start and data[end - 1] in (10, 13):
+        end -= 1
+    if end == start:
+        return None
+
+    first_end = memory.find(b"\n", start, end)
+    if first_end == -1:
+        # A single line, its line ending is whatever follows it
+        eol = 2 if data[end : end + 2].tobytes() == b"\r\n" else 1
+        return [name, end - start, start, end - start, end - start + eol]
+    line_width = first_end - start + 1
+    eol = 2 if data[first_end - 1] == 13 else 1
+    line_bases = line_width - eol
+
+    # Every line but the last is exactly line_width bytes when the newlines are all
+    # at multiples of it, and there are no others
+    newlines = count_byte(data, start, end, 10)
+    expected = data[start + line_width - 1 : start + newlines * line_width : line_width]
+    last_line = end - start - newlines * line_width
+    if (
+        len(expected) != newlines
+        or not np.all(expected == 10)
+        or not 0 < last_line <= line_bases
+        or (eol == 2 and count_byte(data, start, end, 13) != newlines)
+    ):
+        raise FastaIndexError(f"{name} has lines of different lengths")
+    return [name, newlines * line_bases + last_line, start, line_bases, line_width]
+
+
+def index_fasta(file):
+    # The .fai entries of every record of an uncompressed FASTA file
+    with open(file, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        memory = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    data = np.frombuffer(memory, np.uint8)
+    records = []
+    position = 0
+    if data[0] != ord(">"):
+        raise FastaIndexError("the file doesn't start with a header")
+    while position < len(memory):
+        header_end = memory.find(b"\n", position)
+        if header_end == -1:
+            header_end = len(memory)
+        name = memory[position + 1 : header_end].split(None, 1)
+        if not name:
+            raise FastaIndexError(f"header without a name at byte {position}")
+        next_header = memory.find(b"\n>", header_end)
+        end = len(memory) if next_header == -1 else next_header + 1
+        record = index_record(
+            memory, data, name[0].decode(), min(header_end + 1, end), end
+        )
+        if record is not None:
+            records.append(record)
+        position = end
+    del data
+    memory.close()
+    return records
+
+
+def get_fai_file(file):
+    return file + FAI_SUFFIX
+
+
+def is_index_current(file):
+    fai_file = get_fai_file(file)
+    return (
+        os.path.exists(fai_file)
+        and os.stat(fai_file).st_mtime_ns >= os.stat(file).st_mtime_ns
+    )
+
+
+def write_fai(file, records):
+    # Write to a temporary file and rename so a failed run never leaves a partial index
+    fai_file = get_fai_file(file)
+    with open(fai_file + ".tmp", "w") as f:
+        f.writelines("\t".join(map(str, record)) + "\n" for record in records)
+    os.replace(fai_file + ".tmp", fai_file)
+
+
+def read_fai(file):
+    records = []
+    with open(get_fai_file(file), "r") as f:
+        for line in f:
+            name, length, offset, line_bases, line_width = line.rstrip("\n").split(
+                "\t"
+            )[:5]
+            records.append(
+                [name, int(length), int(offset), int(line_bases), int(line_width)]
+            )
+    return records
+
+
+def build_fasta_index(file, force=False):
+    # Returns the number of records, None if the file was skipped
+    if get_input_compression(file) is not None:
+        logging.warning(f"{file} is compressed, only uncompressed files are indexed")
+        return None
+    if not force and is_index_current(file):
+        return None
+    try:
+        records = index_fasta(file)
+    except FastaIndexError as e:
+        logging.error(f"can't index {file}: {e}")
+        sys.exit(1)
+    write_fai(file, records)
+    return len(records)
+
+
+def build_directory_index(reference_directory, threads, force=False):
+    # numpy's comparisons and mmap's searches release the GIL on long sequences, so
+    # the files are indexed on a thread pool. Returns the files and records indexed.
+    from concurrent.futures import ThreadPoolExecutor
+
+    files = sorted(get_reference_files(reference_directory))
+    with ThreadPoolExecutor(threads) as executor:
+        counts = list(executor.map(lambda file: build_fasta_index(file, force), files))
+    indexed = [count for count in counts if count is not None]
+    logging.info(
+        f"indexed {len(indexed)} files, {len(files) - len(indexed)} were current or compressed"
+    )
+    return len(indexed), sum(indexed)
+
+
+def get_indexed_bases(file):
+    # The bases in a FASTA file from its .fai, None if it has no current one
+    if not is_index_current(file):
+        return None
+    return sum(record[1] for record in read_fai(file))
+
+
+class FastaIndex:
+    # Random access to every indexed sequence of a reference directory by sequence id,
+    # or by accession (the id without its version) when only one sequence has it
+    def __init__(self, reference_directory):
+        self.files = []
+        self.sequences = {}
+        self.count = 0
+        accessions = {}
+        for file in sorted(get_reference_files(reference_directory)):
+            if not os.path.exists(get_fai_file(file)):
+                continue
+            if not is_index_current(file):
+                logging.warning(
+                    f"{get_fai_file(file)} is older than {file}, skipping it"
+                )
+                continue
+            self.files.append(file)
+            for name, length, offset, line_bases, line_width in read_fai(file):
+                self.count += 1
+                entry = (len(self.files) - 1, length, offset, line_bases, line_width)
+                self.sequences[name] = entry
+                accession = name.split(".")[0]
+                accessions[accession] = None if accession in accessions else entry
+        for accession, entry in accessions.items():
+            if entry is not None and accession not in self.sequences:
+                self.sequences[accession] = entry
+        self.maps = OrderedDict()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, name):
+        return name in self.sequences
+
+    def entry(self, name):
+        if name not in self.sequences:
+            raise KeyError(f"{name} is not in the index")
+        return self.sequences[name]
+
+    def map_file(self, file_index):
+        # The most recently used files stay mapped
+        if file_index in self.maps:
+            self.maps.move_to_end(file_index)
+            return self.maps[file_index]
+        with open(self.files[file_index], "rb") as f:
+            memory = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.maps[file_index] = memory
+        if len(self.maps) > MAX_OPEN_FILES:
+            self.maps.popitem(last=False)[1].close()
+        return memory
+
+    def file(self, name):
+        return self.files[self.entry(name)[0]]
+
+    def length(self, name):
+        return self.entry(name)[1]
+
+    def header(self, name):
+        # The whole header line without the '>'
+        file_index, _, offset, _, _ = self.entry(name)
+        memory = self.map_file(file_index)
+        header_end = memory.rfind(b"\n", 0, offset)
+        header_start = memory.rfind(b"\n", 0, header_end) + 1
+        return memory[header_start + 1 : header_end].rstrip(b"\r").decode()
+
+    def fetch(self, name, start=0, end=None):
+        # Bases start to end (0-based, end excluded) of a sequence
+        file_index, length, offset, line_bases, line_width = self.entry(name)
+        end = length if end is None else min(end, length)
+        start = max(start, 0)
+        if start >= end:
+            return ""
+
+        def position(base):
+            return offset + base // line_bases * line_width + base % line_bases
+
+        data = self.map_file(file_index)[position(start) : position(end - 1) + 1]
+        return data.replace(b"\n", b"").replace(b"\r", b"").decode()
+
+    def close(self):
+        for memory in self.maps.values():
+            memory.close()
+        self.maps.clear()
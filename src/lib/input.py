@@ -0,0 +1,220 @@
+import gzip
+import io
+import logging
+import os
+import queue
+import sys
+import threading
+import zlib
+from collections import deque
+
+READ_SIZE = 1024 * 1024
+QUEUE_SIZE = 4
+BGZF_BATCH_SIZE = 1024 * 1024
+DECOMPRESSION_THREADS = min(4, os.cpu_count() or 1)
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+BGZF_HEADER_SIZE = 18
+
+
+class DecompressionError(OSError):
+    # A corrupt or truncated compressed input, raised to the code reading it so that
+    # library code never exits (which would hang a pool waiting for a worker)
+    pass
+
+
+def get_input_compression(filename):
+    # Detected from the magic bytes, the file name doesn't matter. BGZF is gzip with
+    # a 'BC' extra field holding the size of the block.
+    with open(filename, "rb") as f:
+        header = f.read(BGZF_HEADER_SIZE)
+    if header.startswith(ZSTD_MAGIC):
+        return "zstd"
+    if header.startswith(GZIP_MAGIC):
+        if len(header) == BGZF_HEADER_SIZE and header[3] & 4 and header[12:14] == b"BC":
+            return "bgzf"
+        return "gzip"
+    return None
+
+
+def read_chunks(f):
+    return iter(lambda: f.read(READ_SIZE), b"")
+
+
+def decompress_gzip(f):
+    # Concatenated gzip members are one stream, like gzip -d does
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    in_member = False
+    for data in read_chunks(f):
+        while data:
+            in_member = True
+            decompressed = decompressor.decompress(data)
+            if decompressed:
+                yield decompressed
+            data = b""
+            if decompressor.eof:
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                in_member = False
+    if in_member:
+        raise EOFError("compressed file ended before the end of the stream")
+
+
+def decompress_zstd(f):
+    import zstandard
+
+    reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+    yield from read_chunks(reader)
+
+
+def read_bgzf_batches(f):
+    # Lists of whole BGZF blocks adding up to about BGZF_BATCH_SIZE compressed bytes
+    batch = []
+    batch_size = 0
+    while True:
+        header = f.read(BGZF_HEADER_SIZE)
+        if not header:
+            break
+        if len(header) < BGZF_HEADER_SIZE or header[12:14] != b"BC":
+            raise ValueError("BGZF block without a block size")
+        block_size = int.from_bytes(header[16:18], "little") + 1
+        block = header + f.read(block_size - BGZF_HEADER_SIZE)
+        if len(block) != block_size:
+            raise EOFError("compressed file ended in the middle of a block")
+        batch.append(block)
+        batch_size += block_size
+        if batch_size >= BGZF_BATCH_SIZE:
+            yield batch
+            batch = []
+            batch_size = 0
+    if batch:
+        yield batch
+
+
+def decompress_bgzf_batch(batch):
+    # zlib releases the GIL, so batches decompress in parallel on threads
+    return b"".join(zlib.decompress(block, zlib.MAX_WBITS | 16) for block in batch)
+
+
+def decompress_bgzf(f, threads):
+    # Blocks are independent, keep a few batches per thread in flight and yield them in order
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(threads, thread_name_prefix="bgzf") as executor:
+        pending = deque()
+        for batch in read_bgzf_batches(f):
+            pending.append(executor.submit(decompress_bgzf_batch, batch))
+            if len(pending) >= 2 * threads:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class DecompressingReader(io.RawIOBase):
+    # A background thread decompresses the file into a bounded queue of chunks, so
+    # decompression overlaps with the caller parsing the previous chunks
+    def __init__(self, filename, compression, threads):
+        self.filename = filename
+        self.file = open(filename, "rb")
+        if compression == "bgzf":
+            chunks = decompress_bgzf(self.file, threads)
+        elif compression == "zstd":
+            chunks = decompress_zstd(self.file)
+        else:
+            chunks = decompress_gzip(self.file)
+        self.view = memoryview(b"")
+        self.position = 0
+        self.finished = False
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.stop = threading.Event()
+        self.thread = threading.Thread(
+            target=self.decompress, args=(chunks,), name="reader", daemon=True
+        )
+        self.thread.start()
+
+    def decompress(self, chunks):
+        try:
+            for chunk in chunks:
+                self.queue.put(chunk)
+                if self.stop.is_set():
+                    return
+            self.queue.put(None)
+        except Exception as e:
+            self.queue.put(e)
+        finally:
+            chunks.close()
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def readinto(self, buffer):
+        while not self.view:
+            if self.finished:
+                return 0
+            chunk = self.queue.get()
+            if chunk is None:
+                self.finished = True
+                return 0
+            if isinstance(chunk, Exception):
+                self.finished = True
+                raise DecompressionError(
+                    f"failed to decompress {self.filename}: {chunk}"
+                ) from chunk
+            self.view = memoryview(chunk)
+        size = min(len(buffer), len(self.view))
+        buffer[:size] = self.view[:size]
+        self.view = self.view[size:]
+        self.position += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            # Unblock the thread if it is waiting on a full queue
+            self.stop.set()
+            while self.thread.is_alive():
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    self.thread.join(0.01)
+            self.file.close()
+        super().close()
+
+
+def open_input(filename, mode="rb", threads=DECOMPRESSION_THREADS, background=True):
+    # Opens plain, gzip, BGZF or zstd files the same way, 'rb' for bytes or 'r' for
+    # text. Compressed files are decompressed on a background thread (BGZF on
+    # 'threads' threads), background=False decompresses on the caller's thread
+    # instead, which is cheaper when only the start of a file is read.
+    compression = get_input_compression(filename)
+    if compression is None:
+        return open(filename, mode)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            logging.error(
+                f"{filename} is zstd compressed, which needs the zstandard package "
+                "(pip install zstandard)"
+            )
+            sys.exit(1)
+
+    if background:
+        binary_file = io.BufferedReader(
+            DecompressingReader(filename, compression, threads), READ_SIZE
+        )
+    elif compression == "zstd":
+        binary_file = io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(
+                open(filename, "rb"), read_across_frames=True, closefd=True
+            )
+        )
+    else:
+        # BGZF is valid multi-member gzip
+        binary_file = gzip.open(filename, "rb")
+
+    if "b" in mode:
+        return binary_file
+    return io.TextIOWrapper(binary_file)
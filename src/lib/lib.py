@@ -1,32 +1,89 @@
 import logging
+import os
 import sys
 
+from lib.input import open_input
+from lib.lookup import get_remote_accession2taxid
+
 
 def load_accession2taxid(file):
-    accession2taxid = {}
-    with open(file, "r") as f:
-        for line in f:
-            line = line.strip()
-            if line.__contains__("\t"):
-                # If the line has a tab, split on tab
-                split_line = line.split("\t")
-            else:
-                # Otherwise, split on space
-                split_line = line.split(" ")
-
-            # If the accession has a period, remove everything after the period
-            accession = split_line[0].split(".")[0]
-
-            # Check to make sure the same accession isn't assigned a tax id twice
-            if (
-                accession in accession2taxid
-                and accession2taxid[accession] != split_line[-1]
-            ):
-                logging.error(
-                    f"{accession} appeared twice with taxids {accession2taxid[accession]} and {split_line[-1]}"
-                )
-                logging.error(f"please fix this before running again - exiting")
-                sys.exit(1)
-            else:
-                accession2taxid[accession] = split_line[-1]
+    # A lookup server that has this file loaded answers instead of reading it again
+    remote_accession2taxid = get_remote_accession2taxid(file)
+    if remote_accession2taxid is not None:
+        return remote_accession2taxid
+
+    # An accession index directory (accession-index.py) is its snapshot plus its log
+    if os.path.isdir(file):
+        from lib.accessionindex import load_accession_index
+
+        return load_accession_index(file)
+
+    with open_input(file, "r") as f:
+        return read_accession2taxid(f)
+
+
+def read_accession2taxid(f, accession2taxid=None):
+    # Adds the lines of an open accession2taxid to the dict, exits if an accession is
+    # given two different tax ids (also across the calls that fill the same dict)
+    accession2taxid = {} if accession2taxid is None else accession2taxid
+    for line in f:
+        line = line.strip()
+        if line.__contains__("\t"):
+            # If the line has a tab, split on tab
+            split_line = line.split("\t")
+        else:
+            # Otherwise, split on space
+            split_line = line.split(" ")
+
+        # NCBI's files (and their delta and dead accession lists) have a header and
+        # the columns accession, accession.version, taxid and gi
+        if split_line[0] == "accession":
+            continue
+        taxid = split_line[2] if len(split_line) == 4 else split_line[-1]
+
+        # If the accession has a period, remove everything after the period
+        accession = split_line[0].split(".")[0]
+
+        # Check to make sure the same accession isn't assigned a tax id twice
+        if accession in accession2taxid and accession2taxid[accession] != taxid:
+            logging.error(
+                f"{accession} appeared twice with taxids {accession2taxid[accession]} and {taxid}"
+            )
+            logging.error(f"please fix this before running again - exiting")
+            sys.exit(1)
+        else:
+            accession2taxid[accession] = taxid
     return accession2taxid
+
+
+def get_reference_files(directory):
+    # Real paths of every fasta file directly inside the directory
+    return [
+        os.path.realpath(os.path.join(directory, file_name))
+        for file_name in os.listdir(directory)
+        if file_name.endswith(".fna") or file_name.endswith(".fasta")
+    ]
+
+
+def read_first_header(file):
+    # Only read up to the first newline instead of parsing the whole first record
+    with open_input(file, "rb", background=False) as f:
+        header = f.readline()
+    if not header.startswith(b">"):
+        logging.error(f"{file} does not start with a fasta header")
+        sys.exit(1)
+    return header[1:].decode().strip()
+
+
+def read_first_accession(file):
+    # The first word of the header is the sequence id, drop the version after the period
+    return read_first_header(file).split()[0].split(".")[0]
+
+
+def count_fasta_bases(file):
+    total_bases = 0
+    with open_input(file, "rb") as f:
+        for line in f:
+            if not line.startswith(b">"):
+                total_bases += len(line.rstrip())
+    return total_bases
@@ -0,0 +1,360 @@
+import json
+import logging
+import os
+import socket
+import struct
+import sys
+from collections import namedtuple
+
+# A lookup server keeps the taxonomy, accession2taxid maps and the names.dmp index
+# loaded and answers batched requests over a Unix socket. When the environment
+# variable below names a socket, load_accession2taxid, load_taxonomy and
+# load_name_index return clients for whatever the server has loaded instead of
+# reading the files again. Anything the server doesn't have is loaded locally.
+LOOKUP_SOCKET_VARIABLE = "BIO_TOOLS_LOOKUP_SOCKET"
+BATCH_SIZE = 100000
+LENGTH = struct.Struct(">I")
+
+TaxonomyNode = namedtuple("TaxonomyNode", ["id", "name", "parent", "rank"])
+
+# One connection per socket path and process, forked batch workers reconnect
+clients = {}
+
+
+class LookupServerError(Exception):
+    pass
+
+
+def send_message(connection, message):
+    data = json.dumps(message, separators=(",", ":")).encode()
+    connection.sendall(LENGTH.pack(len(data)) + data)
+
+
+def receive_exactly(connection, size):
+    parts = []
+    while size > 0:
+        part = connection.recv(min(size, 1 << 20))
+        if not part:
+            raise ConnectionError("lookup server connection closed")
+        parts.append(part)
+        size -= len(part)
+    return b"".join(parts)
+
+
+def receive_message(connection):
+    # None when the other side closed the connection between messages
+    header = connection.recv(LENGTH.size, socket.MSG_WAITALL)
+    if not header:
+        return None
+    if len(header) < LENGTH.size:
+        header += receive_exactly(connection, LENGTH.size - len(header))
+    return json.loads(receive_exactly(connection, LENGTH.unpack(header)[0]))
+
+
+def node_to_list(node):
+    return None if node is None else [node.id, node.name, node.parent, node.rank]
+
+
+def list_to_node(values):
+    return None if values is None else TaxonomyNode(*values)
+
+
+class LookupClient:
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.connection.connect(socket_path)
+        self.info = self.request("info")
+
+    def request(self, operation, **arguments):
+        send_message(self.connection, {"operation": operation, **arguments})
+        response = receive_message(self.connection)
+        if response is None:
+            raise ConnectionError("lookup server connection closed")
+        if "error" in response:
+            raise LookupServerError(response["error"])
+        return response["result"]
+
+    def request_batches(self, operation, key, values, **arguments):
+        # Large requests are split so no message has to hold everything at once
+        results = []
+        for start in range(0, len(values), BATCH_SIZE):
+            results.extend(
+                self.request(
+                    operation,
+                    **{key: values[start : start + BATCH_SIZE]},
+                    **arguments,
+                )
+            )
+        return results
+
+    def accession2taxid(self, accessions, map_file):
+        return self.request_batches(
+            "accession2taxid", "accessions", list(accessions), map=map_file
+        )
+
+    def lca(self, taxid_pairs):
+        # The LCA node of each pair, like Taxonomy.lca
+        return [
+            list_to_node(node)
+            for node in self.request_batches("lca", "taxid_pairs", list(taxid_pairs))
+        ]
+
+    def lca_of_sets(self, taxid_sets):
+        # The LCA tax id of each set, as readid2taxid-lca computes it
+        return self.request_batches("lca_of_sets", "taxid_sets", list(taxid_sets))
+
+    def parents(self, taxids, rank=None):
+        return [
+            list_to_node(node)
+            for node in self.request_batches(
+                "parent", "taxids", list(taxids), rank=rank
+            )
+        ]
+
+    def nodes(self, taxids):
+        return [
+            list_to_node(node)
+            for node in self.request_batches("node", "taxids", list(taxids))
+        ]
+
+    def resolve_names(self, names, ignore_case=False, name_classes=None):
+        result = self.request(
+            "resolve_names",
+            names=list(names),
+            ignore_case=ignore_case,
+            name_classes=name_classes,
+        )
+        for problem in result["report"].values():
+            problem["candidates"] = [tuple(c) for c in problem["candidates"]]
+        return result["name2taxid"], result["report"]
+
+    def close(self):
+        self.connection.close()
+
+
+def get_lookup_client():
+    # The client for the server named by the environment, None if there is none
+    socket_path = os.environ.get(LOOKUP_SOCKET_VARIABLE)
+    if not socket_path:
+        return None
+    key = (socket_path, os.getpid())
+    if key not in clients:
+        try:
+            clients[key] = LookupClient(socket_path)
+            logging.info(f"Using the lookup server at {socket_path}")
+        except OSError as e:
+            logging.warning(
+                f"could not connect to the lookup server at {socket_path} ({e}), "
+                "loading files locally"
+            )
+            clients[key] = None
+    return clients[key]
+
+
+def request_server(operation, *arguments):
+    # Runs a LookupClient method for the remote wrappers below. A server that stopped
+    # or failed in the middle of a job ends it with an error instead of a traceback.
+    client = get_lookup_client()
+    try:
+        if client is None:
+            raise ConnectionError("not connected")
+        return getattr(client, operation)(*arguments)
+    except (OSError, LookupServerError) as e:
+        logging.error(
+            f"lookup server request '{operation}' to "
+            f"{os.environ.get(LOOKUP_SOCKET_VARIABLE)} failed: {e}"
+        )
+        sys.exit(1)
+
+
+class RemoteAccession2Taxid:
+    # Read-only dict of accession -> tax id answered by the server, every answer
+    # is cached so a repeated accession costs one request per job. Scripts prefetch
+    # the accessions they are about to look up so a batch costs one request.
+    def __init__(self, map_file, size):
+        self.map_file = map_file
+        self.size = size
+        self.cache = {}
+
+    def prefetch(self, accessions):
+        missing = list(set(a for a in accessions if a not in self.cache))
+        if missing:
+            taxids = request_server("accession2taxid", missing, self.map_file)
+            self.cache.update(zip(missing, taxids))
+
+    def get(self, accession, default=None):
+        if accession not in self.cache:
+            self.prefetch([accession])
+        taxid = self.cache[accession]
+        return default if taxid is None else taxid
+
+    def __getitem__(self, accession):
+        taxid = self.get(accession)
+        if taxid is None:
+            raise KeyError(accession)
+        return taxid
+
+    def __contains__(self, accession):
+        return self.get(accession) is not None
+
+    def __len__(self):
+        return self.size
+
+
+class RemoteTaxonomy:
+    # The parts of taxonomy.Taxonomy the scripts use, answered by the server
+    def __init__(self, directory):
+        self.directory = directory
+        self.lca_cache = {}
+        self.parent_cache = {}
+        self.node_cache = {}
+
+    def lca(self, taxid1, taxid2):
+        key = (str(taxid1), str(taxid2))
+        if key not in self.lca_cache:
+            self.lca_cache[key] = request_server("lca", [key])[0]
+        return self.lca_cache[key]
+
+    def lca_of_sets(self, taxid_sets):
+        # One batched request instead of a request per pair
+        return request_server(
+            "lca_of_sets", [list(map(int, taxids)) for taxids in taxid_sets]
+        )
+
+    def prefetch_parents(self, taxids, at_rank=None):
+        missing = list(
+            set(str(t) for t in taxids if (str(t), at_rank) not in self.parent_cache)
+        )
+        if missing:
+            nodes = request_server("parents", missing, at_rank)
+            self.parent_cache.update(
+                ((taxid, at_rank), node) for taxid, node in zip(missing, nodes)
+            )
+
+    def parent(self, taxid, at_rank=None):
+        key = (str(taxid), at_rank)
+        if key not in self.parent_cache:
+            self.prefetch_parents([taxid], at_rank)
+        return self.parent_cache[key]
+
+    def prefetch_nodes(self, taxids):
+        missing = list(set(str(t) for t in taxids if str(t) not in self.node_cache))
+        if missing:
+            nodes = request_server("nodes", missing)
+            self.node_cache.update(zip(missing, nodes))
+
+    def node(self, taxid):
+        if str(taxid) not in self.node_cache:
+            self.prefetch_nodes([taxid])
+        return self.node_cache[str(taxid)]
+
+
+class RemoteNameIndex:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def resolve_names(self, names, ignore_case=False, name_classes=None):
+        return request_server("resolve_names", names, ignore_case, name_classes)
+
+
+def prefetch_accessions(accession2taxid, accessions):
+    # Looks up every accession a script is about to use in one request when the map
+    # is a lookup server's, a local dict needs nothing
+    if isinstance(accession2taxid, RemoteAccession2Taxid):
+        accession2taxid.prefetch(accessions)
+
+
+def prefetch_parents(taxonomy, taxids, at_rank=None):
+    # The same for taxonomy.parent
+    if isinstance(taxonomy, RemoteTaxonomy):
+        taxonomy.prefetch_parents(taxids, at_rank)
+
+
+def get_remote_accession2taxid(map_file):
+    client = get_lookup_client()
+    if client is None:
+        return None
+    map_file = os.path.realpath(map_file)
+    size = client.info["maps"].get(map_file)
+    return None if size is None else RemoteAccession2Taxid(map_file, size)
+
+
+def get_remote_taxonomy(directory):
+    client = get_lookup_client()
+    if client is None or client.info["taxonomy"] != os.path.realpath(directory):
+        return None
+    return RemoteTaxonomy(directory)
+
+
+def get_remote_name_index(directory):
+    client = get_lookup_client()
+    if client is None or client.info["names"] != os.path.realpath(directory):
+        return None
+    return RemoteNameIndex(directory)
+
+
+def handle_request(loaded, request):
+    # The server side of every operation, loaded holds what the server has read
+    operation = request.get("operation")
+    if operation == "info":
+        return {
+            "taxonomy": loaded["taxonomy_directory"],
+            "maps": {path: len(mapping) for path, mapping in loaded["maps"].items()},
+            "names": loaded["names_directory"],
+        }
+
+    if operation == "accession2taxid":
+        mapping = loaded["maps"].get(request["map"])
+        if mapping is None:
+            raise LookupServerError(f"{request['map']} is not loaded")
+        return [mapping.get(accession) for accession in request["accessions"]]
+
+    if operation == "resolve_names":
+        from lib.names import resolve_names
+
+        if loaded["name_index"] is None:
+            raise LookupServerError("no name index is loaded")
+        name2taxid, report = resolve_names(
+            loaded["name_index"],
+            request["names"],
+            request["ignore_case"],
+            request["name_classes"],
+        )
+        return {"name2taxid": name2taxid, "report": report}
+
+    taxonomy = loaded["taxonomy"]
+    if operation in ("lca", "lca_of_sets", "parent", "node") and taxonomy is None:
+        raise LookupServerError("no taxonomy is loaded")
+    if operation == "lca":
+        return [
+            node_to_list(taxonomy.lca(taxid1, taxid2))
+            for taxid1, taxid2 in request["taxid_pairs"]
+        ]
+    if operation == "lca_of_sets":
+        from lib.pipeline import lca_of_taxids
+
+        return [lca_of_taxids(taxids, taxonomy) for taxids in request["taxid_sets"]]
+    if operation == "parent":
+        return [
+            node_to_list(taxonomy.parent(taxid, at_rank=request["rank"]))
+            for taxid in request["taxids"]
+        ]
+    if operation == "node":
+        return [node_to_list(taxonomy.node(taxid)) for taxid in request["taxids"]]
+    raise LookupServerError(f"unknown operation '{operation}'")
+
+
+def load_taxonomy(directory):
+    # A lookup server's taxonomy if it has this one, otherwise read from disk. An array
+    # taxonomy file (taxonomy-arrays.py) can be given instead of the directory.
+    if os.path.isfile(directory):
+        from lib.arraytaxonomy import load_array_taxonomy
+
+        return load_array_taxonomy(directory)
+    taxonomy = get_remote_taxonomy(directory)
+    if taxonomy is not None:
+        return taxonomy
+    from taxonomy.taxonomy import Taxonomy
+
+    return Taxonomy.from_ncbi(directory)
@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.input import open_input
+from lib.lib import get_reference_files
+
+TAXOR_LEVELS = [
+    "superkingdom",
+    "phylum",
+    "class",
+    "order",
+    "family",
+    "genus",
+    "species",
+]
+
+
+def scan_fasta(file):
+    # One pass over the file collecting every sequence id with its number of bases
+    sequences = []
+    seqid = None
+    bases = 0
+    with open_input(file, "rb") as f:
+        for line in f:
+            if line.startswith(b">"):
+                if seqid is not None:
+                    sequences.append([seqid, bases])
+                seqid = line[1:].split(None, 1)[0].decode()
+                bases = 0
+            else:
+                bases += len(line.rstrip())
+    if seqid is not None:
+        sequences.append([seqid, bases])
+    return sequences
+
+
+def prefetch_taxor_lineages(taxids, taxonomy):
+    # Asks a lookup server for every rank of every tax id in one request per rank
+    from lib.lookup import prefetch_parents
+
+    taxids = set(str(taxid) for taxid in taxids)
+    for level in TAXOR_LEVELS:
+        prefetch_parents(taxonomy, taxids, level)
+
+
+def get_taxor_lineage(taxid, taxonomy):
+    organism_names = []
+    organism_taxids = []
+    for level in TAXOR_LEVELS:
+        node = taxonomy.parent(str(taxid), at_rank=level)
+        if node is not None:
+            if level == "superkingdom":
+                name = f"k__{node.name}"
+            else:
+                name = f"{level[0]}__{node.name}"
+            organism_names.append(name)
+            organism_taxids.append(node.id)
+
+    # Lowest available taxid, its name, and the ';' separated lineage strings
+    return [
+        organism_taxids[-1],
+        organism_names[-1].split("_")[2:][0],
+        ";".join(organism_names),
+        ";".join(organism_taxids),
+    ]
+
+
+def get_assembly_version(file_name_with_extension):
+    if "_" in file_name_with_extension:
+        file_split = file_name_with_extension.split("_")
+        return file_split[0] + "_" + file_split[1]
+    else:
+        return file_name_with_extension.split(".")[0]
+
+
+def scan_reference(reference_directory, threads, cached_files=None):
+    # Files that have not changed since the cached manifest are not read again
+    cached_files = {} if cached_files is None else cached_files
+
+    def scan_file(file):
+        stat = os.stat(file)
+        cached = cached_files.get(file)
+        if (
+            cached is not None
+            and cached["size"] == stat.st_size
+            and cached["mtime_ns"] == stat.st_mtime_ns
+        ):
+            return cached, False
+        return {
+            "file": file,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sequences": scan_fasta(file),
+        }, True
+
+    ref_files = sorted(get_reference_files(reference_directory))
+    with ThreadPoolExecutor(threads) as executor:
+        scanned = list(executor.map(scan_file, ref_files))
+
+    total_rescanned = sum(map(lambda x: x[1], scanned))
+    logging.info(
+        f"scanned {total_rescanned} files, reused {len(scanned) - total_rescanned} from the cache"
+    )
+    return [file_info for file_info, _ in scanned]
+
+
+def resolve_taxids(files, accession2taxid, taxonomy):
+    # Attach a tax id to every sequence and a taxor lineage to every tax id
+    from lib.lookup import prefetch_accessions
+
+    prefetch_accessions(
+        accession2taxid,
+        set(
+            sequence[0].split(".")[0]
+            for file_info in files
+            for sequence in file_info["sequences"]
+        ),
+    )
+    for file_info in files:
+        for sequence in file_info["sequences"]:
+            accession = sequence[0].split(".")[0]
+            if accession not in accession2taxid:
+                logging.error(
+                    f"{accession} from {file_info['file']} is not in the accession2taxid"
+                )
+                logging.error(f"please fix this before running again - exiting")
+                sys.exit(1)
+            sequence[2:] = [accession2taxid[accession]]
+
+    taxids = dict.fromkeys(
+        sequence[2] for file_info in files for sequence in file_info["sequences"]
+    )
+    prefetch_taxor_lineages(taxids, taxonomy)
+    return {taxid: get_taxor_lineage(taxid, taxonomy) for taxid in taxids}
+
+
+def build_manifest(
+    reference_directory, accession2taxid, taxonomy, threads, cached_manifest=None
+):
+    cached_files = None
+    if cached_manifest is not None:
+        cached_files = {
+            file_info["file"]: file_info for file_info in cached_manifest["files"]
+        }
+    files = scan_reference(reference_directory, threads, cached_files)
+    lineages = resolve_taxids(files, accession2taxid, taxonomy)
+    return {
+        "reference_directory": os.path.realpath(reference_directory),
+        "files": files,
+        "lineages": lineages,
+    }
+
+
+def save_manifest(manifest, filename):
+    # Write to a temporary file first so an interrupted run never leaves a broken cache
+    with open(filename + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(filename + ".tmp", filename)
+
+
+def load_manifest(filename):
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def taxor_lines(manifest):
+    for file_info in manifest["files"]:
+        file_name_with_extension = os.path.basename(file_info["file"])
+        first_taxid = file_info["sequences"][0][2]
+        lowest_taxid, lowest_name, lineage_names_str, lineage_taxid_str = manifest[
+            "lineages"
+        ][first_taxid]
+        assembly_version = get_assembly_version(file_name_with_extension)
+        yield f"{assembly_version}\t{lowest_taxid}\t/{file_name_with_extension}\t{lowest_name}\t{lineage_names_str}\t{lineage_taxid_str}"
+
+
+def clark_lines(manifest):
+    # CLARK's fileToAccssnTaxID has the first accession (without version) of each file
+    for file_info in manifest["files"]:
+        seqid, _, taxid = file_info["sequences"][0]
+        yield f"{file_info['file']}\t{seqid.split('.')[0]}\t{taxid}"
+
+
+def seqid2taxid_lines(manifest):
+    for file_info in manifest["files"]:
+        for seqid, _, taxid in file_info["sequences"]:
+            yield f"{seqid}\t{taxid}"
+
+
+def accession2taxid_lines(manifest):
+    # Same columns as the accession2taxid files distributed by NCBI (gi is unknown)
+    yield "accession\taccession.version\ttaxid\tgi"
+    for file_info in manifest["files"]:
+        for seqid, _, taxid in file_info["sequences"]:
+            yield f"{seqid.split('.')[0]}\t{seqid}\t{taxid}\t0"
+
+
+MANIFEST_FORMATS = {
+    "taxor": taxor_lines,
+    "clark": clark_lines,
+    "seqid2taxid": seqid2taxid_lines,
+    "accession2taxid": accession2taxid_lines,
+}
@@ -0,0 +1,134 @@
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+# Per-stage wall time, CPU time, peak RSS delta and items processed. Stages are
+# sequential (not nested), each one resets the kernel's peak RSS so its own peak is
+# measured instead of the peak of an earlier stage.
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument(
+        "--metrics",
+        dest="metrics",
+        default=None,
+        help="Write the wall time, CPU time, peak RSS delta and items processed of each "
+        "stage as JSON to this file ('-' for stderr)",
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        default=None,
+        help="Run under cProfile and write the stats to this file (view with python3 -m pstats)",
+    )
+
+
+def read_memory_kb():
+    # Current and peak resident set size of this process
+    memory = {"VmRSS": 0, "VmHWM": 0}
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in memory:
+                memory[key] = int(value.split()[0])
+    return memory["VmRSS"], memory["VmHWM"]
+
+
+def reset_peak_rss():
+    # Writing 5 to clear_refs resets VmHWM to the current RSS (Linux 4.0+)
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_cpu_seconds():
+    # Every thread of this process plus the children that have been waited for
+    # (batch mode worker pools and subprocesses)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+class Metrics:
+    def __init__(self, metrics_file=None, profile_file=None):
+        self.metrics_file = metrics_file
+        self.profile_file = profile_file
+        self.stages = []
+        # Resetting the peak RSS for a stage loses the earlier peak, so keep the maximum
+        self.peak_rss_kb = 0
+        self.start_wall = time.perf_counter()
+        self.start_cpu = get_cpu_seconds()
+        self.profiler = None
+        if profile_file is not None:
+            import cProfile
+
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @contextmanager
+    def stage(self, name):
+        # Callers set record["items"] to the number of rows/reads/files they handled
+        record = {"stage": name, "items": None}
+        if self.metrics_file is None:
+            yield record
+            return
+
+        self.update_peak_rss()
+        peak_reset = reset_peak_rss()
+        start_rss_kb, _ = read_memory_kb()
+        start_wall = time.perf_counter()
+        start_cpu = get_cpu_seconds()
+        yield record
+        wall_seconds = time.perf_counter() - start_wall
+        cpu_seconds = get_cpu_seconds() - start_cpu
+        _, peak_rss_kb = read_memory_kb()
+        self.peak_rss_kb = max(self.peak_rss_kb, peak_rss_kb)
+        if not peak_reset:
+            # The peak can only be an upper bound when it couldn't be reset
+            peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        record["wall_seconds"] = round(wall_seconds, 6)
+        record["cpu_seconds"] = round(cpu_seconds, 6)
+        record["peak_rss_delta_kb"] = max(0, peak_rss_kb - start_rss_kb)
+        if record["items"] is not None:
+            record["items_per_second"] = round(
+                record["items"] / max(wall_seconds, 1e-9), 1
+            )
+        self.stages.append(record)
+
+    def update_peak_rss(self):
+        _, peak_rss_kb = read_memory_kb()
+        self.peak_rss_kb = max(
+            self.peak_rss_kb,
+            peak_rss_kb,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        )
+
+    def close(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_file)
+        if self.metrics_file is None:
+            return
+
+        self.update_peak_rss()
+        report = {
+            "command": os.path.basename(sys.argv[0]),
+            "arguments": sys.argv[1:],
+            "wall_seconds": round(time.perf_counter() - self.start_wall, 6),
+            "cpu_seconds": round(get_cpu_seconds() - self.start_cpu, 6),
+            "peak_rss_kb": self.peak_rss_kb,
+            "stages": self.stages,
+        }
+        if self.metrics_file == "-":
+            json.dump(report, sys.stderr, indent=2)
+            sys.stderr.write("\n")
+        else:
+            with open(self.metrics_file, "w") as f:
+                json.dump(report, f, indent=2)
+                f.write("\n")
@@ -0,0 +1,114 @@
+import logging
+import os
+import pickle
+
+from lib.lookup import RemoteNameIndex, get_remote_name_index
+
+NAME_INDEX_CACHE = "names.dmp.index.pickle"
+NAME_INDEX_VERSION = 1
+
+
+def build_name_index(names_dmp):
+    # name -> [(taxid, name class id), ...] with the name classes stored once
+    names = {}
+    name_classes = []
+    name_class_ids = {}
+    with open(names_dmp, "r") as f:
+        for line in f:
+            split_line = line.rstrip("\t|\n").split("\t|\t")
+            taxid, name, name_class = split_line[0], split_line[1], split_line[3]
+            if name_class not in name_class_ids:
+                name_class_ids[name_class] = len(name_classes)
+                name_classes.append(name_class)
+            names.setdefault(name, []).append((taxid, name_class_ids[name_class]))
+
+    lowercase = {}
+    for name in names:
+        lowercase.setdefault(name.lower(), []).append(name)
+
+    return {
+        "version": NAME_INDEX_VERSION,
+        "names": names,
+        "lowercase": lowercase,
+        "name_classes": name_classes,
+    }
+
+
+def load_name_index(taxonomy_directory, cache_file=None):
+    # The index is cached next to names.dmp and rebuilt whenever names.dmp is newer
+    remote_name_index = get_remote_name_index(taxonomy_directory)
+    if remote_name_index is not None:
+        return remote_name_index
+
+    names_dmp = os.path.join(taxonomy_directory, "names.dmp")
+    if cache_file is None:
+        cache_file = os.path.join(taxonomy_directory, NAME_INDEX_CACHE)
+
+    if (
+        os.path.exists(cache_file)
+        and os.stat(cache_file).st_mtime_ns >= os.stat(names_dmp).st_mtime_ns
+    ):
+        with open(cache_file, "rb") as f:
+            name_index = pickle.load(f)
+        if name_index.get("version") == NAME_INDEX_VERSION:
+            return name_index
+
+    logging.info(f"Building name index from {names_dmp}")
+    name_index = build_name_index(names_dmp)
+    try:
+        with open(cache_file + ".tmp", "wb") as f:
+            pickle.dump(name_index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(cache_file + ".tmp", cache_file)
+    except OSError as e:
+        logging.warning(f"could not cache the name index at {cache_file}: {e}")
+    return name_index
+
+
+def lookup_name(name_index, name, ignore_case=False, name_classes=None):
+    # All (taxid, matched name, name class) for a name, optionally only some classes
+    if ignore_case:
+        matched_names = name_index["lowercase"].get(name.lower(), [])
+    else:
+        matched_names = [name] if name in name_index["names"] else []
+
+    candidates = []
+    for matched_name in matched_names:
+        for taxid, name_class_id in name_index["names"][matched_name]:
+            name_class = name_index["name_classes"][name_class_id]
+            if name_classes is None or name_class in name_classes:
+                candidates.append((taxid, matched_name, name_class))
+    return candidates
+
+
+def resolve_names(name_index, names, ignore_case=False, name_classes=None):
+    # A name resolves if exactly one tax id has it as a scientific name or,
+    # failing that, if all of its matches are for one tax id
+    if isinstance(name_index, RemoteNameIndex):
+        return name_index.resolve_names(names, ignore_case, name_classes)
+    name2taxid = {}
+    report = {}
+    for name in names:
+        candidates = lookup_name(name_index, name, ignore_case, name_classes)
+        scientific_taxids = set(
+            taxid
+            for taxid, _, name_class in candidates
+            if name_class == "scientific name"
+        )
+        taxids = set(taxid for taxid, _, _ in candidates)
+        if len(scientific_taxids) == 1:
+            name2taxid[name] = scientific_taxids.pop()
+        elif len(taxids) == 1:
+            name2taxid[name] = taxids.pop()
+        else:
+            report[name] = {
+                "status": "missing" if not candidates else "ambiguous",
+                "candidates": candidates,
+            }
+    return name2taxid, report
+
+
+def log_resolution_report(report):
+    for name, problem in report.items():
+        logging.error(f"'{name}' is {problem['status']}")
+        for taxid, matched_name, name_class in problem["candidates"]:
+            logging.error(f"    {taxid}\t{matched_name}\t{name_class}")
@@ -0,0 +1,149 @@
+import gzip
+import logging
+import queue
+import sys
+import threading
+
+BUFFER_SIZE = 8 * 1024 * 1024
+QUEUE_SIZE = 4
+GZIP_LEVEL = 6
+COMPRESSION_EXTENSIONS = {".gz": "gzip", ".zst": "zstd"}
+
+
+def get_compression(filename):
+    if filename is None:
+        return None
+    for extension, compression in COMPRESSION_EXTENSIONS.items():
+        if filename.endswith(extension):
+            return compression
+    return None
+
+
+class BulkWriter:
+    # Collects rows into large buffers and writes them in bulk to a file (stdout if
+    # None or '-'). Output is compressed with gzip or zstd when asked or when the file
+    # name ends in .gz or .zst. A background thread does the compression and writing
+    # so formatting overlaps with it, by default only when compressing.
+    def __init__(
+        self, filename=None, compression=None, background=None, buffer_size=BUFFER_SIZE
+    ):
+        self.buffer_size = buffer_size
+        self.parts = []
+        self.size = 0
+        self.files = []
+
+        if compression is None:
+            compression = get_compression(filename)
+        if compression not in (None, "gzip", "zstd"):
+            logging.error(f"unknown output compression '{compression}'")
+            sys.exit(1)
+        if compression == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                logging.error(
+                    "zstd output needs the zstandard package (pip install zstandard)"
+                )
+                sys.exit(1)
+
+        self.to_stdout = filename is None or filename == "-"
+        if self.to_stdout:
+            self.file = sys.stdout.buffer
+        else:
+            self.file = open(filename, "wb")
+            self.files.append(self.file)
+        if compression == "gzip":
+            self.file = gzip.GzipFile(
+                fileobj=self.file, mode="wb", compresslevel=GZIP_LEVEL
+            )
+            self.files.append(self.file)
+        elif compression == "zstd":
+            self.file = zstandard.ZstdCompressor().stream_writer(
+                self.file, closefd=False
+            )
+            self.files.append(self.file)
+
+        if background is None:
+            background = compression is not None
+        self.queue = None
+        self.error = None
+        if background:
+            self.queue = queue.Queue(QUEUE_SIZE)
+            self.thread = threading.Thread(
+                target=self.write_queued, name="writer", daemon=True
+            )
+            self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def write_queued(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            if self.error is None:
+                try:
+                    self.file.write(data)
+                except Exception as e:
+                    # Keep draining the queue so the main thread never blocks on it
+                    self.error = e
+
+    def write_bytes(self, data):
+        if self.queue is None:
+            self.file.write(data)
+            return
+        if self.error is not None:
+            raise self.error
+        # The caller may reuse its buffer once this returns
+        self.queue.put(data if isinstance(data, bytes) else bytes(data))
+
+    def flush_parts(self):
+        if self.parts:
+            data = "".join(self.parts).encode()
+            self.parts.clear()
+            self.size = 0
+            self.write_bytes(data)
+
+    def write(self, data):
+        # Text is buffered until there is enough of it, bytes are written as they are
+        if isinstance(data, str):
+            self.parts.append(data)
+            self.size += len(data)
+            if self.size >= self.buffer_size:
+                self.flush_parts()
+        else:
+            self.flush_parts()
+            self.write_bytes(data)
+
+    def write_row(self, *fields):
+        self.write("\t".join(map(str, fields)) + "\n")
+
+    def close_files(self):
+        # The compressor is closed before the file under it, which is closed even if
+        # closing the compressor fails
+        while self.files:
+            file = self.files.pop()
+            try:
+                file.close()
+            except Exception:
+                self.close_files()
+                raise
+
+    def close(self):
+        try:
+            self.flush_parts()
+        finally:
+            # Stop the writer thread and close the files even when a write failed
+            if self.queue is not None:
+                self.queue.put(None)
+                self.thread.join()
+                self.queue = None
+            self.close_files()
+        if self.error is not None:
+            raise self.error
+        if self.to_stdout:
+            sys.stdout.buffer.flush()
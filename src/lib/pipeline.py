@@ -0,0 +1,149 @@
+from itertools import islice
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from taxonomy.taxonomy import Taxonomy
+
+BATCH_SIZE = 100000
+
+
+def batched(rows, batch_size=BATCH_SIZE):
+    # Lists of up to batch_size rows, so stages hand over work in bulk
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def get_mappings_taxids(mappings_batch, accession2taxid, taxonomy, species_level):
+    # The tax id of each read of a batch from the accessions of its best alignments.
+    # A lookup server gets one request for the accessions, one for the LCAs and one
+    # for the species check of the whole batch.
+    from lib.lookup import prefetch_accessions, prefetch_parents
+
+    prefetch_accessions(
+        accession2taxid,
+        set(a for mappings in mappings_batch for a in mappings if a is not None),
+    )
+    taxids = []
+    lca_rows, lca_sets = [], []
+    for mappings in mappings_batch:
+        if len(mappings) == 1:
+            taxids.append("0" if mappings[0] is None else accession2taxid[mappings[0]])
+        else:
+            taxids.append(None)
+            lca_rows.append(len(taxids) - 1)
+            lca_sets.append([accession2taxid[accession] for accession in mappings])
+    lcas = lca_of_taxid_sets(lca_sets, taxonomy) if lca_sets else []
+
+    if species_level:
+        prefetch_parents(taxonomy, lcas, "species")
+    for row, lca in zip(lca_rows, lcas):
+        if species_level and taxonomy.parent(lca, at_rank="species") is None:
+            lca = "0"
+        taxids[row] = lca
+    return taxids
+
+
+def readid2taxid_from_alignments(alignments, accession2taxid, taxonomy, species_level):
+    # Yields (read id, tax id) for each run of alignments with the same read id, the
+    # tax ids are resolved a batch of reads at a time
+    for batch in batched(group_alignments(alignments)):
+        yield from zip(
+            (readid for readid, _ in batch),
+            get_mappings_taxids(
+                [mappings for _, mappings in batch],
+                accession2taxid,
+                taxonomy,
+                species_level,
+            ),
+        )
+
+
+def group_alignments(alignments):
+    # Yields (read id, accessions of its best alignments) for each run of alignments
+    # with the same read id
+    last_readid = ""
+    last_readid_highest_mapq = -1
+    mappings_buffer = []
+    for alignment in alignments:
+        readid = alignment.query_name
+        accession = alignment.reference_name
+
+        if accession is not None:
+            accession = accession.split(".")[0]
+
+        mapq = alignment.mapping_quality
+
+        if last_readid == readid or last_readid == "":
+            # Haven't gathered all information for this read yet
+            if last_readid == "":
+                last_readid = readid
+
+            if mapq >= last_readid_highest_mapq:
+                mappings_buffer = []
+                last_readid_highest_mapq = mapq
+                mappings_buffer.append(accession)
+
+        else:
+            # This is a new read, output the last one
+            yield last_readid, mappings_buffer
+
+            # Start the new readid
+            last_readid = readid
+            mappings_buffer = [accession]
+            last_readid_highest_mapq = mapq
+
+    # Output the remaining read in the buffer
+    if mappings_buffer:
+        yield last_readid, mappings_buffer
+
+
+def lca_of_taxids(taxids, taxonomy: "Taxonomy") -> str:
+    lca = ""
+    for idx, taxid in enumerate(taxids):
+        if taxid == 0:
+            return "0"
+
+        if idx == 0:
+            lca = str(taxid)
+        else:
+            lca = taxonomy.lca(lca, str(taxid)).id
+    return lca
+
+
+def lca_of_taxid_sets(taxid_sets, taxonomy):
+    # A lookup server answers every set in one request, locally it is one at a time
+    if hasattr(taxonomy, "lca_of_sets"):
+        return taxonomy.lca_of_sets(taxid_sets)
+    return [lca_of_taxids(taxids, taxonomy) for taxids in taxid_sets]
+
+
+def group_taxids(read_ids, taxids, readid2taxid=None):
+    # Every tax id of a read, in the order the reads first appear
+    readid2taxid = {} if readid2taxid is None else readid2taxid
+    for read_id, taxid in zip(read_ids, taxids):
+        if read_id in readid2taxid:
+            readid2taxid[read_id].append(taxid)
+        else:
+            readid2taxid[read_id] = [taxid]
+    return readid2taxid
+
+
+def collapse_to_lca(batches, taxonomy):
+    # A read can appear again anywhere, so every batch is grouped before any LCA
+    readid2taxids = {}
+    for batch in batches:
+        group_taxids(
+            (read_id for read_id, _ in batch),
+            (int(taxid) for _, taxid in batch),
+            readid2taxids,
+        )
+    return dict(
+        zip(
+            readid2taxids,
+            map(int, lca_of_taxid_sets(list(readid2taxids.values()), taxonomy)),
+        )
+    )
@@ -0,0 +1,172 @@
+import logging
+import os
+import subprocess
+import sys
+import time
+
+PAGE_SIZE_KB = os.sysconf("SC_PAGE_SIZE") // 1024
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+TIME_SERIES_COLUMNS = [
+    "elapsed_seconds",
+    "rss_kb",
+    "user_seconds",
+    "sys_seconds",
+    "cpu_percent",
+    "read_bytes",
+    "write_bytes",
+    "threads",
+    "processes",
+]
+
+
+def read_proc_stat(pid):
+    # Fields after the command name, which is in parentheses and may contain spaces
+    with open(f"/proc/{pid}/stat", "r") as f:
+        data = f.read()
+    fields = data[data.rindex(")") + 2 :].split()
+    return {
+        "ppid": int(fields[1]),
+        # Own CPU time plus the time of children that have already been waited for
+        "user_seconds": (int(fields[11]) + int(fields[13])) / CLOCK_TICKS,
+        "sys_seconds": (int(fields[12]) + int(fields[14])) / CLOCK_TICKS,
+        "threads": int(fields[17]),
+        # With the pid, identifies the process even if its pid is reused
+        "start_ticks": int(fields[19]),
+        "rss_kb": int(fields[21]) * PAGE_SIZE_KB,
+    }
+
+
+def read_proc_io(pid):
+    io = {"read_bytes": 0, "write_bytes": 0}
+    try:
+        with open(f"/proc/{pid}/io", "r") as f:
+            for line in f:
+                key, value = line.split(":")
+                if key in io:
+                    io[key] = int(value)
+    except (PermissionError, FileNotFoundError):
+        pass
+    return io
+
+
+def get_process_tree(root_pid):
+    # Every live process descending from root_pid (including itself)
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                data = f.read()
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+        ppid = int(data[data.rindex(")") + 2 :].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+
+    tree = []
+    pids = [root_pid]
+    while pids:
+        pid = pids.pop()
+        tree.append(pid)
+        pids.extend(children.get(pid, []))
+    return tree
+
+
+def sample_process_tree(root_pid, last_io, exited_io):
+    # last_io keeps the last I/O counters seen for every process and exited_io the
+    # totals of processes that are gone, so the I/O of exited children still counts
+    sample = {
+        "rss_kb": 0,
+        "user_seconds": 0.0,
+        "sys_seconds": 0.0,
+        "read_bytes": 0,
+        "write_bytes": 0,
+        "threads": 0,
+        "processes": 0,
+    }
+    current_io = {}
+    for pid in get_process_tree(root_pid):
+        try:
+            stat = read_proc_stat(pid)
+        except (FileNotFoundError, ProcessLookupError):
+            # The process exited between listing and reading it
+            continue
+        io = read_proc_io(pid)
+        sample["rss_kb"] += stat["rss_kb"]
+        sample["user_seconds"] += stat["user_seconds"]
+        sample["sys_seconds"] += stat["sys_seconds"]
+        sample["threads"] += stat["threads"]
+        current_io[(pid, stat["start_ticks"])] = {"ppid": stat["ppid"], **io}
+        sample["processes"] += 1
+
+    live_pids = {pid for pid, _ in current_io}
+    for key, io in last_io.items():
+        # The kernel adds the I/O of a child to its parent's counters when the parent
+        # waits for it, so it is only kept separately if the parent is gone too
+        if key not in current_io and io["ppid"] not in live_pids:
+            exited_io["read_bytes"] += io["read_bytes"]
+            exited_io["write_bytes"] += io["write_bytes"]
+    last_io.clear()
+    last_io.update(current_io)
+
+    for key in ["read_bytes", "write_bytes"]:
+        sample[key] = exited_io[key] + sum(x[key] for x in current_io.values())
+    return sample
+
+
+def profile_command(command, interval, on_sample=None):
+    # Run the command, sampling its process tree every interval seconds until it exits
+    start = time.monotonic()
+    try:
+        process = subprocess.Popen(command)
+    except OSError as e:
+        logging.error(f"can't run {command[0]}: {e.strerror}")
+        sys.exit(1)
+    samples = []
+    last_io, exited_io = {}, {"read_bytes": 0, "write_bytes": 0}
+    last_cpu_seconds, last_elapsed = 0.0, 0.0
+    while True:
+        pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+        if pid != 0:
+            break
+
+        sample = sample_process_tree(process.pid, last_io, exited_io)
+        elapsed = time.monotonic() - start
+        cpu_seconds = sample["user_seconds"] + sample["sys_seconds"]
+        sample["elapsed_seconds"] = round(elapsed, 3)
+        sample["cpu_percent"] = round(
+            100 * (cpu_seconds - last_cpu_seconds) / max(elapsed - last_elapsed, 1e-9),
+            1,
+        )
+        last_cpu_seconds, last_elapsed = cpu_seconds, elapsed
+        samples.append(sample)
+        if on_sample is not None:
+            on_sample(sample)
+        time.sleep(interval)
+
+    wall_seconds = time.monotonic() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    # The final CPU times and I/O come from the kernel and include every waited-for
+    # descendant (block counts are in 512 byte units)
+    peak = max(samples, key=lambda x: x["rss_kb"]) if samples else None
+    summary = {
+        "command": " ".join(command).replace("\n", " "),
+        "exit_status": process.returncode,
+        "wall_seconds": round(wall_seconds, 3),
+        "user_seconds": round(rusage.ru_utime, 3),
+        "sys_seconds": round(rusage.ru_stime, 3),
+        "cpu_utilization_percent": round(
+            100 * (rusage.ru_utime + rusage.ru_stime) / max(wall_seconds, 1e-9), 1
+        ),
+        "peak_sampled_rss_kb": peak["rss_kb"] if peak else 0,
+        "peak_sampled_rss_seconds": peak["elapsed_seconds"] if peak else 0,
+        "max_single_process_rss_kb": rusage.ru_maxrss,
+        "peak_threads": max((x["threads"] for x in samples), default=0),
+        "peak_processes": max((x["processes"] for x in samples), default=0),
+        "read_bytes": rusage.ru_inblock * 512,
+        "write_bytes": rusage.ru_oublock * 512,
+        "samples": len(samples),
+    }
+    return samples, summary
@@ -0,0 +1,298 @@
+import logging
+import mmap
+import sys
+
+import numpy as np
+
+from lib.input import get_input_compression, open_input
+from lib.output import BulkWriter
+from lib.remap import CHUNK_SIZE, gather_segments, parse_chunk, parse_values
+
+# Binary readid2taxid layout (little endian):
+#   magic (8 bytes), read count n (uint64), pool size (uint64)
+#   offsets: int64[n + 1], read i is pool[offsets[i]:offsets[i + 1] - 1]
+#   taxids: int32[n]
+#   pool: every read id followed by a newline
+BINARY_MAGIC = b"RID2TAX1"
+HEADER_SIZE = len(BINARY_MAGIC) + 16
+MAX_TAXID = 2**31 - 1
+WRITE_ROWS = 1 << 20
+SAMPLE_ROWS = 1 << 20
+
+
+def is_binary_readid2taxid(filename):
+    with open_input(filename, "rb", background=False) as f:
+        return f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+def make_table(pool, offsets, taxids):
+    return {"pool": pool, "offsets": offsets, "taxids": taxids}
+
+
+def table_from_lists(read_ids, taxids):
+    # read_ids are str or bytes, taxids are anything int() accepts
+    read_ids = [
+        read_id.encode() if isinstance(read_id, str) else read_id
+        for read_id in read_ids
+    ]
+    lengths = np.fromiter(map(len, read_ids), dtype=np.int64, count=len(read_ids))
+    offsets = np.zeros(len(read_ids) + 1, dtype=np.int64)
+    np.cumsum(lengths + 1, out=offsets[1:])
+    pool = np.frombuffer(b"".join(read_id + b"\n" for read_id in read_ids), np.uint8)
+    return make_table(
+        pool, offsets, np.array([int(taxid) for taxid in taxids], dtype=np.int64)
+    )
+
+
+def mix_hashes(hashes):
+    # The splitmix64 finalizer, every bit of the input affects every bit of the output
+    hashes ^= hashes >> 30
+    hashes *= 0xBF58476D1CE4E5B9
+    hashes ^= hashes >> 27
+    hashes *= 0x94D049BB133111EB
+    hashes ^= hashes >> 31
+    return hashes
+
+
+def combine_word(hashes, words):
+    hashes ^= words
+    hashes *= 0x9E3779B97F4A7C15
+    hashes ^= hashes >> 32
+    return hashes
+
+
+def hash_read_ids(data, starts, lengths):
+    # A 64-bit hash of every read id data[start:start + length] that, unlike hash(),
+    # is the same in every process and on every platform: each of the id's 8 byte
+    # little endian words (the last one zero padded) is combined with the length in
+    # turn by combine_word, and the result goes through mix_hashes
+    padded = np.concatenate((data, np.zeros(8, dtype=np.uint8)))
+    words = np.ndarray(len(data), "<u8", padded, 0, (1,))
+    hashes = lengths.astype(np.uint64)
+    for position in range(0, int(lengths.max(initial=0)), 8):
+        # Read ids usually have the same length, so most words are whole words of
+        # every read and need no masking or row selection
+        if lengths.min() >= position + 8:
+            combine_word(hashes, words[starts + position])
+        else:
+            rows = np.flatnonzero(lengths > position)
+            remaining = (lengths[rows] - position).astype(np.uint64)
+            word = words[starts[rows] + position]
+            word &= np.uint64(2**64 - 1) >> (64 - np.minimum(remaining, 8) * 8)
+            hashes[rows] = combine_word(hashes[rows], word)
+    return mix_hashes(hashes)
+
+
+def in_sample(data, starts, lengths, fraction):
+    # Whether each read is in the sample: its hash is in the first fraction of the
+    # hash range, so a read is in or out of it in every file it appears in
+    threshold = min(int(fraction * 2**64), 2**64 - 1)
+    return hash_read_ids(data, starts, lengths) < np.uint64(threshold)
+
+
+def sample_table(table, fraction):
+    # The rows of a table whose read ids are in the sample, hashed a block at a time
+    # so nothing the size of the whole table is allocated
+    offsets, count = table["offsets"], len(table["taxids"])
+    rows = [np.zeros(0, dtype=np.int64)]
+    for start in range(0, count, SAMPLE_ROWS):
+        end = min(start + SAMPLE_ROWS, count)
+        block_offsets = np.asarray(offsets[start : end + 1]) - offsets[start]
+        keep = in_sample(
+            table["pool"][offsets[start] : offsets[end]],
+            block_offsets[:-1],
+            np.diff(block_offsets) - 1,
+            fraction,
+        )
+        rows.append(np.flatnonzero(keep) + start)
+    return take_rows(table, np.concatenate(rows))
+
+
+def read_line_chunks(in_file):
+    # About CHUNK_SIZE bytes at a time, always ending with a whole line
+    while True:
+        chunk = in_file.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        chunk += in_file.readline()
+        if not chunk.endswith(b"\n"):
+            chunk += b"\n"
+        yield chunk
+
+
+def read_tsv_readid2taxid(in_file, na_as_zero=False, fraction=None):
+    # Parse a tsv in line-aligned chunks into the pool, offsets and taxids arrays,
+    # dropping the lines of reads outside the sample before anything is gathered
+    pools, lengths, taxids = [], [], []
+    for chunk in read_line_chunks(in_file):
+        data, line_starts, first_tabs, value_ends = parse_chunk(chunk)
+        if fraction is not None:
+            keep = in_sample(data, line_starts, first_tabs - line_starts, fraction)
+            line_starts, first_tabs = line_starts[keep], first_tabs[keep]
+            value_ends = value_ends[keep]
+        if len(line_starts) == 0:
+            continue
+
+        # Keep "<read id>\n" of every line, reusing the newline after the chunk
+        segment_starts = np.empty(2 * len(line_starts), dtype=np.int64)
+        segment_lengths = np.ones(2 * len(line_starts), dtype=np.int64)
+        segment_starts[0::2] = line_starts
+        segment_lengths[0::2] = first_tabs - line_starts
+        segment_starts[1::2] = len(data) - 1
+        pools.append(
+            np.frombuffer(
+                gather_segments(data, segment_starts, segment_lengths), np.uint8
+            )
+        )
+        lengths.append(first_tabs - line_starts + 1)
+        taxids.append(parse_values(data, first_tabs + 1, value_ends, na_as_zero))
+
+    lengths = np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.int64)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return make_table(
+        np.concatenate(pools) if pools else np.zeros(0, dtype=np.uint8),
+        offsets,
+        np.concatenate(taxids) if taxids else np.zeros(0, dtype=np.int64),
+    )
+
+
+def load_binary_readid2taxid(filename):
+    # The arrays are views of a read-only memory map, so loading costs no copies
+    with open(filename, "rb") as f:
+        if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            logging.error(f"{filename} is not a binary readid2taxid file")
+            sys.exit(1)
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return binary_table(data, filename)
+
+
+def binary_table(data, filename):
+    # The arrays are views of data, a memory map or the bytes of a decompressed file
+    count, pool_size = np.frombuffer(data, "<u8", 2, len(BINARY_MAGIC)).tolist()
+    taxids_start = HEADER_SIZE + 8 * (count + 1)
+    pool_start = taxids_start + 4 * count
+    if len(data) != pool_start + pool_size:
+        logging.error(f"{filename} is truncated or corrupt")
+        sys.exit(1)
+    return make_table(
+        np.frombuffer(data, np.uint8, pool_size, pool_start),
+        np.frombuffer(data, "<i8", count + 1, HEADER_SIZE),
+        np.frombuffer(data, "<i4", count, taxids_start),
+    )
+
+
+def load_readid2taxid(filename, na_as_zero=False, fraction=None):
+    # Accepts either format, plain or compressed, the binary one is recognized by
+    # its magic bytes. Only an uncompressed binary file can be memory mapped. With a
+    # fraction, only the reads in_sample keeps are loaded.
+    if is_binary_readid2taxid(filename):
+        if get_input_compression(filename) is None:
+            table = load_binary_readid2taxid(filename)
+        else:
+            with open_input(filename, "rb") as f:
+                table = binary_table(f.read(), filename)
+        return table if fraction is None else sample_table(table, fraction)
+    with open_input(filename, "rb") as f:
+        return read_tsv_readid2taxid(f, na_as_zero, fraction)
+
+
+def load_taxids(filename, na_as_zero=False):
+    # Only the tax id of every row, a tsv is parsed without gathering the read ids
+    if is_binary_readid2taxid(filename):
+        return load_readid2taxid(filename)["taxids"]
+    taxids = []
+    with open_input(filename, "rb") as f:
+        for chunk in read_line_chunks(f):
+            data, line_starts, first_tabs, value_ends = parse_chunk(chunk)
+            if len(line_starts) > 0:
+                taxids.append(
+                    parse_values(data, first_tabs + 1, value_ends, na_as_zero)
+                )
+    return np.concatenate(taxids) if taxids else np.zeros(0, dtype=np.int64)
+
+
+def get_read_ids(table):
+    # Every read id as bytes, split at C speed thanks to the newline terminators
+    return table["pool"].tobytes().split(b"\n")[:-1]
+
+
+def take_rows(table, rows):
+    starts = table["offsets"][rows]
+    lengths = table["offsets"][rows + 1] - starts
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    pool = np.frombuffer(gather_segments(table["pool"], starts, lengths), np.uint8)
+    return make_table(pool, offsets, np.asarray(table["taxids"])[rows])
+
+
+def write_binary_readid2taxid(table, out_file):
+    taxids = np.asarray(table["taxids"])
+    if len(taxids) > 0 and (taxids.min() < 0 or taxids.max() > MAX_TAXID):
+        logging.error("tax ids must be between 0 and 2^31 - 1 for the binary format")
+        sys.exit(1)
+    out_file.write(BINARY_MAGIC)
+    out_file.write(np.array([len(taxids), len(table["pool"])], "<u8").tobytes())
+    out_file.write(np.asarray(table["offsets"], "<i8").tobytes())
+    out_file.write(taxids.astype("<i4").tobytes())
+    out_file.write(memoryview(np.ascontiguousarray(table["pool"])))
+
+
+def write_tsv_readid2taxid(table, out_file):
+    # Gather "<read id>", "\t" and "<tax id>\n" segments for a block of rows at a time
+    offsets, taxids = table["offsets"], np.asarray(table["taxids"])
+    for start in range(0, len(taxids), WRITE_ROWS):
+        end = min(start + WRITE_ROWS, len(taxids))
+        pool = table["pool"][offsets[start] : offsets[end]]
+        unique_taxids, inverse = np.unique(taxids[start:end], return_inverse=True)
+        taxid_strings = [f"{taxid}\n".encode() for taxid in unique_taxids.tolist()]
+        pool_lengths = np.fromiter(map(len, taxid_strings), dtype=np.int64)
+        pool_starts = np.cumsum(pool_lengths) - pool_lengths + len(pool) + 1
+
+        source = np.concatenate(
+            (
+                pool,
+                np.frombuffer(b"\t", np.uint8),
+                np.frombuffer(b"".join(taxid_strings), np.uint8),
+            )
+        )
+        rows = end - start
+        segment_starts = np.empty(3 * rows, dtype=np.int64)
+        segment_lengths = np.empty(3 * rows, dtype=np.int64)
+        segment_starts[0::3] = offsets[start:end] - offsets[start]
+        segment_lengths[0::3] = np.diff(offsets[start : end + 1]) - 1
+        segment_starts[1::3] = len(pool)
+        segment_lengths[1::3] = 1
+        segment_starts[2::3] = pool_starts[inverse]
+        segment_lengths[2::3] = pool_lengths[inverse]
+        out_file.write(gather_segments(source, segment_starts, segment_lengths))
+
+
+def write_readid2taxid(table, out_file, binary):
+    if binary:
+        write_binary_readid2taxid(table, out_file)
+    else:
+        write_tsv_readid2taxid(table, out_file)
+
+
+class Readid2TaxidOutput:
+    # Tools that find reads one at a time write tsv rows as they go,
+    # the binary format needs every read before it can be written
+    def __init__(self, binary, output=None):
+        self.binary = binary
+        self.out_file = BulkWriter(output)
+        self.read_ids, self.taxids = [], []
+
+    def add(self, read_id, taxid):
+        if self.binary:
+            self.read_ids.append(read_id)
+            self.taxids.append(taxid)
+        else:
+            self.out_file.write(f"{read_id}\t{taxid}\n")
+
+    def close(self):
+        if self.binary:
+            write_binary_readid2taxid(
+                table_from_lists(self.read_ids, self.taxids), self.out_file
+            )
+        self.out_file.close()
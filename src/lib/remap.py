@@ -0,0 +1,247 @@
+import logging
+import sys
+
+import numpy as np
+
+from lib.input import open_input
+
+CHUNK_SIZE = 4 * 1024 * 1024
+KRAKENUNIQ_MIN_SEQUENCE_TAXID = 1000000000
+
+
+def get_seqid2taxid(filename, columns=None):
+    seqid2taxid = {}
+    key_column, value_column = (0, 1) if columns is None else columns
+    with open_input(filename, "r") as f:
+        for line in f:
+            line = line.rstrip("\n").split("\t")
+            seqid2taxid[line[key_column]] = int(line[value_column])
+    return seqid2taxid
+
+
+def get_krakenuniq_taxid2taxid(filename):
+    # krakenuniq assigns sequences their own tax ids, map them back to the real ones
+    krakenuniq_seq2taxid = get_seqid2taxid(filename)
+    seqid2taxid = get_seqid2taxid(filename + ".orig")
+    taxid2taxid = {}
+    for seqid, taxid in krakenuniq_seq2taxid.items():
+        real_taxid = seqid2taxid[seqid]
+        taxid2taxid[taxid] = real_taxid
+    return taxid2taxid
+
+
+def get_kasa_taxid2taxid(ref_content, seqid2taxid):
+    kasa_readid2taxid = get_seqid2taxid(ref_content, (3, 2))
+    seqid2taxid = get_seqid2taxid(seqid2taxid)
+    taxid2taxid = {}
+    for seqid, taxid in kasa_readid2taxid.items():
+        real_taxid = seqid2taxid[seqid]
+        taxid2taxid[taxid] = real_taxid
+    return taxid2taxid
+
+
+def load_lookup(krakenuniq_map=None, kasa_map_and_seqid2taxid=None):
+    # The translation table of a classifier's tax ids, None if they are NCBI tax ids
+    if krakenuniq_map is not None:
+        logging.info(f"Reading krakenuniq translation table {krakenuniq_map}")
+        # Only krakenuniq's sequence tax ids are translated, real tax ids are kept
+        krakenuniq_taxid2taxid = get_krakenuniq_taxid2taxid(krakenuniq_map)
+        return build_lookup(
+            {
+                taxid: real_taxid
+                for taxid, real_taxid in krakenuniq_taxid2taxid.items()
+                if taxid > KRAKENUNIQ_MIN_SEQUENCE_TAXID
+            },
+            KRAKENUNIQ_MIN_SEQUENCE_TAXID,
+        )
+    if kasa_map_and_seqid2taxid is not None:
+        split_files = list(kasa_map_and_seqid2taxid.split(","))
+        logging.info(f"Reading kASA translation table {split_files[0]}")
+        return build_lookup(get_kasa_taxid2taxid(split_files[0], split_files[1]))
+    return None
+
+
+def build_lookup(taxid2taxid, passthrough_max=-1):
+    # Tax ids <= passthrough_max that aren't in the table are output unchanged
+    keys = np.fromiter(taxid2taxid.keys(), dtype=np.int64, count=len(taxid2taxid))
+    values = np.fromiter(taxid2taxid.values(), dtype=np.int64, count=len(taxid2taxid))
+    lookup = {"passthrough_max": passthrough_max, "dense": None, "keys": None}
+    if len(keys) == 0:
+        lookup["keys"], lookup["values"] = keys, values
+        return lookup
+
+    # Use a dense array when the ids are packed closely enough, otherwise binary search
+    offset = int(keys.min())
+    span = int(keys.max()) - offset + 1
+    if span <= max(4 * len(keys), 1 << 16):
+        dense = np.full(span, -1, dtype=np.int64)
+        dense[keys - offset] = values
+        lookup["offset"], lookup["dense"] = offset, dense
+    else:
+        order = np.argsort(keys)
+        lookup["keys"], lookup["values"] = keys[order], values[order]
+    return lookup
+
+
+def translate(lookup, taxids):
+    translated = np.full(len(taxids), -1, dtype=np.int64)
+    if lookup["dense"] is not None:
+        index = taxids - lookup["offset"]
+        in_range = (index >= 0) & (index < len(lookup["dense"]))
+        translated[in_range] = lookup["dense"][index[in_range]]
+    elif len(lookup["keys"]) > 0:
+        index = np.searchsorted(lookup["keys"], taxids)
+        index[index == len(lookup["keys"])] = 0
+        found = lookup["keys"][index] == taxids
+        translated[found] = lookup["values"][index[found]]
+
+    missing = translated == -1
+    passthrough = missing & (taxids <= lookup["passthrough_max"])
+    translated[passthrough] = taxids[passthrough]
+    missing &= ~passthrough
+    if missing.any():
+        logging.error(
+            f"tax ids {np.unique(taxids[missing])[:10].tolist()} are not in the translation table"
+        )
+        sys.exit(1)
+    return translated
+
+
+def remap_taxids(taxids, lookup):
+    # Translate each distinct tax id once
+    unique_taxids, inverse = np.unique(taxids, return_inverse=True)
+    return translate(lookup, unique_taxids.astype(np.int64))[inverse]
+
+
+def parse_chunk(chunk):
+    # Locate the read id and value of every line of a chunk ending with a newline
+    data = np.frombuffer(chunk, dtype=np.uint8)
+    line_ends = np.flatnonzero(data == 10)
+    line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+    # Ignore carriage returns and empty lines
+    has_cr = np.zeros(len(line_ends), dtype=bool)
+    has_cr[line_ends > 0] = data[line_ends[line_ends > 0] - 1] == 13
+    line_ends = line_ends - has_cr
+    not_empty = line_ends > line_starts
+    line_starts, line_ends = line_starts[not_empty], line_ends[not_empty]
+
+    tabs = np.flatnonzero(data == 9)
+    first_tab_index = np.searchsorted(tabs, line_starts)
+    if (first_tab_index == len(tabs)).any() or (
+        tabs[np.minimum(first_tab_index, len(tabs) - 1)] >= line_ends
+    ).any():
+        logging.error("found a line without a tab separating the read id and tax id")
+        sys.exit(1)
+    first_tabs = tabs[first_tab_index]
+
+    # The value ends at the next tab (extra columns are dropped) or the end of the line
+    next_tab_index = np.minimum(first_tab_index + 1, len(tabs) - 1)
+    value_ends = np.where(
+        (first_tab_index + 1 < len(tabs)) & (tabs[next_tab_index] < line_ends),
+        tabs[next_tab_index],
+        line_ends,
+    )
+    return data, line_starts, first_tabs, value_ends
+
+
+def parse_values(data, value_starts, value_ends, na_as_zero):
+    # Parse the digits of every value at once, right aligned in a 2D array
+    lengths = value_ends - value_starts
+    width = int(lengths.max())
+    positions = np.arange(width)
+    valid = positions[None, :] >= (width - lengths)[:, None]
+    index = value_ends[:, None] - width + positions[None, :]
+    digits = data[np.where(valid, index, 0)].astype(np.int64) - 48
+    digits[~valid] = 0
+
+    numeric = ((digits >= 0) & (digits <= 9)).all(axis=1) & (lengths > 0)
+    values = (digits * (10 ** (width - 1 - positions))).sum(axis=1)
+    if not numeric.all():
+        bad_lines = np.flatnonzero(~numeric)
+        if na_as_zero:
+            is_na = (lengths[bad_lines] == 2) & (
+                data[value_starts[bad_lines]] == ord("N")
+            )
+            is_na &= data[
+                np.minimum(value_starts[bad_lines] + 1, len(data) - 1)
+            ] == ord("A")
+            if is_na.all():
+                values[bad_lines] = 0
+                return values
+            bad_lines = bad_lines[~is_na]
+        first_bad = bad_lines[0]
+        logging.error(
+            f"found a tax id that is not a number: {data[value_starts[first_bad]:value_ends[first_bad]].tobytes().decode()}"
+        )
+        sys.exit(1)
+    return values
+
+
+def gather_segments(source, segment_starts, segment_lengths):
+    # Concatenate source[start:start + length] for every segment without a python loop
+    output_starts = np.cumsum(segment_lengths) - segment_lengths
+    index = np.repeat(segment_starts - output_starts, segment_lengths)
+    index += np.arange(len(index))
+    return source[index].tobytes()
+
+
+def remap_chunk(chunk, lookup, na_as_zero):
+    data, line_starts, first_tabs, value_ends = parse_chunk(chunk)
+    if len(line_starts) == 0:
+        return b""
+
+    segment_starts = np.empty(2 * len(line_starts), dtype=np.int64)
+    segment_lengths = np.empty(2 * len(line_starts), dtype=np.int64)
+    segment_starts[0::2] = line_starts
+    if lookup is None:
+        # Nothing to translate, output "<read id>\t<value>" and a newline from the end
+        source = np.concatenate((data, np.frombuffer(b"\n0\n", dtype=np.uint8)))
+        segment_lengths[0::2] = value_ends - line_starts
+        segment_starts[1::2] = len(data)
+        segment_lengths[1::2] = 1
+        if na_as_zero:
+            # CLARK's NA becomes "0\n", every other value is passed through as is
+            value_starts = first_tabs + 1
+            is_na = (
+                (value_ends - value_starts == 2)
+                & (data[value_starts] == ord("N"))
+                & (data[np.minimum(value_starts + 1, len(data) - 1)] == ord("A"))
+            )
+            segment_lengths[0::2][is_na] = value_starts[is_na] - line_starts[is_na]
+            segment_starts[1::2][is_na] = len(data) + 1
+            segment_lengths[1::2][is_na] = 2
+        return gather_segments(source, segment_starts, segment_lengths)
+
+    values = parse_values(data, first_tabs + 1, value_ends, na_as_zero)
+
+    # Translate and format each distinct tax id once
+    unique_values, inverse = np.unique(values, return_inverse=True)
+    if lookup is not None:
+        unique_values = translate(lookup, unique_values)
+    value_strings = [f"{value}\n".encode() for value in unique_values.tolist()]
+    pool_lengths = np.fromiter(map(len, value_strings), dtype=np.int64)
+    pool_starts = np.cumsum(pool_lengths) - pool_lengths + len(data)
+
+    # Gather "<read id>\t" from the chunk and "<tax id>\n" from the pool for every line
+    source = np.concatenate(
+        (data, np.frombuffer(b"".join(value_strings), dtype=np.uint8))
+    )
+    segment_lengths[0::2] = first_tabs + 1 - line_starts
+    segment_starts[1::2] = pool_starts[inverse]
+    segment_lengths[1::2] = pool_lengths[inverse]
+    return gather_segments(source, segment_starts, segment_lengths)
+
+
+def remap_readid2taxid(in_file, out_file, lookup=None, na_as_zero=False):
+    # Stream the input in line-aligned chunks so memory doesn't depend on its size
+    total_lines = 0
+    while True:
+        chunk = in_file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        chunk += in_file.readline()
+        if not chunk.endswith(b"\n"):
+            chunk += b"\n"
+        total_lines += chunk.count(b"\n")
+        out_file.write(remap_chunk(chunk, lookup, na_as_zero))
+    return total_lines
@@ -0,0 +1,163 @@
+import os
+
+# Seeded generators of synthetic inputs, every function takes a random.Random so the
+# same seed always produces the same files
+
+TAXONOMY_RANKS = [
+    ("superkingdom", 0.001),
+    ("phylum", 0.005),
+    ("class", 0.01),
+    ("order", 0.02),
+    ("family", 0.05),
+    ("genus", 0.15),
+    ("species", 0.5),
+    ("strain", 0.264),
+]
+BASES = "ACGT"
+
+
+def write_dmp_line(out_file, fields):
+    out_file.write("\t|\t".join(fields) + "\t|\n")
+
+
+def write_taxonomy(directory, size, rng):
+    # An NCBI-style nodes.dmp/names.dmp of about size nodes, every rank's nodes
+    # hang from a random node of the rank above. Returns the tax ids of each rank.
+    os.makedirs(directory, exist_ok=True)
+    taxids_by_rank = {"no rank": ["1"]}
+    nodes = [("1", "1", "no rank")]
+    parents = ["1"]
+    taxid = 1
+    for rank, fraction in TAXONOMY_RANKS:
+        rank_taxids = []
+        for _ in range(max(1, int(size * fraction))):
+            # Leave gaps like real tax ids
+            taxid += rng.randint(1, 20)
+            rank_taxids.append(str(taxid))
+            nodes.append((str(taxid), rng.choice(parents), rank))
+        taxids_by_rank[rank] = rank_taxids
+        parents = rank_taxids
+
+    with open(os.path.join(directory, "nodes.dmp"), "w") as f:
+        for node_taxid, parent_taxid, rank in nodes:
+            write_dmp_line(
+                f,
+                [node_taxid, parent_taxid, rank, "", "0", "1", "11", "1"]
+                + ["0", "1", "1", "0", ""],
+            )
+    with open(os.path.join(directory, "names.dmp"), "w") as f:
+        for node_taxid, _, rank in nodes:
+            name = "root" if node_taxid == "1" else f"{rank} {node_taxid}"
+            write_dmp_line(f, [node_taxid, name, "", "scientific name"])
+    return taxids_by_rank
+
+
+def write_accession2taxid(filename, count, taxids, rng):
+    # Returns the (accession, tax id) of every line
+    accessions = []
+    with open(filename, "w") as f:
+        for index in range(count):
+            accession = f"NZ_{index:09d}"
+            taxid = rng.choice(taxids)
+            f.write(f"{accession}.1\t{taxid}\n")
+            accessions.append((accession, taxid))
+    return accessions
+
+
+def get_read_alignments(reads, accessions, rng, max_alignments, unmapped_fraction):
+    # (read id, accession or None, mapping quality) rows grouped by read id
+    for index in range(reads):
+        read_id = f"read_{index}"
+        if rng.random() < unmapped_fraction:
+            yield read_id, None, 0
+            continue
+        for _ in range(rng.randint(1, max_alignments)):
+            yield read_id, rng.choice(accessions)[0], rng.choice((0, 30, 60))
+
+
+def write_sam(
+    filename,
+    reads,
+    accessions,
+    rng,
+    max_alignments=3,
+    unmapped_fraction=0.1,
+    read_length=100,
+):
+    # A name grouped SAM file with multi-mapping reads, returns the number of alignments
+    sequence = random_sequence(read_length, rng)
+    quality = "I" * read_length
+    total_alignments = 0
+    with open(filename, "w") as f:
+        f.write("@HD\tVN:1.6\tSO:queryname\n")
+        for accession, _ in accessions:
+            f.write(f"@SQ\tSN:{accession}.1\tLN:100000\n")
+        for read_id, accession, mapq in get_read_alignments(
+            reads, accessions, rng, max_alignments, unmapped_fraction
+        ):
+            if accession is None:
+                f.write(f"{read_id}\t4\t*\t0\t0\t*\t*\t0\t0\t{sequence}\t{quality}\n")
+            else:
+                f.write(
+                    f"{read_id}\t0\t{accession}.1\t{rng.randint(1, 99000)}\t{mapq}\t"
+                    f"{read_length}M\t*\t0\t0\t{sequence}\t{quality}\n"
+                )
+            total_alignments += 1
+    return total_alignments
+
+
+def random_sequence(length, rng):
+    return "".join(rng.choices(BASES, k=length))
+
+
+def write_fastq(filename, reads, accessions, rng, read_length=1000):
+    # Badread-style descriptions, '<read id> <accession>,<strand><start>-<end>'
+    with open(filename, "w") as f:
+        for index in range(reads):
+            accession = rng.choice(accessions)[0]
+            start = rng.randint(0, 100000)
+            f.write(
+                f"@read_{index} {accession}.1,+strand,{start}-{start + read_length}\n"
+                f"{random_sequence(read_length, rng)}\n+\n{'I' * read_length}\n"
+            )
+
+
+def write_fasta(filename, sequences, rng, sequence_length=10000, line_length=80):
+    with open(filename, "w") as f:
+        for index in range(sequences):
+            sequence = random_sequence(sequence_length, rng)
+            f.write(f">NZ_{index:09d}.1 synthetic sequence {index}\n")
+            for start in range(0, sequence_length, line_length):
+                f.write(sequence[start : start + line_length] + "\n")
+
+
+def write_readid2taxid_pair(
+    ground_truth_file,
+    predicted_file,
+    reads,
+    taxids,
+    reference_taxids,
+    rng,
+    accuracy=0.8,
+):
+    # A ground truth over taxids and a classifier's prediction (from the reference
+    # taxids only) that agrees with it at the given rate when it can, and is
+    # unclassified, wrong or missing otherwise
+    reference_taxid_set = set(reference_taxids)
+    with open(ground_truth_file, "w") as truth, open(predicted_file, "w") as predicted:
+        for index in range(reads):
+            true_taxid = rng.choice(taxids) if rng.random() > 0.05 else "0"
+            truth.write(f"read_{index}\t{true_taxid}\n")
+            roll = rng.random()
+            if roll < accuracy and true_taxid in reference_taxid_set:
+                predicted.write(f"read_{index}\t{true_taxid}\n")
+            elif roll < accuracy + (1 - accuracy) / 3:
+                predicted.write(f"read_{index}\t0\n")
+            elif roll < accuracy + 2 * (1 - accuracy) / 3:
+                predicted.write(f"read_{index}\t{rng.choice(reference_taxids)}\n")
+
+
+def write_seqid2taxid(filename, accessions):
+    with open(filename, "w") as f:
+        for accession, taxid in accessions:
+            f.write(f"{accession}.1\t{taxid}\n")
@@ -0,0 +1,135 @@
+import argparse
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+
+from lib.lookup import (
+    LOOKUP_SOCKET_VARIABLE,
+    handle_request,
+    receive_message,
+    send_message,
+)
+
+
+def serve(socket_path, loaded):
+    class Handler(socketserver.BaseRequestHandler):
+        # A connection sends any number of requests, each gets one response
+        def handle(self):
+            while True:
+                try:
+                    request = receive_message(self.request)
+                except (ConnectionError, ValueError):
+                    return
+                if request is None:
+                    return
+                try:
+                    response = {"result": handle_request(loaded, request)}
+                except Exception as e:
+                    response = {"error": f"{type(e).__name__}: {e}"}
+                send_message(self.request, response)
+
+    server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+    server.daemon_threads = True
+    # Stop cleanly on 'kill' as well as on Ctrl-C
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        logging.info(f"Serving on {socket_path}")
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+        logging.info("Server stopped")
+
+
+def main():
+    # Parse arguments from command line
+    parser = argparse.ArgumentParser(
+        description="Loads a taxonomy, accession2taxid maps and the names.dmp index once and "
+        "answers accession to tax id, LCA, rank ancestor and name to tax id lookups over a Unix "
+        f"socket. Scripts run with {LOOKUP_SOCKET_VARIABLE}=<socket> use it instead of loading "
+        "these files themselves"
+    )
+    parser.add_argument(
+        "-a",
+        "--accession2taxid",
+        dest="accession2taxid",
+        action="append",
+        default=[],
+        help="An accession2taxid to serve (can be given several times)",
+    )
+    parser.add_argument(
+        "-t",
+        "--taxonomy",
+        dest="taxonomy",
+        default=None,
+        help="NCBI taxonomy directory",
+    )
+    parser.add_argument(
+        "-n",
+        "--names",
+        dest="names",
+        action="store_true",
+        help="Also serve name to tax id lookups from the taxonomy's names.dmp",
+    )
+    parser.add_argument("socket", help="Path of the Unix socket to listen on")
+    args = parser.parse_args()
+    if args.names and args.taxonomy is None:
+        parser.error("'--names' requires '--taxonomy'")
+    if args.taxonomy is None and not args.accession2taxid:
+        parser.error("nothing to serve, give '--taxonomy' and/or '--accession2taxid'")
+
+    # The server loads the files itself, even when started from a job's environment
+    os.environ.pop(LOOKUP_SOCKET_VARIABLE, None)
+
+    from lib.lib import load_accession2taxid
+    from lib.names import load_name_index
+
+    # Initialize event logger
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.DEBUG,
+        format="[%(asctime)s %(threadName)s %(levelname)s] %(message)s",
+        datefmt="%m-%d-%Y %I:%M:%S%p",
+    )
+
+    # Refuse to replace the socket of a server that is still running
+    if os.path.exists(args.socket):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            try:
+                connection.connect(args.socket)
+                logging.error(f"a server is already listening on {args.socket}")
+                sys.exit(1)
+            except OSError:
+                os.unlink(args.socket)
+
+    loaded = {
+        "taxonomy": None,
+        "taxonomy_directory": None,
+        "maps": {},
+        "name_index": None,
+        "names_directory": None,
+    }
+    if args.taxonomy is not None:
+        from taxonomy.taxonomy import Taxonomy
+
+        logging.info(f"Reading taxonomy from directory {args.taxonomy}")
+        loaded["taxonomy"] = Taxonomy.from_ncbi(args.taxonomy)
+        loaded["taxonomy_directory"] = os.path.realpath(args.taxonomy)
+        if args.names:
+            logging.info(f"Loading name index for {args.taxonomy}")
+            loaded["name_index"] = load_name_index(args.taxonomy)
+            loaded["names_directory"] = loaded["taxonomy_directory"]
+    for map_file in args.accession2taxid:
+        logging.info(f"Reading accession2taxid at {map_file}")
+        loaded["maps"][os.path.realpath(map_file)] = load_accession2taxid(map_file)
+
+    serve(args.socket, loaded)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import logging
+import sys
+
+from lib.profiler import TIME_SERIES_COLUMNS, profile_command
+
+
+def main():
+    # Parse arguments from command line
+    parser = argparse.ArgumentParser(
+        description="Runs a command (e.g. a classifier) and samples the memory, CPU, I/O and threads "
+        "of it and its child processes from /proc. "
+        "Usage: profile-command.py [options] <time_series.tsv> -- <command> [args...]"
+    )
+    parser.add_argument(
+        "-i",
+        "--interval",
+        type=float,
+        default=0.5,
+        help="Seconds between samples (default 0.5)",
+    )
+    parser.add_argument(
+        "-s",
+        "--summary",
+        dest="summary",
+        default=None,
+        help="Write the summary as a tab separated key/value file (default is to log it)",
+    )
+    parser.add_argument(
+        "time_series", help="Tab separated file to write the samples to"
+    )
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="The command to run")
+    args = parser.parse_args()
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        parser.error("no command given to profile")
+
+    # Initialize event logger
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.DEBUG,
+        format="[%(asctime)s %(threadName)s %(levelname)s] %(message)s",
+        datefmt="%m-%d-%Y %I:%M:%S%p",
+    )
+
+    logging.info(f"Profiling '{' '.join(command)}' every {args.interval} seconds")
+    with open(args.time_series, "w") as out_file:
+        out_file.write("\t".join(TIME_SERIES_COLUMNS) + "\n")
+
+        # Write each sample as it is taken so an interrupted run still has data
+        def write_sample(sample):
+            out_file.write(
+                "\t".join(str(sample[column]) for column in TIME_SERIES_COLUMNS) + "\n"
+            )
+            out_file.flush()
+
+        _, summary = profile_command(command, args.interval, write_sample)
+
+    if args.summary is None:
+        for key, value in summary.items():
+            logging.info(f"{key}: {value}")
+    else:
+        with open(args.summary, "w") as out_file:
+            for key, value in summary.items():
+                out_file.write(f"{key}\t{value}\n")
+
+    logging.info("Done!")
+    # A command killed by a signal has a negative status, exit like a shell would
+    exit_status = summary["exit_status"]
+    sys.exit(128 - exit_status if exit_status < 0 else exit_status)
+
+
+if __name__ == "__main__":
+    main()
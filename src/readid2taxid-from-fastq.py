@@ -2,9 +2,10 @@ import argparse
 import logging
 import sys
 
-from Bio import SeqIO
 
+from lib.input import open_input
 from lib.lib import load_accession2taxid
+from lib.metrics import Metrics, add_metrics_arguments
 
 
 def main():
@@ -12,10 +13,34 @@ def main():
     parser = argparse.ArgumentParser(
         description="Outputs a tsv read id to tax id mapping from a Badread simulated FASTQ reads"
     )
+    parser.add_argument(
+        "-b",
+        "--binary",
+        dest="binary",
+        action="store_true",
+        help="Output the binary readid2taxid format instead of a tsv",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        default=None,
+        help="Write to this file instead of stdout (compressed if it ends in .gz or .zst)",
+    )
+    add_metrics_arguments(parser)
     parser.add_argument("accession2taxid", help="Tab separated accession to tax id")
-    parser.add_argument("fastq_reads", help="Simulated FASTQ reads")
+    parser.add_argument(
+        "fastq_reads",
+        help="Simulated FASTQ reads, optionally gzip, BGZF or zstd compressed",
+    )
     args = parser.parse_args()
 
+    from Bio import SeqIO
+
+    from lib.lookup import prefetch_accessions
+    from lib.pipeline import batched
+    from lib.readid2taxid import Readid2TaxidOutput
+
     # Initialize event logger
     logging.basicConfig(
         stream=sys.stderr,
@@ -24,16 +49,33 @@ def main():
         datefmt="%m-%d-%Y %I:%M:%S%p",
     )
 
+    metrics = Metrics(args.metrics, args.profile)
+
     # Read accession2taxid
     logging.info(f"Reading accession2taxid at {args.accession2taxid}")
-    accession2taxid = load_accession2taxid(args.accession2taxid)
+    with metrics.stage("mapping load") as stage:
+        accession2taxid = load_accession2taxid(args.accession2taxid)
+        stage["items"] = len(accession2taxid)
     logging.info("Accession2taxid read!")
 
+    output = Readid2TaxidOutput(args.binary, args.output)
     logging.info("Extracting readid2taxid from FASTQ file")
-    for read in SeqIO.parse(args.fastq_reads, "fastq"):
-        accession = read.description.strip().split(" ")[1].split(",")[0].split(".")[0]
-        print(f"{read.id}\t{accession2taxid[accession]}")
+    with metrics.stage("main loop") as stage, open_input(args.fastq_reads, "r") as f:
+        stage["items"] = 0
+        # Reads are handled in batches so a lookup server gets one request per batch
+        for batch in batched(SeqIO.parse(f, "fastq")):
+            accessions = [
+                read.description.strip().split(" ")[1].split(",")[0].split(".")[0]
+                for read in batch
+            ]
+            prefetch_accessions(accession2taxid, accessions)
+            for read, accession in zip(batch, accessions):
+                output.add(read.id, accession2taxid[accession])
+            stage["items"] += len(batch)
 
+    with metrics.stage("output"):
+        output.close()
+    metrics.close()
     logging.info("Done!")
 
 
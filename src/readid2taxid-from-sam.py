@@ -2,9 +2,9 @@ import argparse
 import logging
 import sys
 
-import pysam
 from lib.lib import load_accession2taxid
-from taxonomy.taxonomy import Taxonomy
+from lib.metrics import Metrics, add_metrics_arguments
+from lib.pipeline import readid2taxid_from_alignments
 
 
 def main():
@@ -22,15 +22,35 @@ def main():
     parser.add_argument(
         "-s",
         "--species-level",
-        dest="species-level",
+        dest="species_level",
         action="store_true",
         help="If the mapping doesn't occur at the species level, consider it unmapped",
     )
+    parser.add_argument(
+        "-b",
+        "--binary",
+        dest="binary",
+        action="store_true",
+        help="Output the binary readid2taxid format instead of a tsv",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        default=None,
+        help="Write to this file instead of stdout (compressed if it ends in .gz or .zst)",
+    )
+    add_metrics_arguments(parser)
     parser.add_argument("accession2taxid", help="Tab separated accession to tax id")
     parser.add_argument("sam_file", help="SAM alignment file")
     parser.add_argument("taxonomy", help="The NCBI taxonomy location")
     args = parser.parse_args()
 
+    import pysam
+
+    from lib.lookup import load_taxonomy
+    from lib.readid2taxid import Readid2TaxidOutput
+
     # Initialize event logger
     logging.basicConfig(
         stream=sys.stderr,
@@ -39,84 +59,37 @@ def main():
         datefmt="%m-%d-%Y %I:%M:%S%p",
     )
 
+    metrics = Metrics(args.metrics, args.profile)
+
     # Read taxonomy
     logging.info(f"Attempting to read taxonomy from directory {args.taxonomy}")
-    taxonomy = Taxonomy.from_ncbi(args.taxonomy)
+    with metrics.stage("taxonomy load"):
+        taxonomy = load_taxonomy(args.taxonomy)
     logging.info("Taxonomy read!")
 
     # Read accession2taxid
     logging.info(f"Reading accession2taxid at {args.accession2taxid}")
-    accession2taxid = load_accession2taxid(args.accession2taxid)
+    with metrics.stage("mapping load") as stage:
+        accession2taxid = load_accession2taxid(args.accession2taxid)
+        stage["items"] = len(accession2taxid)
     logging.info("Accession2taxid read!")
 
-    last_readid = ""
-    last_readid_highest_mapq = -1
-    mappings_buffer = []
+    output = Readid2TaxidOutput(args.binary, args.output)
     logging.info("Extracting readid2taxid from SAM file")
-    for alignment in pysam.AlignmentFile(args.sam_file, "r"):
-        readid = alignment.query_name
-        accession = alignment.reference_name
-
-        if accession is not None:
-            accession = accession.split(".")[0]
-
-        mapq = alignment.mapping_quality
-
-        if last_readid == readid or last_readid == "":
-            # Haven't gathered all information for this read yet
-            if last_readid == "":
-                last_readid = readid
-
-            if mapq >= last_readid_highest_mapq:
-                mappings_buffer.clear()
-                last_readid_highest_mapq = mapq
-                mappings_buffer.append(accession)
-
-        else:
-            # This is a new read
-            # Print the information for the last read
-            if len(mappings_buffer) == 1:
-                print_accession = mappings_buffer[0]
-                if print_accession is None:
-                    print(f"{last_readid}\t0")
-                else:
-                    print(f"{last_readid}\t{accession2taxid[mappings_buffer[0]]}")
-            else:
-                lca = accession2taxid[mappings_buffer[0]]
-                for accession in mappings_buffer[1:]:
-                    lca = taxonomy.lca(lca, accession2taxid[accession]).id
-
-                if (
-                    args.species_level
-                    and taxonomy.parent(lca, at_rank="species") is None
-                ):
-                    print(f"{last_readid}\t0")
-                else:
-                    print(f"{last_readid}\t{lca}")
-
-            # Start the new readid
-            last_readid = readid
-            mappings_buffer.clear()
-            mappings_buffer.append(accession)
-            last_readid_highest_mapq = mapq
-
-    # Print remaining information in the buffer
-    if len(mappings_buffer) == 1:
-        print_accession = mappings_buffer[0]
-        if print_accession is None:
-            print(f"{last_readid}\t0")
-        else:
-            print(f"{last_readid}\t{accession2taxid[mappings_buffer[0]]}")
-    else:
-        lca = accession2taxid[mappings_buffer[0]]
-        for accession in mappings_buffer[1:]:
-            lca = taxonomy.lca(lca, accession2taxid[accession]).id
-
-            if args.species_level and taxonomy.parent(lca, at_rank="species") is None:
-                print(f"{last_readid}\t0")
-            else:
-                print(f"{last_readid}\t{lca}")
-
+    with metrics.stage("main loop") as stage:
+        stage["items"] = 0
+        for readid, taxid in readid2taxid_from_alignments(
+            pysam.AlignmentFile(args.sam_file, "r"),
+            accession2taxid,
+            taxonomy,
+            args.species_level,
+        ):
+            output.add(readid, taxid)
+            stage["items"] += 1
+
+    with metrics.stage("output"):
+        output.close()
+    metrics.close()
     logging.info("Done!")
 
 
@@ -2,33 +2,8 @@ import argparse
 import logging
 import sys
 
-from taxonomy.taxonomy import Taxonomy
-
-
-def lca_of_taxids(taxids, taxonomy: Taxonomy) -> str:
-    lca = ""
-    for idx, taxid in enumerate(taxids):
-        if taxid == 0:
-            return "0"
-
-        if idx == 0:
-            lca = str(taxid)
-        else:
-            lca = taxonomy.lca(lca, str(taxid)).id
-    return lca
-
-
-def get_readid2taxid_for_lca(filename):
-    readid2taxid = {}
-    with open(filename, "r") as f:
-        for line in f.readlines():
-            line = line.strip().split("\t")
-            read_id = line[0]
-            if read_id in readid2taxid:
-                readid2taxid[read_id].append(int(line[1]))
-            else:
-                readid2taxid[read_id] = [int(line[1])]
-    return readid2taxid
+from lib.metrics import Metrics, add_metrics_arguments
+from lib.pipeline import group_taxids, lca_of_taxid_sets
 
 
 def main():
@@ -38,10 +13,35 @@ def main():
         description="Takes read id to tax id mapping. "
         "Ensures that each read id has only one tax id by using the lca if needed"
     )
+    parser.add_argument(
+        "-b",
+        "--binary",
+        dest="binary",
+        action="store_true",
+        help="Output the binary readid2taxid format instead of a tsv",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        default=None,
+        help="Write to this file instead of stdout (compressed if it ends in .gz or .zst)",
+    )
+    add_metrics_arguments(parser)
     parser.add_argument("taxonomy", help="NCBI taxonomy directory")
-    parser.add_argument("readid2taxid", help="Tab separated read id to tax id")
+    parser.add_argument(
+        "readid2taxid", help="Read id to tax id, as a tsv or the binary format"
+    )
     args = parser.parse_args()
 
+    from lib.output import BulkWriter
+    from lib.readid2taxid import (
+        get_read_ids,
+        load_readid2taxid,
+        table_from_lists,
+        write_readid2taxid,
+    )
+
     # Initialize event logger
     logging.basicConfig(
         stream=sys.stderr,
@@ -50,20 +50,42 @@ def main():
         datefmt="%m-%d-%Y %I:%M:%S%p",
     )
 
-    # Read taxonomy
-    logging.info(f"Reading taxonomy from directory {args.taxonomy}")
-    taxonomy = Taxonomy.from_ncbi(args.taxonomy)
-    logging.info("Taxonomy read!")
+    metrics = Metrics(args.metrics, args.profile)
 
     logging.info(f"Reading readid2taxid at {args.readid2taxid}")
     # Read readid2taxid
-    readid2taxid = get_readid2taxid_for_lca(args.readid2taxid)
+    with metrics.stage("readid2taxid load") as stage:
+        table = load_readid2taxid(args.readid2taxid)
+        read_ids = get_read_ids(table)
+        stage["items"] = len(read_ids)
     logging.info("Readid2taxid read!")
 
-    logging.info("Computing the LCA of all reads")
-    for read_id, tax_ids in readid2taxid.items():
-        lca = lca_of_taxids(tax_ids, taxonomy)
-        print(f"{read_id}\t{lca}")
+    if len(set(read_ids)) == len(read_ids):
+        # Every read has one tax id, which is its own LCA
+        logging.info("Every read has one tax id, no LCA needed")
+    else:
+        from lib.lookup import load_taxonomy
+
+        # Read taxonomy
+        logging.info(f"Reading taxonomy from directory {args.taxonomy}")
+        with metrics.stage("taxonomy load"):
+            taxonomy = load_taxonomy(args.taxonomy)
+        logging.info("Taxonomy read!")
+
+        logging.info("Computing the LCA of all reads")
+        with metrics.stage("main loop") as stage:
+            readid2taxid = group_taxids(read_ids, table["taxids"].tolist())
+            table = table_from_lists(
+                list(readid2taxid),
+                lca_of_taxid_sets(list(readid2taxid.values()), taxonomy),
+            )
+            stage["items"] = len(read_ids)
+
+    with metrics.stage("output") as stage:
+        with BulkWriter(args.output) as out_file:
+            write_readid2taxid(table, out_file, args.binary)
+        stage["items"] = len(table["taxids"])
+    metrics.close()
 
     logging.info("Done!")
 
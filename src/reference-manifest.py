@@ -0,0 +1,119 @@
+import argparse
+import logging
+import os
+import sys
+
+from lib.lib import load_accession2taxid
+from lib.manifest import MANIFEST_FORMATS, build_manifest, load_manifest, save_manifest
+from lib.metrics import Metrics, add_metrics_arguments
+from lib.output import BulkWriter
+
+
+def main():
+    # Parse arguments from command line
+    parser = argparse.ArgumentParser(
+        description="Scans a reference directory once into a cached manifest, "
+        "then outputs the reference files needed by each classifier from the manifest"
+    )
+    add_metrics_arguments(parser)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser(
+        "build",
+        help="Scan the reference (only changed files if the manifest already exists)",
+    )
+    build_parser.add_argument(
+        "-t", "--threads", type=int, default=14, help="Number of threads to use"
+    )
+    build_parser.add_argument(
+        "accession2taxid", help="accession2taxid of reference file"
+    )
+    build_parser.add_argument(
+        "reference_directory", help="Directory containing reference fasta files"
+    )
+    build_parser.add_argument("taxonomy", help="NCBI taxonomy directory")
+    build_parser.add_argument("manifest", help="The manifest file to create or update")
+
+    emit_parser = subparsers.add_parser(
+        "emit", help="Print a classifier file from the manifest"
+    )
+    emit_parser.add_argument(
+        "format",
+        choices=list(MANIFEST_FORMATS),
+        help="taxor: taxor input tsv, clark: CLARK .fileToAccssnTaxID, "
+        "seqid2taxid: kraken-style seqid2taxid.map, accession2taxid: NCBI-style accession2taxid",
+    )
+    emit_parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        default=None,
+        help="Write to this file instead of stdout (compressed if it ends in .gz or .zst)",
+    )
+    emit_parser.add_argument("manifest", help="The manifest file created by 'build'")
+    args = parser.parse_args()
+
+    # Initialize event logger
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.DEBUG,
+        format="[%(asctime)s %(threadName)s %(levelname)s] %(message)s",
+        datefmt="%m-%d-%Y %I:%M:%S%p",
+    )
+
+    metrics = Metrics(args.metrics, args.profile)
+
+    if args.command == "build":
+        from lib.lookup import load_taxonomy
+
+        cached_manifest = None
+        if os.path.exists(args.manifest):
+            logging.info(f"Reading cached manifest at {args.manifest}")
+            cached_manifest = load_manifest(args.manifest)
+
+        # Read taxonomy
+        logging.info(f"Reading taxonomy from directory {args.taxonomy}")
+        with metrics.stage("taxonomy load"):
+            taxonomy = load_taxonomy(args.taxonomy)
+
+        # Read in accession2taxid
+        logging.info(f"Reading accession2taxid at {args.accession2taxid}")
+        with metrics.stage("mapping load") as stage:
+            accession2taxid = load_accession2taxid(args.accession2taxid)
+            stage["items"] = len(accession2taxid)
+
+        logging.info(f"Scanning reference files in {args.reference_directory}")
+        with metrics.stage("main loop") as stage:
+            manifest = build_manifest(
+                args.reference_directory,
+                accession2taxid,
+                taxonomy,
+                args.threads,
+                cached_manifest,
+            )
+            stage["items"] = len(manifest["files"])
+
+        logging.info(f"Writing manifest to {args.manifest}")
+        with metrics.stage("output"):
+            save_manifest(manifest, args.manifest)
+
+    else:
+        logging.info(f"Reading manifest at {args.manifest}")
+        with metrics.stage("mapping load"):
+            manifest = load_manifest(args.manifest)
+
+        logging.info(f"Printing {args.format} lines")
+        with metrics.stage("output") as stage:
+            stage["items"] = 0
+            with BulkWriter(args.output) as out_file:
+                for line in MANIFEST_FORMATS[args.format](manifest):
+                    out_file.write(line + "\n")
+                    stage["items"] += 1
+
+    metrics.close()
+
+    logging.info("Done!")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,37 +2,36 @@ import argparse
 import logging
 import sys
 
+from lib.batch import get_input_output_pairs, is_batch, run_batch
+from lib.metrics import Metrics, add_metrics_arguments
+from lib.output import BulkWriter
 
-def get_seqid2taxid(filename, columns=None):
-    readid2taxid = {}
-    with open(filename, "r") as f:
-        for line in f.readlines():
-            line = line.strip().split("\t")
-            if columns is None:
-                readid2taxid[line[0]] = int(line[1])
-            else:
-                readid2taxid[line[columns[0]]] = int(line[columns[1]])
-    return readid2taxid
-
-
-def get_krakenuniq_taxid2taxid(filename):
-    krakenuniq_seq2taxid = get_seqid2taxid(filename)
-    seqid2taxid = get_seqid2taxid(filename + ".orig")
-    taxid2taxid = {}
-    for seqid, taxid in krakenuniq_seq2taxid.items():
-        real_taxid = seqid2taxid[seqid]
-        taxid2taxid[taxid] = real_taxid
-    return taxid2taxid
-
-
-def get_kasa_taxid2taxid(ref_content, seqid2taxid):
-    kasa_readid2taxid = get_seqid2taxid(ref_content, (3, 2))
-    seqid2taxid = get_seqid2taxid(seqid2taxid)
-    taxid2taxid = {}
-    for seqid, taxid in kasa_readid2taxid.items():
-        real_taxid = seqid2taxid[seqid]
-        taxid2taxid[taxid] = real_taxid
-    return taxid2taxid
+
+def reformat(input_file, out_file, lookup, na_as_zero, binary):
+    from lib.input import open_input
+    from lib.readid2taxid import (
+        is_binary_readid2taxid,
+        load_readid2taxid,
+        write_readid2taxid,
+    )
+    from lib.remap import remap_readid2taxid, remap_taxids
+
+    # tsv to tsv streams, anything involving the binary format goes through the arrays
+    if not binary and not is_binary_readid2taxid(input_file):
+        with open_input(input_file, "rb") as f:
+            return remap_readid2taxid(f, out_file, lookup, na_as_zero)
+
+    table = load_readid2taxid(input_file, na_as_zero)
+    if lookup is not None:
+        table["taxids"] = remap_taxids(table["taxids"], lookup)
+    write_readid2taxid(table, out_file, binary)
+    return len(table["taxids"])
+
+
+def reformat_file(input_file, output_file, lookup, na_as_zero, binary):
+    # No output file writes to stdout, outputs ending in .gz or .zst are compressed
+    with BulkWriter(output_file) as out_file:
+        return reformat(input_file, out_file, lookup, na_as_zero, binary)
 
 
 def main():
@@ -59,22 +58,51 @@ def main():
         default=None,
         help="<ref_content.txt>,<seqid2taxid> -- ref_content.txt provided by kASA's database",
     )
-    parser.add_argument("file", help="read id to tax id file to reformat")
-    args = parser.parse_args()
-    krakenuniq_taxid2taxid = (
-        None
-        if args.krakenuniq_map is None
-        else get_krakenuniq_taxid2taxid(args.krakenuniq_map)
+    parser.add_argument(
+        "-b",
+        "--binary",
+        dest="binary",
+        action="store_true",
+        help="Write the binary readid2taxid format (inputs can be tsv or binary)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        default=None,
+        help="File to write to when reformatting one file (default is stdout), "
+        "compressed if it ends in .gz or .zst. Several files need '--output-directory' "
+        "or <input>=<output> pairs",
+    )
+    parser.add_argument(
+        "-O",
+        "--output-directory",
+        dest="output_directory",
+        default=None,
+        help="Write each input (or glob match) to a file of the same name in this directory",
     )
-    kasa_files = None
-    if args.kasa_map_and_seqid2taxid is not None:
-        split_files = list(args.kasa_map_and_seqid2taxid.split(","))
-        kasa_files = (split_files[0], split_files[1])
-    kasa_taxid2taxid = (
-        None
-        if args.kasa_map_and_seqid2taxid is None
-        else get_kasa_taxid2taxid(kasa_files[0], kasa_files[1])
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of files to reformat at the same time",
     )
+    add_metrics_arguments(parser)
+    parser.add_argument(
+        "files",
+        nargs="+",
+        help="read id to tax id file(s) to reformat, as files, globs or <input>=<output> pairs",
+    )
+    args = parser.parse_args()
+    batch = is_batch(args.files, args.output_directory)
+    if batch and args.output is not None:
+        parser.error(
+            "'--output' only applies to one input file, use '--output-directory' or "
+            "<input>=<output> pairs for several"
+        )
+
+    from lib.remap import load_lookup
 
     # Initialize event logger
     logging.basicConfig(
@@ -84,26 +112,37 @@ def main():
         datefmt="%m-%d-%Y %I:%M:%S%p",
     )
 
-    # Read the TSV/CSV
-    logging.info(f"Reformatting {args.file}")
-
-    with open(args.file, "r") as f:
-        for line in f.readlines():
-            line = list(line.strip().split("\t"))
-            readid = line[0]
-            value = line[1]
-            if args.clark and value == "NA":
-                value = "0"
-            elif krakenuniq_taxid2taxid is not None:
-                value = int(value)
-                if value > 1000000000:
-                    value = krakenuniq_taxid2taxid[value]
-                value = str(value)
-            elif kasa_taxid2taxid is not None:
-                value = int(value)
-                value = str(kasa_taxid2taxid[value])
-            print(f"{readid}\t{value}")
+    metrics = Metrics(args.metrics, args.profile)
+
+    # Load the translation table into lookup arrays
+    with metrics.stage("mapping load"):
+        lookup = load_lookup(args.krakenuniq_map, args.kasa_map_and_seqid2taxid)
+
+    # A single file without an output directory keeps writing to stdout (or '-o')
+    if not batch:
+        logging.info(f"Reformatting {args.files[0]}")
+        with metrics.stage("main loop") as stage:
+            total_lines = reformat_file(
+                args.files[0], args.output, lookup, args.clark, args.binary
+            )
+            stage["items"] = total_lines
+        metrics.close()
+        logging.info(f"Done reformatting {total_lines} lines!")
+        return
 
+    # Otherwise the translation table is shared by every file in the batch
+    pairs = get_input_output_pairs(args.files, args.output_directory)
+    logging.info(f"Reformatting {len(pairs)} files with {args.threads} workers")
+    with metrics.stage("main loop") as stage:
+        stage["items"] = run_batch(
+            reformat_file,
+            pairs,
+            args.threads,
+            lookup=lookup,
+            na_as_zero=args.clark,
+            binary=args.binary,
+        )
+    metrics.close()
     logging.info("Done reformatting!")
 
 
@@ -0,0 +1,98 @@
+import argparse
+import logging
+import sys
+
+from lib.metrics import Metrics, add_metrics_arguments
+from lib.names import load_name_index, log_resolution_report, resolve_names
+from lib.output import BulkWriter
+
+
+def main():
+    # Parse arguments from command line
+    parser = argparse.ArgumentParser(
+        description="Outputs a tsv name to tax id mapping for a list of organism names (one per line)"
+    )
+    parser.add_argument(
+        "-i",
+        "--ignore-case",
+        dest="ignore_case",
+        action="store_true",
+        help="Match names case-insensitively",
+    )
+    parser.add_argument(
+        "-n",
+        "--name-classes",
+        dest="name_classes",
+        default=None,
+        help="Comma separated names.dmp name classes to match (default is all, "
+        "e.g. 'scientific name,synonym')",
+    )
+    parser.add_argument(
+        "-r",
+        "--report",
+        dest="report",
+        default=None,
+        help="Write a tsv of every missing or ambiguous name and its candidates to this file",
+    )
+    parser.add_argument(
+        "--cache",
+        dest="cache",
+        default=None,
+        help="Location of the name index cache (default is next to names.dmp)",
+    )
+    add_metrics_arguments(parser)
+    parser.add_argument("taxonomy", help="NCBI taxonomy directory (with names.dmp)")
+    parser.add_argument("names", help="File with one organism name per line")
+    args = parser.parse_args()
+    name_classes = None if args.name_classes is None else args.name_classes.split(",")
+
+    # Initialize event logger
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.DEBUG,
+        format="[%(asctime)s %(threadName)s %(levelname)s] %(message)s",
+        datefmt="%m-%d-%Y %I:%M:%S%p",
+    )
+
+    metrics = Metrics(args.metrics, args.profile)
+
+    logging.info(f"Loading name index for {args.taxonomy}")
+    with metrics.stage("mapping load"):
+        name_index = load_name_index(args.taxonomy, args.cache)
+
+    with open(args.names, "r") as f:
+        names = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+
+    logging.info(f"Resolving {len(names)} names")
+    with metrics.stage("main loop") as stage:
+        name2taxid, report = resolve_names(
+            name_index, names, args.ignore_case, name_classes
+        )
+        stage["items"] = len(names)
+    with metrics.stage("output") as stage:
+        with BulkWriter() as out_file:
+            for name, taxid in name2taxid.items():
+                out_file.write_row(name, taxid)
+        stage["items"] = len(name2taxid)
+
+    if report:
+        logging.warning(f"{len(report)} of {len(names)} names could not be resolved")
+        if args.report is None:
+            log_resolution_report(report)
+        else:
+            with open(args.report, "w") as f:
+                f.write("name\tstatus\tcandidate_taxid\tcandidate_name\tname_class\n")
+                for name, problem in report.items():
+                    if not problem["candidates"]:
+                        f.write(f"{name}\t{problem['status']}\t\t\t\n")
+                    for taxid, matched_name, name_class in problem["candidates"]:
+                        f.write(
+                            f"{name}\t{problem['status']}\t{taxid}\t{matched_name}\t{name_class}\n"
+                        )
+
+    metrics.close()
+    logging.info("Done!")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,84 @@
 import argparse
 import logging
+import os
 import sys
 
+from lib.input import open_input
+from lib.metrics import Metrics, add_metrics_arguments
+from lib.output import BulkWriter, get_compression
+
+
+def load_rules(mapping_file):
+    file_name2taxid = {}
+    with open_input(mapping_file, "r") as f:
+        for line in f:
+            split_line = line.strip().split("\t")
+            if len(split_line) < 2:
+                continue
+            file_name, new_taxid = split_line[0], split_line[1]
+            if file_name in file_name2taxid and file_name2taxid[file_name] != new_taxid:
+                logging.error(
+                    f"{file_name} appeared twice with taxids {file_name2taxid[file_name]} and {new_taxid}"
+                )
+                logging.error(f"please fix this before running again - exiting")
+                sys.exit(1)
+            file_name2taxid[file_name] = new_taxid
+    return file_name2taxid
+
+
+def fix_taxids(in_file, out_file, file_name2taxid):
+    # One pass over the file, every rule is a dictionary lookup on the file name column
+    total_matched = dict.fromkeys(file_name2taxid, 0)
+    total_updated = dict.fromkeys(file_name2taxid, 0)
+    for line in in_file:
+        stripped_line = line.strip()
+        split_line = stripped_line.split("\t")
+        new_taxid = file_name2taxid.get(split_line[3])
+        if new_taxid is not None:
+            total_matched[split_line[3]] += 1
+            if split_line[2] != new_taxid:
+                split_line[2] = new_taxid
+                stripped_line = "\t".join(split_line)
+                total_updated[split_line[3]] += 1
+        out_file.write(stripped_line + "\n")
+    return total_matched, total_updated
+
 
 def main():
     # Parse arguments from command line
     parser = argparse.ArgumentParser(
-        description="Changes the taxid for a specific file in SKiM output"
+        description="Changes the taxid for specific files in SKiM output. "
+        "Run with '<file_name> <new_taxid> <tsv_file>' for one file or "
+        "'-m <mapping> <tsv_file>' for many"
+    )
+    parser.add_argument(
+        "-m",
+        "--mapping",
+        dest="mapping",
+        default=None,
+        help="Tab separated file name to new taxid, applied together in one pass",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        default=None,
+        help="Write to this file (atomically, once complete) instead of stdout "
+        "(compressed if it ends in .gz or .zst)",
+    )
+    add_metrics_arguments(parser)
+    parser.add_argument(
+        "arguments",
+        nargs="+",
+        metavar="[file_name new_taxid] tsv_file",
+        help="The file name to update, what to update the taxid to, and the TSV file to fix",
     )
-    parser.add_argument("file_name", help="The file name to update")
-    parser.add_argument("new_taxid", help="What to update the taxid to")
-    parser.add_argument("tsv_file", help="TSV file to fix")
     args = parser.parse_args()
+    if args.mapping is None and len(args.arguments) != 3:
+        parser.error("expected <file_name> <new_taxid> <tsv_file> or '-m <mapping>'")
+    if args.mapping is not None and len(args.arguments) != 1:
+        parser.error("expected only <tsv_file> with '-m <mapping>'")
+    tsv_file = args.arguments[-1]
 
     # Initialize event logger
     logging.basicConfig(
@@ -21,29 +88,52 @@ def main():
         datefmt="%m-%d-%Y %I:%M:%S%p",
     )
 
+    metrics = Metrics(args.metrics, args.profile)
+
+    if args.mapping is None:
+        file_name2taxid = {args.arguments[0]: args.arguments[1]}
+    else:
+        logging.info(f"Reading taxid updates from {args.mapping}")
+        with metrics.stage("mapping load") as stage:
+            file_name2taxid = load_rules(args.mapping)
+            stage["items"] = len(file_name2taxid)
+
     # Read the TSV/CSV
     logging.info(
-        f"Updating {args.file_name} to taxid {args.new_taxid} for {args.tsv_file}"
+        f"Updating {len(file_name2taxid)} file names to new taxids for {tsv_file}"
     )
 
-    total_updated = 0
-
-    with open(args.tsv_file, "r") as f:
-        for line in f:
-            stripped_line = line.strip()
-            split_line = list(stripped_line.split("\t"))
-            if split_line[3] == args.file_name:
-                if split_line[2] != args.new_taxid:
-                    print(
-                        f"{split_line[0]}\t{split_line[1]}\t{args.new_taxid}\t{split_line[3]}"
+    with metrics.stage("main loop") as stage, open_input(tsv_file, "r") as f:
+        if args.output is None:
+            with BulkWriter() as out_file:
+                total_matched, total_updated = fix_taxids(f, out_file, file_name2taxid)
+        else:
+            # Only replace the output once it has been completely written, and
+            # don't leave a partial temporary file behind on failure
+            temporary_output = args.output + ".tmp"
+            try:
+                with BulkWriter(
+                    temporary_output, get_compression(args.output)
+                ) as out_file:
+                    total_matched, total_updated = fix_taxids(
+                        f, out_file, file_name2taxid
                     )
-                    total_updated += 1
-                else:
-                    print(stripped_line)
-            else:
-                print(stripped_line)
+                os.replace(temporary_output, args.output)
+            except BaseException:
+                if os.path.exists(temporary_output):
+                    os.remove(temporary_output)
+                raise
+        stage["items"] = sum(total_matched.values())
 
-    logging.info(f"total updated tax ids: {str(total_updated)}")
+    for file_name, new_taxid in file_name2taxid.items():
+        if total_matched[file_name] == 0:
+            logging.warning(f"{file_name} did not appear in {tsv_file}")
+        else:
+            logging.info(
+                f"{file_name} -> {new_taxid}: {total_updated[file_name]} of {total_matched[file_name]} lines updated"
+            )
+    logging.info(f"total updated tax ids: {str(sum(total_updated.values()))}")
+    metrics.close()
 
     logging.info("Done!")
 
@@ -0,0 +1,55 @@
+import argparse
+import logging
+import os
+import sys
+
+from lib.metrics import Metrics, add_metrics_arguments
+
+
+def main():
+    # Parse arguments from command line
+    parser = argparse.ArgumentParser(
+        description="Converts an NCBI taxonomy directory to an array taxonomy file. Scripts "
+        "given the file instead of the directory memory map it instead of parsing nodes.dmp and "
+        "names.dmp, and every worker process shares the one copy"
+    )
+    add_metrics_arguments(parser)
+    parser.add_argument(
+        "taxonomy", help="NCBI taxonomy directory (with names.dmp and nodes.dmp)"
+    )
+    parser.add_argument("output", help="The array taxonomy file to write")
+    args = parser.parse_args()
+
+    from lib.arraytaxonomy import build_array_taxonomy
+
+    # Initialize event logger
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.DEBUG,
+        format="[%(asctime)s %(threadName)s %(levelname)s] %(message)s",
+        datefmt="%m-%d-%Y %I:%M:%S%p",
+    )
+
+    metrics = Metrics(args.metrics, args.profile)
+
+    logging.info(f"Reading taxonomy from directory {args.taxonomy}")
+    with metrics.stage("taxonomy load"):
+        try:
+            data = build_array_taxonomy(args.taxonomy)
+        except (OSError, ValueError) as e:
+            logging.error(f"can't convert {args.taxonomy}: {e}")
+            sys.exit(1)
+
+    logging.info(f"Writing {args.output}")
+    with metrics.stage("output"):
+        # Write to a temporary file and rename so a failed run never leaves a partial file
+        with open(args.output + ".tmp", "wb") as out_file:
+            out_file.write(data)
+        os.replace(args.output + ".tmp", args.output)
+    metrics.close()
+
+    logging.info("Done!")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,102 +2,101 @@ import argparse
 import logging
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
-from Bio import SeqIO
-from taxonomy.taxonomy import Taxonomy
-from lib.lib import load_accession2taxid
+from lib.lib import get_reference_files, load_accession2taxid, read_first_accession
+from lib.manifest import (
+    get_assembly_version,
+    get_taxor_lineage,
+    prefetch_taxor_lineages,
+)
+from lib.metrics import Metrics, add_metrics_arguments
+from lib.output import BulkWriter
 
 
 def main():
 
     # Parse arguments from command line
     parser = argparse.ArgumentParser(
-        description="Creates an input tsv file for taxor based on a reference database")
+        description="Creates an input tsv file for taxor based on a reference database"
+    )
     parser.add_argument(
-        "accession2taxid",
-        help="accession2taxid of reference file")
+        "-t", "--threads", type=int, default=14, help="Number of threads to use"
+    )
     parser.add_argument(
-        "reference_directory",
-        help="Directory containing reference fasta files")
+        "-o",
+        "--output",
+        dest="output",
+        default=None,
+        help="Write to this file instead of stdout (compressed if it ends in .gz or .zst)",
+    )
+    add_metrics_arguments(parser)
+    parser.add_argument("accession2taxid", help="accession2taxid of reference file")
     parser.add_argument(
-        "taxonomy",
-        help="NCBI taxonomy directory")
+        "reference_directory", help="Directory containing reference fasta files"
+    )
+    parser.add_argument("taxonomy", help="NCBI taxonomy directory")
     args = parser.parse_args()
 
+    from lib.lookup import load_taxonomy, prefetch_accessions
+
     # Initialize event logger
     logging.basicConfig(
         stream=sys.stderr,
         level=logging.DEBUG,
-        format='[%(asctime)s %(threadName)s %(levelname)s] %(message)s',
-        datefmt='%m-%d-%Y %I:%M:%S%p')
+        format="[%(asctime)s %(threadName)s %(levelname)s] %(message)s",
+        datefmt="%m-%d-%Y %I:%M:%S%p",
+    )
+
+    metrics = Metrics(args.metrics, args.profile)
 
     # Read taxonomy
     logging.info(f"Reading taxonomy from directory {args.taxonomy}")
-    taxonomy = Taxonomy.from_ncbi(args.taxonomy)
+    with metrics.stage("taxonomy load"):
+        taxonomy = load_taxonomy(args.taxonomy)
 
     # Read in accession2taxid
-    logging.info(
-        f"Reading accession2taxid at {args.accession2taxid}")
-    accession2taxid = load_accession2taxid(args.accession2taxid)
+    logging.info(f"Reading accession2taxid at {args.accession2taxid}")
+    with metrics.stage("mapping load") as stage:
+        accession2taxid = load_accession2taxid(args.accession2taxid)
+        stage["items"] = len(accession2taxid)
 
     logging.info(f"Collecting reference files from: {args.reference_directory}")
-    ref_files = map(
-        lambda x: os.path.realpath(
-            os.path.join(
-                args.reference_directory, x)), filter(
-            lambda y: y.endswith('.fna') or y.endswith('.fasta'), os.listdir(
-                args.reference_directory)))
-
-    logging.info("Getting lineage for all tax ids in the reference")
-    taxids_in_ref = set()
-    for taxid in accession2taxid.values():
-        taxids_in_ref.add(taxid)
-
-    levels = ["superkingdom", "phylum", "class", "order", "family", "genus", "species"]
-    taxid_to_lineage = {}
-    for taxid in taxids_in_ref:
-        organism_names = []
-        organism_taxids = []
-        for level in levels:
-            node = taxonomy.parent(str(taxid), at_rank=level)
-            if node is not None:
-                if level == "superkingdom":
-                    name = f"k__{node.name}"
-                else:
-                    name = f"{level[0]}__{node.name}"
-                organism_names.append(name)
-                organism_taxids.append(node.id)
-        taxid_to_lineage[taxid] = [organism_names, organism_taxids]
+    with metrics.stage("main loop") as stage:
+        ref_files = get_reference_files(args.reference_directory)
+
+        # Only the first header of each file is needed, read them all in parallel
+        logging.info("Reading the first accession of every reference file")
+        with ThreadPoolExecutor(args.threads) as executor:
+            accessions = list(executor.map(read_first_accession, ref_files))
+
+        # Build the lineage strings once per tax id found in the reference
+        logging.info("Getting lineage for all tax ids in the reference")
+        prefetch_accessions(accession2taxid, accessions)
+        taxids = dict.fromkeys(accession2taxid[accession] for accession in accessions)
+        prefetch_taxor_lineages(taxids, taxonomy)
+        taxid_to_lineage = {
+            taxid: get_taxor_lineage(taxid, taxonomy) for taxid in taxids
+        }
+        stage["items"] = len(ref_files)
 
     logging.info("Printing taxor reference strings")
-    for file in ref_files:
-        file_name_with_extension = os.path.basename(file)
-
-        taxid = accession2taxid[next(SeqIO.parse(file, 'fasta')).id.split(".")[0]]
-        lineage = taxid_to_lineage[taxid]
-        lineage_names = lineage[0]
-        lineage_taxids = lineage[1]
-        # Update taxid to the lowest available taxid
-        taxid = lineage_taxids[-1]
-
-        lineage_names_str = lineage_names[0]
-        for lineage_name in lineage_names[1:]:
-            lineage_names_str += f";{lineage_name}"
-
-        lineage_taxid_str = lineage_taxids[0]
-        for lineage_taxid in lineage_taxids[1:]:
-            lineage_taxid_str += f";{lineage_taxid}"
-
-        assembly_version = ""
-        if "_" in file_name_with_extension:
-            file_split = file_name_with_extension.split("_")
-            assembly_version = file_split[0] + "_" + file_split[1]
-        else:
-            assembly_version = file_name_with_extension.split(".")[0]
-
-        print(f"{assembly_version}\t{taxid}\t/{file_name_with_extension}\t{lineage_names[-1].split('_')[2:][0]}\t{lineage_names_str}\t{lineage_taxid_str}")
-
-
-if __name__ == '__main__':
+    with metrics.stage("output") as stage:
+        out_file = BulkWriter(args.output)
+        for file, accession in zip(ref_files, accessions):
+            file_name_with_extension = os.path.basename(file)
+            lowest_taxid, lowest_name, lineage_names_str, lineage_taxid_str = (
+                taxid_to_lineage[accession2taxid[accession]]
+            )
+            assembly_version = get_assembly_version(file_name_with_extension)
+
+            out_file.write(
+                f"{assembly_version}\t{lowest_taxid}\t/{file_name_with_extension}\t{lowest_name}\t{lineage_names_str}\t{lineage_taxid_str}\n"
+            )
+        out_file.close()
+        stage["items"] = len(ref_files)
+    metrics.close()
+
+
+if __name__ == "__main__":
     main()
-
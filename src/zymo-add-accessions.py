@@ -1,27 +1,112 @@
 import argparse
 import logging
+import os
 import sys
-from functools import reduce
+from multiprocessing.pool import Pool
 
-from Bio import SeqIO
-from taxonomy.taxonomy import Taxonomy
+from lib.metrics import Metrics, add_metrics_arguments
+from lib.names import load_name_index, log_resolution_report, resolve_names
+
+CHUNK_SIZE = 16 * 1024 * 1024
 
 
 def get_postfix(num: int) -> str:
-    id_postfix = str(num)
-    while len(id_postfix) < 6:
-        id_postfix = "0" + id_postfix
-    id_postfix += ".1"
-    return id_postfix
+    return f"{num:06d}.1"
+
+
+def get_genus_species(fasta_file):
+    # Reference files are named <genus>_<species>_...
+    split_input_file = os.path.basename(fasta_file).split("_")
+    return split_input_file[0], split_input_file[1]
+
+
+def get_output_file_prefix(fasta_file):
+    genus, species = get_genus_species(fasta_file)
+    return os.path.join(
+        os.path.dirname(fasta_file), genus + "_" + species + "_formatted"
+    )
+
+
+def find_header(chunk, position):
+    # Chunks always start at the beginning of a line
+    if position == 0 and chunk.startswith(b">"):
+        return 0
+    index = chunk.find(b"\n>", max(position - 1, 0))
+    return -1 if index == -1 else index + 1
+
+
+def rewrite_headers(in_file, out_file, id_prefix):
+    # Copy the sequence lines through untouched, only the header lines are rewritten
+    new_ids = []
+    with open(in_file, "rb") as f, open(out_file, "wb", buffering=CHUNK_SIZE) as out:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            # Finish the current line so headers never span two chunks
+            chunk += f.readline()
+            view = memoryview(chunk)
+
+            position = 0
+            while True:
+                header_start = find_header(chunk, position)
+                if header_start == -1:
+                    out.write(view[position:])
+                    break
+                header_end = chunk.find(b"\n", header_start)
+                header_end = len(chunk) if header_end == -1 else header_end + 1
+
+                out.write(view[position:header_start])
+                new_id = id_prefix + "_" + get_postfix(len(new_ids) + 1)
+                new_ids.append(new_id)
+                out.write(b">" + new_id.encode() + b" ")
+                out.write(view[header_start + 1 : header_end])
+                position = header_end
+    return new_ids
+
+
+def add_accessions(fasta_file, tax_id):
+    genus, species = get_genus_species(fasta_file)
+    output_file_prefix = get_output_file_prefix(fasta_file)
+    new_ids = rewrite_headers(
+        fasta_file, output_file_prefix + ".fasta", genus[0] + species[0]
+    )
+    with open(output_file_prefix + ".accession2taxid", "w") as accession2taxid:
+        accession2taxid.writelines(f"{new_id}\t{tax_id}\n" for new_id in new_ids)
+    return fasta_file, new_ids
 
 
 def main():
     # Parse arguments from command line
     parser = argparse.ArgumentParser(
-        description="Takes a reference and adds accessions to the records"
+        description="Takes references and adds accessions to the records. "
+        "Each <genus>_<species>_... input writes <genus>_<species>_formatted.fasta and "
+        ".accession2taxid next to it"
+    )
+    parser.add_argument(
+        "-t", "--threads", type=int, default=14, help="Number of processes to use"
+    )
+    parser.add_argument(
+        "-a",
+        "--accession2taxid",
+        dest="combined_accession2taxid",
+        default=None,
+        help="Also write one accession2taxid for all of the inputs to this file",
+    )
+    parser.add_argument(
+        "-i",
+        "--ignore-case",
+        dest="ignore_case",
+        action="store_true",
+        help="Match species names case-insensitively",
     )
+    add_metrics_arguments(parser)
     parser.add_argument("taxonomy", help="NCBI taxonomy directory")
-    parser.add_argument("fasta_file", help="The reference fasta file")
+    parser.add_argument(
+        "fasta_files",
+        nargs="+",
+        help="The reference fasta files (or directories containing them)",
+    )
     args = parser.parse_args()
 
     # Initialize event logger
@@ -32,53 +117,86 @@ def main():
         datefmt="%m-%d-%Y %I:%M:%S%p",
     )
 
-    # Read taxonomy
-    logging.info(f"Reading taxonomy from directory {args.taxonomy}")
-    taxonomy = Taxonomy.from_ncbi(args.taxonomy)
-    logging.info("Taxonomy read!")
-
-    # Create output file name
-    split_input_file = args.fasta_file.split("/")[-1].split("_")
-    genus = split_input_file[0]
-    species = split_input_file[1]
-    id_prefix = genus[0] + species[0]
-    id_number = 1
-    output_file_prefix = (
-        reduce(lambda acc, x: acc + "/" + x, args.fasta_file.split("/")[:-1])
-        + "/"
-        + genus
-        + "_"
-        + species
-        + "_formatted"
+    metrics = Metrics(args.metrics, args.profile)
+
+    # Collect the input files, skipping outputs of previous runs
+    fasta_files = []
+    for path in args.fasta_files:
+        if os.path.isdir(path):
+            fasta_files.extend(
+                sorted(
+                    os.path.join(path, file_name)
+                    for file_name in os.listdir(path)
+                    if (file_name.endswith(".fna") or file_name.endswith(".fasta"))
+                    and not file_name.endswith("_formatted.fasta")
+                )
+            )
+        else:
+            fasta_files.append(path)
+
+    # Make sure no two inputs would write the same output file or the same accessions
+    output_file_prefixes = {}
+    id_prefixes = {}
+    for fasta_file in fasta_files:
+        genus, species = get_genus_species(fasta_file)
+        output_file_prefixes.setdefault(get_output_file_prefix(fasta_file), []).append(
+            fasta_file
+        )
+        id_prefixes.setdefault(genus[0] + species[0], set()).add(genus + " " + species)
+    duplicate_outputs = {k: v for k, v in output_file_prefixes.items() if len(v) > 1}
+    duplicate_ids = {k: v for k, v in id_prefixes.items() if len(v) > 1}
+    if duplicate_outputs or duplicate_ids:
+        for output_file_prefix, inputs in duplicate_outputs.items():
+            logging.error(f"{inputs} would all write to '{output_file_prefix}'")
+        for id_prefix, names in duplicate_ids.items():
+            logging.error(f"{sorted(names)} would all get accessions '{id_prefix}_...'")
+        sys.exit(1)
+
+    # Load the names.dmp index instead of the whole taxonomy
+    logging.info(f"Loading name index for {args.taxonomy}")
+    with metrics.stage("mapping load"):
+        name_index = load_name_index(args.taxonomy)
+
+    # Get the tax id of every species once, up front
+    names = sorted(set(" ".join(get_genus_species(x)) for x in fasta_files))
+    logging.info(f"Resolving tax ids for {len(names)} species")
+    name2taxid, report = resolve_names(
+        name_index, names, args.ignore_case, ["scientific name", "synonym"]
     )
-    logging.info(f"Will write to files with prefix '{output_file_prefix}'")
+    if report:
+        logging.error(f"{len(report)} species didn't resolve to exactly 1 tax id")
+        log_resolution_report(report)
+        sys.exit(1)
 
-    # Get tax id of all records
-    potential_nodes = taxonomy.find_all_by_name(genus + " " + species)
-    if len(potential_nodes) != 1:
-        logging.error(
-            f"{genus} {species} didn't return exactly 1 node, don't know what to do"
+    # Rewrite the reference fasta files and create an accession2taxid for each
+    logging.info(f"Looping through {len(fasta_files)} reference files")
+    with metrics.stage("main loop") as stage, Pool(args.threads) as pool:
+        results = pool.starmap(
+            add_accessions,
+            [
+                (fasta_file, name2taxid[" ".join(get_genus_species(fasta_file))])
+                for fasta_file in fasta_files
+            ],
         )
-        logging.error(f"The following nodes were found: {potential_nodes}")
-        sys.exit()
-    else:
-        tax_node = potential_nodes[0]
-        tax_id = tax_node.id
-
-    # Read the reference fasta file and create a new fasta file and
-    # accession2taxid for the new file
-    logging.info(f"Looping through reference file at {args.fasta_file}")
-    fasta_file = SeqIO.parse(args.fasta_file, "fasta")
-    with open(output_file_prefix + ".fasta", "w") as out_file_handle:
-        with open(output_file_prefix + ".accession2taxid", "w") as accession2taxid:
-            for record in fasta_file:
-                id_postfix = get_postfix(id_number)
-                id_number += 1
-                record.id = id_prefix + "_" + id_postfix
-                record.description = record.id + " " + record.description
-                accession2taxid.write(f"{record.id}\t{tax_id}\n")
-                SeqIO.write(record, out_file_handle, "fasta")
-            logging.info("Done reading through reference!")
+        stage["items"] = len(fasta_files)
+    for fasta_file, new_ids in results:
+        logging.info(
+            f"Wrote {len(new_ids)} records from {fasta_file} to '{get_output_file_prefix(fasta_file)}'"
+        )
+
+    if args.combined_accession2taxid is not None:
+        logging.info(f"Writing all accessions to {args.combined_accession2taxid}")
+        with metrics.stage("output"), open(
+            args.combined_accession2taxid, "w"
+        ) as accession2taxid:
+            for fasta_file, new_ids in results:
+                tax_id = name2taxid[" ".join(get_genus_species(fasta_file))]
+                accession2taxid.writelines(
+                    f"{new_id}\t{tax_id}\n" for new_id in new_ids
+                )
+    metrics.close()
+
+    logging.info("Done reading through references!")
 
 
 if __name__ == "__main__":